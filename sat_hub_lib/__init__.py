@@ -1,4 +1,4 @@
-from .extension import GProx
+from .extension import GProx, GProxBatch
 from .geotiff import Local_GeoTiff
 from .geotiff.s3 import S3_EsaWorldCover, ESAWC_MAPCODE
 from .sentinel import (
@@ -7,12 +7,14 @@ from .sentinel import (
     SAT_LANDCOVER_MAPCODE,
     STemp,
     NDVI,
+    Composite,
     SentinelBaseSettings,
 )
 from .utils.geotiff_lib import tiff_to_png
 
 __all__ = [
     "GProx",
+    "GProxBatch",
     "Local_GeoTiff",
     "S3_EsaWorldCover",
     "ESAWC_MAPCODE",
@@ -21,6 +23,7 @@ __all__ = [
     "SAT_LANDCOVER_MAPCODE",
     "STemp",
     "NDVI",
+    "Composite",
     "SentinelBaseSettings",
     "tiff_to_png",
 ]
@@ -5,6 +5,7 @@ from shapely import Polygon
 from shapely.geometry import Point
 import logging
 import rasterio
+import sat_hub_lib.utils.geotiff_lib as geotiff_lib
 
 
 class BaseProduct(ABC):
@@ -14,9 +15,11 @@ class BaseProduct(ABC):
     #     #self.output_file = None
     #     self.log = logging.getLogger(type(self).__name__)
 
-    def __init__(self, ouput_file: str = None):
+    def __init__(self, ouput_file: str = None, output_profile=None):
         self.__output_file_path = self._gen_output_filepath(ouput_file)
         self.log = logging.getLogger(type(self).__name__)
+        # Creation options of the GeoTIFF outputs, see geotiff_lib.OUTPUT_PROFILES
+        self.output_profile = output_profile
 
     @abstractmethod
     def write_geotiff(self, output_file: str = None):
@@ -73,6 +76,21 @@ class BaseProduct(ABC):
             os.makedirs(os.path.dirname(self.__output_file_path), exist_ok=True)
         return self.__output_file_path
 
+    def _get_colormap(self):
+        """
+        Returns the colormap written to the first band of the GeoTIFF outputs, None for no colormap.
+        """
+        return None
+
+    def _write_bands(self, output_file: str, data, meta: dict):
+        """
+        Writes a [bands, rows, cols] matrix to a GeoTIFF file with the output profile and the colormap of the product.
+        """
+        with geotiff_lib.open_output_geotiff(
+            output_file, meta, self.output_profile, self._get_colormap()
+        ) as dst:
+            dst.write(data)
+
     def _default_rasterio_preprocess(self, geotiff):
         self.geotiff_meta = geotiff.meta
         self.geotiff_trasform = geotiff.transform
@@ -112,8 +130,14 @@ class BaseSatType(BaseProduct):
     #     self.geotiff_trasform = None
     #     self.geotiff_meta = None
 
-    def __init__(self, point1: tuple, point2: tuple, ouput_file: str = None):
-        super().__init__(ouput_file)
+    def __init__(
+        self,
+        point1: tuple,
+        point2: tuple,
+        ouput_file: str = None,
+        output_profile=None,
+    ):
+        super().__init__(ouput_file, output_profile)
 
         lat1, lon1 = point1
         lat2, lon2 = point2
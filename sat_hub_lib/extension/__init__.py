@@ -1,3 +1,4 @@
 from .gprox import GProx, IsMappable
+from .gprox_batch import GProxBatch
 
-__all__ = ["GProx, IsMappable"]
+__all__ = ["GProx", "GProxBatch", "IsMappable"]
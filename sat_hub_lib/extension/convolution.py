@@ -0,0 +1,263 @@
+"""
+The "same" convolutions of GProx and the selection of the fastest method for a raster and a kernel.
+All the methods return the output of signal.fftconvolve(image, kernel, mode="same"), up to rounding:
+    - direct: the sum over the kernel cells, for the small kernels.
+    - separable: two 1-D convolutions, for the rank 1 kernels, e.g. "exp(-(x/r)**2)".
+    - summed_area: a few rectangle sums of a summed-area table, for the flat kernels whose rows are runs, e.g. "1".
+      The square kernel of "1" is a single rectangle, its cost does not depend on the radius.
+    - fft: the FFT convolution, for the large kernels.
+"""
+
+import logging
+import time
+import numpy as np
+from scipy import fft, signal
+
+log = logging.getLogger(__name__)
+
+METHODS = ("direct", "separable", "summed_area", "fft")
+
+# Relative costs of the operations of the methods, measured with benchmark()
+_DIRECT_COST = 1.6  # per pixel and kernel cell
+_SEPARABLE_COST = 1.3  # per pixel and kernel row or column
+_SUMMED_AREA_COST = 5.0  # per pixel and rectangle
+_FFT_COST = 1.0  # per padded pixel and log2 of the padded size
+
+
+def convolve_same(image: np.ndarray, kernel: np.ndarray, method: str = "auto"):
+    """
+    Convolves the image with the kernel, the output has the shape of the image.
+    Args:
+        image (np.ndarray): The [rows, cols] float image.
+        kernel (np.ndarray): The [rows, cols] kernel.
+        method (str, optional): One of METHODS, or "auto" for choose_method. Defaults to "auto".
+    Returns:
+        np.ndarray: The [rows, cols] convolution.
+    Raises:
+        ValueError: If the method is unknown or does not apply to the kernel.
+    """
+    if method == "auto":
+        method = choose_method(image.shape, kernel)
+    start = time.perf_counter()
+    if method == "direct":
+        result = _convolve_direct(image, kernel)
+    elif method == "separable":
+        result = _convolve_separable(image, kernel)
+    elif method == "summed_area":
+        result = _convolve_summed_area(image, kernel)
+    elif method == "fft":
+        result = signal.fftconvolve(image, kernel, mode="same")
+    else:
+        raise ValueError(
+            f"Unknown convolution method {method}, expected one of {METHODS}"
+        )
+    log.debug(
+        f"Convolution {image.shape} x {kernel.shape} with method {method} took "
+        f"{time.perf_counter() - start:.3f} s"
+    )
+    return result
+
+
+def choose_method(shape: tuple, kernel: np.ndarray) -> str:
+    """
+    Returns the method of the lowest estimated cost for an image of the given shape and the kernel.
+    """
+    return min(_estimate_costs(shape, kernel).items(), key=lambda item: item[1])[0]
+
+
+def _estimate_costs(shape: tuple, kernel: np.ndarray) -> dict:
+    pixels = shape[0] * shape[1]
+    costs = {"direct": _DIRECT_COST * pixels * np.count_nonzero(kernel)}
+    if _get_separable_factors(kernel) is not None:
+        costs["separable"] = _SEPARABLE_COST * pixels * sum(kernel.shape)
+    rectangles = _get_flat_rectangles(kernel)
+    if rectangles is not None:
+        costs["summed_area"] = _SUMMED_AREA_COST * pixels * (len(rectangles) + 1)
+    padded_rows = fft.next_fast_len(shape[0] + kernel.shape[0] - 1, True)
+    padded_cols = fft.next_fast_len(shape[1] + kernel.shape[1] - 1, True)
+    padded = padded_rows * padded_cols
+    costs["fft"] = _FFT_COST * padded * np.log2(padded)
+    return costs
+
+
+def _get_separable_factors(kernel: np.ndarray):
+    """
+    Returns the (column, row) vectors whose outer product is the kernel, None if the kernel is not rank 1.
+    """
+    pivot_row, pivot_col = np.unravel_index(np.argmax(np.abs(kernel)), kernel.shape)
+    pivot = kernel[pivot_row, pivot_col]
+    if pivot == 0:
+        return None
+    column = kernel[:, pivot_col] / pivot
+    row = kernel[pivot_row, :]
+    atol = 1e-12 * abs(pivot)
+    if not np.allclose(np.outer(column, row), kernel, rtol=1e-10, atol=atol):
+        return None
+    return column, row
+
+
+def _get_flat_rectangles(kernel: np.ndarray):
+    """
+    Splits a flat kernel, whose non zero cells share one value and form a run on every row, into rectangles.
+    Returns:
+        list: The (row_start, row_stop, col_start, col_stop, value) rectangles, None if the kernel is not flat.
+    """
+    nonzero = kernel != 0
+    values = kernel[nonzero]
+    if values.size == 0 or not np.allclose(values, values[0], rtol=1e-12, atol=0):
+        return None
+
+    rectangles = []
+    for row in range(kernel.shape[0]):
+        cols = np.flatnonzero(nonzero[row])
+        if cols.size == 0:
+            continue
+        if cols[-1] - cols[0] + 1 != cols.size:
+            return None
+        run = (cols[0], cols[-1] + 1)
+        # Merge the consecutive rows with the same run
+        last = rectangles[-1] if rectangles else None
+        if last is not None and last[1] == row and tuple(last[2:4]) == run:
+            last[1] = row + 1
+        else:
+            rectangles.append([row, row + 1, run[0], run[1], values[0]])
+    return [tuple(rectangle) for rectangle in rectangles]
+
+
+def _accumulate_shifted(result: np.ndarray, image: np.ndarray, weight, shift: tuple):
+    """
+    Adds weight * image[i + row_shift, j + col_shift] to result[i, j], the image is zero outside its bounds.
+    """
+    rows, cols = image.shape
+    row_shift, col_shift = shift
+    if abs(row_shift) >= rows or abs(col_shift) >= cols:
+        return
+    out_rows = slice(max(0, -row_shift), rows - max(0, row_shift))
+    out_cols = slice(max(0, -col_shift), cols - max(0, col_shift))
+    in_rows = slice(max(0, row_shift), rows + min(0, row_shift))
+    in_cols = slice(max(0, col_shift), cols + min(0, col_shift))
+    result[out_rows, out_cols] += weight * image[in_rows, in_cols]
+
+
+def _convolve_direct(image: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    # The output pixel i sums the image pixels i + c - p for the kernel cells p, c = (k - 1) // 2
+    center_row = (kernel.shape[0] - 1) // 2
+    center_col = (kernel.shape[1] - 1) // 2
+    result = np.zeros(image.shape)
+    for row, col in zip(*np.nonzero(kernel)):
+        _accumulate_shifted(
+            result, image, kernel[row, col], (center_row - row, center_col - col)
+        )
+    return result
+
+
+def _convolve_separable(image: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    factors = _get_separable_factors(kernel)
+    if factors is None:
+        raise ValueError("The separable method requires a rank 1 kernel")
+    column, row = factors
+    center_row = (kernel.shape[0] - 1) // 2
+    center_col = (kernel.shape[1] - 1) // 2
+    columns_result = np.zeros(image.shape)
+    for index in np.flatnonzero(column):
+        _accumulate_shifted(
+            columns_result, image, column[index], (center_row - index, 0)
+        )
+    result = np.zeros(image.shape)
+    for index in np.flatnonzero(row):
+        _accumulate_shifted(
+            result, columns_result, row[index], (0, center_col - index)
+        )
+    return result
+
+
+def _convolve_summed_area(image: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    rectangles = _get_flat_rectangles(kernel)
+    if rectangles is None:
+        raise ValueError(
+            "The summed_area method requires a flat kernel with one run per row"
+        )
+    rows, cols = image.shape
+    kernel_rows, kernel_cols = kernel.shape
+    summed_area = np.zeros((rows + 1, cols + 1))
+    np.cumsum(np.cumsum(image, axis=0), axis=1, out=summed_area[1:, 1:])
+    # Repeating the first and last rows and columns clamps the corners of the rectangles to the image
+    summed_area = np.pad(
+        summed_area, ((kernel_rows, kernel_rows), (kernel_cols, kernel_cols)), "edge"
+    )
+
+    # The output pixel i sums the image rows i + c - p for the kernel rows p, c = (k - 1) // 2, so the rectangle
+    # of kernel rows [start, stop) covers the image rows [i + c + 1 - stop, i + c + 1 - start)
+    center_row = (kernel_rows - 1) // 2 + 1 + kernel_rows
+    center_col = (kernel_cols - 1) // 2 + 1 + kernel_cols
+    result = np.zeros(image.shape)
+    for row_start, row_stop, col_start, col_stop, value in rectangles:
+        top = center_row - row_stop
+        bottom = center_row - row_start
+        left = center_col - col_stop
+        right = center_col - col_start
+        upper = summed_area[bottom : bottom + rows] - summed_area[top : top + rows]
+        result += value * (
+            upper[:, right : right + cols] - upper[:, left : left + cols]
+        )
+    return result
+
+
+def benchmark(
+    shape: tuple = (2000, 2000),
+    radii: tuple = (10, 20, 50, 100, 200, 500, 1000),
+    functions: tuple = ("1-(x/r)**o", "exp(-(x/r)**2)", "1"),
+    resolution=10,
+    max_seconds: float = 10,
+) -> list:
+    """
+    Times every applicable method against the chosen one on a random binary raster.
+    The slow methods are skipped at the larger radii once a run exceeds max_seconds.
+    Args:
+        shape (tuple, optional): The (rows, cols) shape of the raster. Defaults to (2000, 2000).
+        radii (tuple, optional): The radii in meters. Defaults to (10, 20, 50, 100, 200, 500, 1000).
+        functions (tuple, optional): The kernel expressions, see kernels.get_kernel.
+        resolution (int | tuple, optional): The resolution of the raster in meters. Defaults to 10.
+        max_seconds (float, optional): The time after which a method is skipped. Defaults to 10.
+    Returns:
+        list: A dict per function, radius and method with the kernel shape, the seconds and whether the method
+              is the chosen one.
+    """
+    from sat_hub_lib.extension import kernels
+
+    image = (np.random.default_rng(0).random(shape) < 0.3).astype(float)
+    results = []
+    for function in functions:
+        too_slow = set()
+        for radius in radii:
+            kernel = kernels.get_kernel(function, radius, 1, resolution)
+            chosen = choose_method(shape, kernel)
+            for method in _estimate_costs(shape, kernel):
+                if method in too_slow:
+                    continue
+                start = time.perf_counter()
+                convolve_same(image, kernel, method)
+                seconds = time.perf_counter() - start
+                if seconds > max_seconds:
+                    too_slow.add(method)
+                results.append(
+                    {
+                        "function": function,
+                        "radius": radius,
+                        "kernel_shape": kernel.shape,
+                        "method": method,
+                        "seconds": seconds,
+                        "chosen": method == chosen,
+                    }
+                )
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark():
+        chosen = " *" if result["chosen"] else ""
+        print(
+            f"{result['function']:>16} {result['radius']:>5} m "
+            f"{str(result['kernel_shape']):>12} {result['method']:>12} "
+            f"{result['seconds']:9.4f} s{chosen}"
+        )
@@ -1,10 +1,15 @@
 from abc import ABC, abstractmethod
 import datetime
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import rasterio
-from scipy import signal
-import sympy as sp
+from rasterio.windows import Window
 from sat_hub_lib.baseproducts import BaseSatType, BaseProduct
+from sat_hub_lib.extension import convolution, kernels
+import sat_hub_lib.utils.geotiff_lib as geotiff_lib
 
 
 class IsMappable(ABC):
@@ -14,7 +19,75 @@ class IsMappable(ABC):
         raise NotImplementedError
 
 
-class GProx(BaseProduct):
+def map_values(matrix: np.ndarray, value_map) -> np.ndarray:
+    """
+    Maps the values of the product matrix to the float weights of the target classes.
+    Args:
+        matrix (np.ndarray): The [rows, cols] matrix of the product.
+        value_map (dict | int): The weight of each target value, or the single target value (weight 1).
+    Returns:
+        np.ndarray: The [rows, cols] float matrix of the weights, 0 for the other values.
+    Raises:
+        ValueError: If the value map type is unsupported.
+    """
+    if isinstance(value_map, dict):
+        # Create a matrix with the target values mapped to integers.
+        target_matrix = np.zeros_like(matrix, dtype=float)
+        for value, target in value_map.items():
+            target_matrix[matrix == value] = target
+    elif isinstance(value_map, int):
+        # Create a binary matrix: 1 where the matrix equals value_map, 0 otherwise.
+        target_matrix = (matrix == value_map).astype(float)
+    else:
+        raise ValueError("Unsupported value map type")
+    return target_matrix
+
+
+class BaseGProx(BaseProduct):
+    """
+    The output file path, colormap and default value map shared by GProx and GProxBatch.
+    """
+
+    def _get_default_value_map(self):
+        """
+        Returns the default value map of the product.
+        Raises:
+            ValueError: If the product does not have a default value map.
+        """
+        if getattr(self.product, "get_default_value_map", None) is None:
+            raise ValueError(
+                f"Value map {self.product.__class__.__name__} is not provided and the product does not have a default value map."
+            )
+        return self.product.get_default_value_map()
+
+    def _get_colormap(self):
+        # Create a green gradient colormap
+        return {i: (0, i, 0, 255) for i in range(256)}
+
+    def _gen_output_filepath(self, out_filepath):
+        """
+        Generates an output file path based on the provided template or class name.
+
+        Args:
+            outfolder (str): The template for the output file path. If it contains
+                             the placeholder "*date_time*", it will be replaced with
+                             the current date and time in the format "YYYY-MM-DD_HH-MM-SS".
+                             If None, the output file path will be generated using
+                             the class name, the product class name and the current date and time.
+
+        Returns:
+            str: The generated output file path.
+        """
+        time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        if out_filepath is not None:
+            return out_filepath.replace("*date_time*", time)
+        else:
+            className = type(self.product).__name__
+            # Default to use output folder
+            return f"output/{type(self).__name__}_{className}_{time}.tif"
+
+
+class GProx(BaseGProx):
 
     # def __init__(self, product: BaseSatType, config):
     #     super().__init__(config)
@@ -37,6 +110,10 @@ class GProx(BaseProduct):
         omega=1,
         function="1-(x/r)**o",
         output_filepath: str = None,
+        output_profile=None,
+        tile_size: int = None,
+        max_workers: int = None,
+        convolution_method: str = "auto",
     ):
         """
         Initialize the Gprox class.
@@ -47,51 +124,82 @@ class GProx(BaseProduct):
             omega (int, optional): The omega value for the function. Defaults to 1.
             function (str, optional): The function to be used. Defaults to '1-(x/r)**o'.
             output_filepath (str, optional): The file path for the output. Defaults to None.
+            output_profile (str | dict, optional): The profile of the GeoTIFF output, see geotiff_lib.OUTPUT_PROFILES.
+                                                   Defaults to None (plain GeoTIFF).
+            tile_size (int, optional): Compute the matrix in blocks of tile_size x tile_size pixels, each convolved
+                                       with a halo of the kernel radius, so the working memory of the convolutions
+                                       depends on the tile size instead of the raster size. write_geotiff then
+                                       holds only the product matrix and one strip of blocks of the output.
+                                       Defaults to None (whole raster at once).
+            max_workers (int, optional): The number of blocks computed in parallel. Defaults to the number of CPUs.
+            convolution_method (str, optional): The convolution method, one of convolution.METHODS, or "auto" for the
+                                                fastest one for the raster and the kernel. Defaults to "auto".
         Raises:
-            ValueError: If value_map is not provided and the product does not have a default value map.
+            ValueError: If value_map is not provided and the product does not have a default value map, or the
+                        convolution method is unknown.
         """
         self.product = product
-        super().__init__(output_filepath)
+        super().__init__(output_filepath, output_profile)
         self.meter_radius = meter_radius
         self.value_map = value_map
         self.matrix = None
         self.omega = omega
         self.function = function
+        self.tile_size = tile_size
+        self.max_workers = max_workers or os.cpu_count() or 1
+        if convolution_method not in ("auto",) + convolution.METHODS:
+            raise ValueError(
+                f"Unknown convolution method {convolution_method}, "
+                f"expected one of {convolution.METHODS}"
+            )
+        self.convolution_method = convolution_method
 
         if self.value_map is None:
-            if self.product.get_default_value_map is not None:
-                self.value_map = self.product.get_default_value_map()
-            else:
-                raise ValueError(
-                    f"Value map {self.product.__class__.__name__} is not provided and the product does not have a default value map."
-                )
+            self.value_map = self._get_default_value_map()
 
     def write_geotiff(self, output_file: str = None):
         if output_file is None:
             output_file = self.get_output_file_path()
 
-        matrix = self.extract_bandmatrix()
-        with rasterio.open(output_file, "w", **self.product.geotiff_meta) as dst:
-            dst.write(matrix.astype(rasterio.uint8), 1)
-            dst.meta.update(
-                {
-                    "driver": "GTiff",
-                    "height": matrix.shape[0],
-                    "width": matrix.shape[1],
-                    "transform": self.product.geotiff_trasform,
-                    "count": 1,
-                    "dtype": rasterio.uint8,
-                }
+        if self.tile_size is None:
+            matrix = self.extract_bandmatrix()
+            meta = self._get_output_meta(matrix.shape)
+            self._write_bands(
+                output_file, matrix[np.newaxis].astype(rasterio.uint8), meta
             )
-        # Create a green gradient colormap
-        color_map = {i: (0, i, 0, 255) for i in range(256)}
-
-        # Write the colormap
-        with rasterio.open(output_file, "r+") as src:
-            src.write_colormap(1, color_map)
+        else:
+            # Stream the blocks into the GeoTIFF as they are computed, only one strip of blocks is held at once.
+            # The strips are full width and written top to bottom, so a compressed output never rewrites a block.
+            matrix = self.product.extract_bandmatrix()[0]
+            meta = self._get_output_meta(matrix.shape)
+            width = matrix.shape[1]
+            with geotiff_lib.open_output_geotiff(
+                output_file, meta, self.output_profile, self._get_colormap()
+            ) as dst:
+                for (row_off, col_off), block in self.iter_blocks(matrix):
+                    rows, cols = block.shape
+                    if col_off == 0:
+                        strip = np.empty((rows, width), dtype=rasterio.uint8)
+                    strip[:, col_off : col_off + cols] = block
+                    if col_off + cols == width:
+                        dst.write(strip, 1, window=Window(0, row_off, width, rows))
         self.log.info("Matrix written to GeoTIFF at " + output_file)
 
-    def extract_bandmatrix(self):
+    def _get_output_meta(self, shape: tuple) -> dict:
+        meta = self.product.geotiff_meta.copy()
+        meta.update(
+            {
+                "driver": "GTiff",
+                "height": shape[0],
+                "width": shape[1],
+                "transform": self.product.geotiff_trasform,
+                "count": 1,
+                "dtype": rasterio.uint8,
+            }
+        )
+        return meta
+
+    def extract_bandmatrix(self, out: np.ndarray = None):
         """
         Extracts a percentage matrix based on the target values and a circular kernel.
         This method performs the following steps:
@@ -100,10 +208,13 @@ class GProx(BaseProduct):
         3. Creates a circular kernel based on the product's resolution type (either integer or tuple).
         4. Parses a function expression to generate the kernel values.
         5. Maps the target values to a matrix.
-        6. Convolves the target matrix with the kernel using FFT to count target occurrences.
-        7. Convolves a ones matrix with the kernel to count total valid cells per pixel neighborhood.
+        6. Convolves the target matrix with the kernel to count target occurrences, see convolution.convolve_same.
+        7. Counts the total valid cells per pixel neighborhood from the prefix sums of the kernel.
         8. Calculates the percentage matrix by dividing the target counts by the total valid cells.
         9. Logs the completion of the percentage matrix calculation and its shape.
+        With a tile size, steps 5 to 8 run block by block in parallel, see iter_blocks.
+        Args:
+            out (np.ndarray, optional): A preallocated [rows, cols] matrix to write the result to.
         Returns:
             np.ndarray: The calculated percentage matrix.
         Raises:
@@ -114,57 +225,38 @@ class GProx(BaseProduct):
         matrix = self.product.extract_bandmatrix()[0]
         self.log.info("Starting percentage matrix calculation")
 
-        # Create the kernel based on resolution type.
-        if isinstance(self.product.resolution, int):
-
-            # Create a circular kernel with increasing values outward (normalized to [0,1])
-            radius = self.meter_radius / self.product.resolution
-            y, x = np.ogrid[-radius : radius + 1, -radius : radius + 1]
-            distance = np.sqrt(x**2 + y**2)
-
-            # Compute kernel values, ensuring they stay within [0,1] using formula: (r - d) / r
-            # circular_kernel = np.clip((radius - distance) / radius, 0, 1)
-
-        elif isinstance(self.product.resolution, tuple):
-            # Unpack the resolution for width and height (e.g., (res_x, res_y) in meters per pixel or degrees converted via a factor)
-            res_x, res_y = self.product.resolution
-            # Calculate how many pixels in each direction correspond to the meter radius.
-            radius_x = self.meter_radius / res_x
-            radius_y = self.meter_radius / res_y
-            # Create grid indices for y and x:
-            y, x = np.ogrid[-radius_y : radius_y + 1, -radius_x : radius_x + 1]
-            # Compute the physical distance for each cell:
-            # Note: x and y here are in pixel offsets; multiply by the corresponding resolution.
-            distance = np.sqrt((x * res_x) ** 2 + (y * res_y) ** 2)
-            # Create the kernel: cells within the meter_radius get a value that linearly decays from 1 (at center) to 0 at the edge.
-            # circular_kernel = np.clip((self.meter_radius - distance) / self.meter_radius, 0, 1)
-        else:
-            raise ValueError("Unsupported resolution type")
+        if self.tile_size is not None:
+            if out is None:
+                out = np.empty(matrix.shape, dtype=float)
+            for (row_off, col_off), block in self.iter_blocks(matrix):
+                out[
+                    row_off : row_off + block.shape[0],
+                    col_off : col_off + block.shape[1],
+                ] = block
+            self.log.info(f"Percentage matrix calculated with shape {out.shape}")
+            return out
 
-        kernel_function = self.parse_function_expression(self.function)
-        circular_kernel = np.clip(
-            kernel_function(distance, self.meter_radius, self.omega), 0, 1
+        circular_kernel = self._get_kernel()
+
+        target_matrix = self._get_target_matrix(matrix)
+
+        # Convolve the target matrix with the kernel to count target occurrences.
+        method = self._get_convolution_method(matrix.shape, circular_kernel)
+        start = time.perf_counter()
+        target_counts = convolution.convolve_same(
+            target_matrix, circular_kernel, method
+        )
+        self.log.info(
+            f"Convolution method {method} took {time.perf_counter() - start:.3f} s"
         )
 
-        # Get the target value map
-        target_value = self.value_map
-
-        if isinstance(target_value, dict):
-            # Create a matrix with the target values mapped to integers.
-            target_matrix = np.zeros_like(matrix, dtype=float)
-            for value, target in target_value.items():
-                target_matrix[matrix == value] = target
-        elif isinstance(target_value, int):
-            # Create a binary matrix: 1 where the matrix equals target_value, 0 otherwise.
-            target_value = self.value_to_map
-            target_matrix = (matrix == target_value).astype(float)
-
-        # Convolve the target matrix with the kernel using FFT to count target occurrences.
-        target_counts = signal.fftconvolve(target_matrix, circular_kernel, mode="same")
-
-        # Convolve a ones matrix with the kernel to count total valid cells per pixel neighborhood.
-        total_cells = signal.fftconvolve(
-            np.ones_like(matrix, dtype=float), circular_kernel, mode="same"
+        # Count the total valid cells per pixel neighborhood, the convolution of a ones matrix with the kernel.
+        total_cells = kernels.get_window_sums(
+            matrix.shape,
+            self.function,
+            self.meter_radius,
+            self.omega,
+            self.product.resolution,
         )
 
         # Calculate percentage (with safe division).
@@ -180,37 +272,109 @@ class GProx(BaseProduct):
         self.log.info(
             f"Percentage matrix calculated with shape {percentageMatrix.shape}"
         )
+        if out is not None:
+            out[...] = percentageMatrix
+            return out
         return percentageMatrix
 
-    def parse_function_expression(self, expression: str):
+    def iter_blocks(self, matrix: np.ndarray):
         """
-        Converts a user-provided string function into a callable function.
-        Example: "1 - (x / r) ** o" will be converted to a function that calculates 1 - (x / r) ** o.
+        Computes the percentage matrix block by block on a thread pool, yielding the blocks in raster order.
+        Every block is convolved with a halo of the kernel radius around it, so the blocks are equal to the
+        corresponding part of the whole matrix. Only a few blocks per worker are in flight at once.
+        Args:
+            matrix (np.ndarray): The [rows, cols] matrix of the product.
+        Yields:
+            tuple: The (row_off, col_off) of the block and the [rows, cols] block, row by row from the top left.
         """
-        x, r, o = sp.symbols("x r o")  # Define symbolic variables
-        expr = sp.sympify(expression)  # Convert string to sympy expression
-        return sp.lambdify(
-            (x, r, o), expr, "numpy"
-        )  # Convert to a NumPy-compatible function
+        kernel = self._get_kernel()
+        tile_size = self.tile_size
+        method = self._get_convolution_method(
+            (tile_size + kernel.shape[0] - 1, tile_size + kernel.shape[1] - 1), kernel
+        )
+        self.log.info(f"Convolution method {method} chosen for the blocks")
+        windows = [
+            (row_off, col_off)
+            for row_off in range(0, matrix.shape[0], tile_size)
+            for col_off in range(0, matrix.shape[1], tile_size)
+        ]
 
-    def _gen_output_filepath(self, out_filepath):
-        """
-        Generates an output file path based on the provided template or class name.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for row_off, col_off in windows:
+                future = executor.submit(
+                    self._compute_block, matrix, kernel, method, row_off, col_off
+                )
+                pending.append(((row_off, col_off), future))
+                if len(pending) >= 2 * self.max_workers:
+                    window, future = pending.popleft()
+                    yield window, future.result()
+            while pending:
+                window, future = pending.popleft()
+                yield window, future.result()
 
-        Args:
-            outfolder (str): The template for the output file path. If it contains
-                             the placeholder "*date_time*", it will be replaced with
-                             the current date and time in the format "YYYY-MM-DD_HH-MM-SS".
-                             If None, the output file path will be generated using
-                             the class name and the current date and time.
+    def _compute_block(
+        self,
+        matrix: np.ndarray,
+        kernel: np.ndarray,
+        method: str,
+        row_off: int,
+        col_off: int,
+    ) -> np.ndarray:
+        rows, cols = matrix.shape
+        row_stop = min(row_off + self.tile_size, rows)
+        col_stop = min(col_off + self.tile_size, cols)
 
-        Returns:
-            str: The generated output file path.
+        # A "same" convolution output depends on the input from (k - 1 - c) before to c after, c = (k - 1) // 2
+        center_row = (kernel.shape[0] - 1) // 2
+        center_col = (kernel.shape[1] - 1) // 2
+        in_row_off = max(0, row_off - (kernel.shape[0] - 1 - center_row))
+        in_col_off = max(0, col_off - (kernel.shape[1] - 1 - center_col))
+        in_row_stop = min(rows, row_stop + center_row)
+        in_col_stop = min(cols, col_stop + center_col)
+
+        target_matrix = self._get_target_matrix(
+            matrix[in_row_off:in_row_stop, in_col_off:in_col_stop]
+        )
+        # The "same" convolution of the region equals the one of the raster away from the region borders
+        same = convolution.convolve_same(target_matrix, kernel, method)
+        target_counts = same[
+            row_off - in_row_off : row_stop - in_row_off,
+            col_off - in_col_off : col_stop - in_col_off,
+        ]
+
+        total_cells = kernels.kernel_window_sums(
+            kernel, matrix.shape, ((row_off, row_stop), (col_off, col_stop))
+        )
+        return (
+            np.divide(
+                target_counts,
+                total_cells,
+                out=np.zeros_like(target_counts),
+                where=total_cells != 0,
+            )
+            * 100
+        )
+
+    def _get_target_matrix(self, matrix: np.ndarray) -> np.ndarray:
+        return map_values(matrix, self.value_map)
+
+    def _get_convolution_method(self, shape: tuple, kernel: np.ndarray) -> str:
+        if self.convolution_method == "auto":
+            return convolution.choose_method(shape, kernel)
+        return self.convolution_method
+
+    def _get_kernel(self) -> np.ndarray:
         """
-        time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        if out_filepath is not None:
-            return out_filepath.replace("*date_time*", time)
-        else:
-            className = type(self.product).__name__
-            # Default to use output folder
-            return f"output/GProx_{className}_{time}.tif"
+        Returns the circular kernel of the product resolution, shared through the process-wide kernel cache.
+        """
+        return kernels.get_kernel(
+            self.function, self.meter_radius, self.omega, self.product.resolution
+        )
+
+    def parse_function_expression(self, expression: str):
+        """
+        Converts a user-provided string function into a callable function.
+        Example: "1 - (x / r) ** o" will be converted to a function that calculates 1 - (x / r) ** o.
+        """
+        return kernels.compile_expression(expression)
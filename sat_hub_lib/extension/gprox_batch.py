@@ -0,0 +1,156 @@
+import numpy as np
+import rasterio
+from scipy import fft
+from sat_hub_lib.baseproducts import BaseSatType
+from sat_hub_lib.extension import kernels
+from sat_hub_lib.extension.gprox import BaseGProx, map_values
+
+DEFAULT_FUNCTION = "1-(x/r)**o"
+
+
+class GProxBatch(BaseGProx):
+    """
+    Computes GProx for several value maps and radii of the same product in a single pass.
+    The product is read once, the rfft2 of each distinct value map is computed once and multiplied by the cached
+    spectrum of every kernel using it, so N value maps and M radii cost N forward and N x M inverse FFTs instead of
+    N x M GProx pipelines. Each band equals the output of the GProx of its spec.
+
+    Example:
+        batch = GProxBatch(s3_esa, [({10: 1}, 100), ({10: 1}, 500), ({30: 1}, 2000, "1")])
+        matrix = batch.extract_bandmatrix()  # [3, rows, cols]
+    """
+
+    def __init__(
+        self,
+        product: BaseSatType,
+        specs: list,
+        output_filepath: str = None,
+        output_profile=None,
+        max_workers: int = None,
+    ):
+        """
+        Args:
+            product (BaseSatType): The satellite product.
+            specs (list): The (value_map, meter_radius, function, omega) of each band, function and omega are
+                          optional and default to '1-(x/r)**o' and 1. A None value map is the default value map of
+                          the product.
+            output_filepath (str, optional): The file path for the output. Defaults to None.
+            output_profile (str | dict, optional): The profile of the GeoTIFF output, see geotiff_lib.OUTPUT_PROFILES.
+                                                   Defaults to None (plain GeoTIFF).
+            max_workers (int, optional): The number of threads of the FFTs. Defaults to None (one thread).
+        Raises:
+            ValueError: If a spec is malformed, or has no value map and the product does not have a default one.
+        """
+        self.product = product
+        super().__init__(output_filepath, output_profile)
+        self.max_workers = max_workers
+        self.specs = [self._normalize_spec(spec) for spec in specs]
+        if not self.specs:
+            raise ValueError("At least one spec is required.")
+
+    def _normalize_spec(self, spec) -> tuple:
+        if not 2 <= len(spec) <= 4:
+            raise ValueError(
+                f"A spec is (value_map, meter_radius, function, omega), got {spec}"
+            )
+        value_map, meter_radius = spec[0], spec[1]
+        function = spec[2] if len(spec) > 2 else DEFAULT_FUNCTION
+        omega = spec[3] if len(spec) > 3 else 1
+        if value_map is None:
+            value_map = self._get_default_value_map()
+        return value_map, meter_radius, function, omega
+
+    def write_geotiff(self, output_file: str = None):
+        """
+        Writes the matrix as a uint8 GeoTIFF with one band per spec, in the order of the specs.
+        """
+        if output_file is None:
+            output_file = self.get_output_file_path()
+        matrix = self.extract_bandmatrix()
+        meta = self.product.geotiff_meta.copy()
+        meta.update(
+            {
+                "driver": "GTiff",
+                "height": matrix.shape[1],
+                "width": matrix.shape[2],
+                "transform": self.product.geotiff_trasform,
+                "count": matrix.shape[0],
+                "dtype": rasterio.uint8,
+            }
+        )
+        self._write_bands(output_file, matrix.astype(rasterio.uint8), meta)
+        self.log.info("Matrix written to GeoTIFF at " + output_file)
+
+    def extract_bandmatrix(self) -> np.ndarray:
+        """
+        Computes the percentage matrix of every spec.
+        Returns:
+            np.ndarray: The [specs, rows, cols] percentage matrices, in the order of the specs.
+        """
+        matrix = self.product.extract_bandmatrix()[0]
+        rows, cols = matrix.shape
+        resolution = self.product.resolution
+        self.log.info(
+            f"Starting percentage matrix calculation of {len(self.specs)} specs"
+        )
+
+        # One padded shape large enough for the linear convolution with the largest kernel
+        kernel_shapes = [
+            kernels.get_kernel(function, meter_radius, omega, resolution).shape
+            for _, meter_radius, function, omega in self.specs
+        ]
+        max_kernel_rows = max(shape[0] for shape in kernel_shapes)
+        max_kernel_cols = max(shape[1] for shape in kernel_shapes)
+        fft_shape = (
+            fft.next_fast_len(rows + max_kernel_rows - 1, True),
+            fft.next_fast_len(cols + max_kernel_cols - 1, True),
+        )
+
+        # Group the specs by value map, only the spectrum of one value map is held at once
+        groups = {}
+        for index, spec in enumerate(self.specs):
+            groups.setdefault(_get_value_map_key(spec[0]), []).append(index)
+
+        result = np.empty((len(self.specs), rows, cols))
+        for indices in groups.values():
+            target_matrix = map_values(matrix, self.specs[indices[0]][0])
+            target_spectrum = fft.rfft2(
+                target_matrix, s=fft_shape, workers=self.max_workers
+            )
+            del target_matrix
+            for index in indices:
+                _, meter_radius, function, omega = self.specs[index]
+                kernel_spectrum = kernels.get_kernel_spectrum(
+                    fft_shape, function, meter_radius, omega, resolution
+                )
+                full = fft.irfft2(
+                    target_spectrum * kernel_spectrum,
+                    s=fft_shape,
+                    workers=self.max_workers,
+                )
+                # The "same" convolution is the full one offset by the kernel center
+                row_start = (kernel_shapes[index][0] - 1) // 2
+                col_start = (kernel_shapes[index][1] - 1) // 2
+                target_counts = full[
+                    row_start : row_start + rows, col_start : col_start + cols
+                ]
+                total_cells = kernels.get_window_sums(
+                    matrix.shape, function, meter_radius, omega, resolution
+                )
+                np.divide(
+                    target_counts,
+                    total_cells,
+                    out=result[index],
+                    where=total_cells != 0,
+                )
+                result[index][total_cells == 0] = 0
+                result[index] *= 100
+
+        self.log.info(f"Percentage matrices calculated with shape {result.shape}")
+        return result
+
+
+def _get_value_map_key(value_map):
+    if isinstance(value_map, dict):
+        return tuple(sorted(value_map.items()))
+    return value_map
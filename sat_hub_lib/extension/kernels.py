@@ -0,0 +1,152 @@
+from functools import lru_cache
+import numpy as np
+from scipy import fft
+
+# Maximum number of compiled expressions and kernels kept by the process
+MAX_CACHED_EXPRESSIONS = 128
+MAX_CACHED_KERNELS = 64
+# The window sums have the size of the raster, only a few are kept
+MAX_CACHED_WINDOW_SUMS = 4
+MAX_CACHED_SPECTRA = 8
+
+
+@lru_cache(maxsize=MAX_CACHED_EXPRESSIONS)
+def compile_expression(expression: str):
+    """
+    Converts a user-provided string function of the distance x, the radius r and omega o into a callable.
+    Example: "1 - (x / r) ** o" will be converted to a function that calculates 1 - (x / r) ** o.
+    The callables are cached, sympy is only imported to compile a new expression.
+    """
+    import sympy as sp
+
+    x, r, o = sp.symbols("x r o")  # Define symbolic variables
+    expr = sp.sympify(expression)  # Convert string to sympy expression
+    return sp.lambdify((x, r, o), expr, "numpy")  # Convert to a NumPy-compatible function
+
+
+@lru_cache(maxsize=MAX_CACHED_KERNELS)
+def get_kernel(function: str, meter_radius, omega, resolution) -> np.ndarray:
+    """
+    Returns the circular kernel of GProx, clipped to [0, 1].
+    The kernels are cached and shared by every caller, they are read only.
+    Args:
+        function (str): The expression of the kernel, see compile_expression.
+        meter_radius (int): The radius in meters.
+        omega (int): The omega value of the function.
+        resolution (int | tuple): The resolution of the product, in meters or (res_x, res_y) in meters.
+    Returns:
+        np.ndarray: The [rows, cols] kernel.
+    Raises:
+        ValueError: If the resolution type is unsupported.
+    """
+    if isinstance(resolution, int):
+        # Create a circular kernel with increasing values outward (normalized to [0,1])
+        radius = meter_radius / resolution
+        y, x = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+        distance = np.sqrt(x**2 + y**2)
+
+    elif isinstance(resolution, tuple):
+        # Unpack the resolution for width and height (e.g., (res_x, res_y) in meters per pixel or degrees converted via a factor)
+        res_x, res_y = resolution
+        # Calculate how many pixels in each direction correspond to the meter radius.
+        radius_x = meter_radius / res_x
+        radius_y = meter_radius / res_y
+        # Create grid indices for y and x:
+        y, x = np.ogrid[-radius_y : radius_y + 1, -radius_x : radius_x + 1]
+        # Compute the physical distance for each cell:
+        # Note: x and y here are in pixel offsets; multiply by the corresponding resolution.
+        distance = np.sqrt((x * res_x) ** 2 + (y * res_y) ** 2)
+    else:
+        raise ValueError("Unsupported resolution type")
+
+    kernel_function = compile_expression(function)
+    kernel = np.clip(kernel_function(distance, meter_radius, omega), 0, 1)
+    # A constant expression such as "1" evaluates to a scalar
+    kernel = np.array(np.broadcast_to(kernel, distance.shape), dtype=float)
+    kernel.flags.writeable = False
+    return kernel
+
+
+def _get_window_bounds(size: int, kernel_size: int):
+    """
+    Returns the [lo, hi) range of the kernel rows (or columns) overlapping the raster at each output row (or
+    column) of a "same" convolution, whose output is the full one offset by (kernel_size - 1) // 2.
+    """
+    index = np.arange(size) + (kernel_size - 1) // 2
+    lo = np.maximum(0, index - size + 1)
+    hi = np.minimum(kernel_size, index + 1)
+    return lo, hi
+
+
+def kernel_window_sums(
+    kernel: np.ndarray, shape: tuple, window: tuple = None
+) -> np.ndarray:
+    """
+    Returns the "same" convolution of a matrix of ones of the given shape with the kernel, i.e. the sum of the
+    kernel weights falling inside the raster at every pixel.
+    The sums are read from the 2-D prefix sums of the kernel instead of a convolution of the whole raster, they are
+    constant in the interior and only depend on the distance to the borders.
+    Args:
+        kernel (np.ndarray): The [rows, cols] kernel.
+        shape (tuple): The (rows, cols) shape of the raster.
+        window (tuple, optional): The ((row_start, row_stop), (col_start, col_stop)) block of the raster to
+                                  return. Defaults to None (the whole raster).
+    Returns:
+        np.ndarray: The [rows, cols] sums of the raster or of the block.
+    """
+    rows, cols = shape
+    if window is None:
+        window = ((0, rows), (0, cols))
+    (row_start, row_stop), (col_start, col_stop) = window
+    prefix = np.zeros((kernel.shape[0] + 1, kernel.shape[1] + 1))
+    np.cumsum(np.cumsum(kernel, axis=0), axis=1, out=prefix[1:, 1:])
+
+    row_lo, row_hi = _get_window_bounds(rows, kernel.shape[0])
+    col_lo, col_hi = _get_window_bounds(cols, kernel.shape[1])
+    row_lo, row_hi = row_lo[row_start:row_stop], row_hi[row_start:row_stop]
+    col_lo, col_hi = col_lo[col_start:col_stop], col_hi[col_start:col_stop]
+
+    # Sum of the rectangle [row_lo, row_hi) x [col_lo, col_hi) of the kernel at every pixel
+    upper = prefix[row_hi] - prefix[row_lo]
+    sums = np.take(upper, col_hi, axis=1)
+    sums -= np.take(upper, col_lo, axis=1)
+    return sums
+
+
+@lru_cache(maxsize=MAX_CACHED_WINDOW_SUMS)
+def get_window_sums(
+    shape: tuple, function: str, meter_radius, omega, resolution
+) -> np.ndarray:
+    """
+    Returns the window sums of the kernel, see kernel_window_sums and get_kernel.
+    The sums are cached per raster shape and kernel, they are read only.
+    """
+    sums = kernel_window_sums(
+        get_kernel(function, meter_radius, omega, resolution), shape
+    )
+    sums.flags.writeable = False
+    return sums
+
+
+@lru_cache(maxsize=MAX_CACHED_SPECTRA)
+def get_kernel_spectrum(
+    fft_shape: tuple, function: str, meter_radius, omega, resolution
+) -> np.ndarray:
+    """
+    Returns the rfft2 of the kernel zero padded to fft_shape, see get_kernel.
+    The spectra are cached per padded shape and kernel, they are read only.
+    """
+    kernel = get_kernel(function, meter_radius, omega, resolution)
+    spectrum = fft.rfft2(kernel, s=fft_shape)
+    spectrum.flags.writeable = False
+    return spectrum
+
+
+def clear_cache():
+    """
+    Drops the compiled expressions, the kernels, their window sums and their spectra.
+    """
+    compile_expression.cache_clear()
+    get_kernel.cache_clear()
+    get_window_sums.cache_clear()
+    get_kernel_spectrum.cache_clear()
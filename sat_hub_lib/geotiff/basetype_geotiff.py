@@ -2,5 +2,11 @@ from sat_hub_lib.baseproducts import BaseSatType
 
 
 class BaseSat_GeoTiff(BaseSatType):
-    def __init__(self, point1: tuple, point2: tuple, output_filepath: str = None):
-        super().__init__(point1, point2, output_filepath)
+    def __init__(
+        self,
+        point1: tuple,
+        point2: tuple,
+        output_filepath: str = None,
+        output_profile=None,
+    ):
+        super().__init__(point1, point2, output_filepath, output_profile)
@@ -16,8 +16,9 @@ class Local_GeoTiff(BaseSat_GeoTiff, IsMappable):
         point2: tuple,
         resolution: tuple,
         output_file: str = None,
+        output_profile=None,
     ):
-        super().__init__(point1, point2, output_file)
+        super().__init__(point1, point2, output_file, output_profile)
         self.input_file = input_file
         self.resolution = resolution
 
@@ -30,11 +31,7 @@ class Local_GeoTiff(BaseSat_GeoTiff, IsMappable):
 
         with rasterio.open(self.input_file) as src:
             data, meta = self.__default_rasterio_preprocess(src)
-            _range = data.shape[0]
-
-            with rasterio.open(output_file, "w", **meta) as dst:
-                for i in range(1, _range + 1):
-                    dst.write(data[i - 1], i)
+        self._write_bands(output_file, data, meta)
 
     def extract_bandmatrix(self):
         with rasterio.open(self.input_file) as src:
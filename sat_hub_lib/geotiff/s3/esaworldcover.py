@@ -1,16 +1,19 @@
-import botocore.client
 from sat_hub_lib.geotiff.basetype_geotiff import BaseSat_GeoTiff
-import boto3
-import botocore
+from contextlib import contextmanager
 import json
-from shapely.geometry import Polygon, box
-from sat_hub_lib.utils import simplecache
+import threading
+from sat_hub_lib.utils import awsclient, simplecache
+from sat_hub_lib.utils.tileindex import TileIndex
 from scipy import signal as signal
 from enum import Enum
 import os
 import sat_hub_lib.utils.geotiff_lib as geotiff_lib
 from sat_hub_lib.extension import IsMappable
 
+# Tile grid indexes shared by all the instances, keyed by their source
+_tile_indexes = {}
+_tile_indexes_lock = threading.Lock()
+
 
 class ESAWC_MAPCODE(Enum):
     TREE_COVER = 10, (0, 100, 0)
@@ -53,6 +56,7 @@ class S3_EsaWorldCover(BaseSat_GeoTiff, IsMappable):
     """
 
     bucket_name = "esa-worldcover"
+    native_resolution = 10  # The ESA World Cover maps have a resolution of 10 meters
 
     # def __init__(self, config):
     #     super().__init__(config)
@@ -87,21 +91,49 @@ class S3_EsaWorldCover(BaseSat_GeoTiff, IsMappable):
         cache_folder: str = "cache",
         disable_cache: bool = False,
         output_file: str = None,
+        cache_max_bytes: int = None,
+        cache_mode: str = "tile",
+        target_resolution: int = None,
+        max_pool_connections: int = awsclient.DEFAULT_MAX_POOL_CONNECTIONS,
+        output_profile=None,
     ):
-        super().__init__(point1, point2, output_file)
+        """
+        Args:
+            point1 (tuple): The (lat, lon) of a corner of the bounding box.
+            point2 (tuple): The (lat, lon) of the opposite corner of the bounding box.
+            version (int): The version of the ESA World Cover, 1 or 2.
+            cache_folder (str, optional): The folder of the cache. Defaults to "cache".
+            disable_cache (bool, optional): Read the tiles straight from S3. Defaults to False.
+            output_file (str, optional): The path of the output file. Defaults to None.
+            cache_max_bytes (int, optional): The size budget of the cache in bytes. Defaults to None (unbounded).
+            cache_mode (str, optional): "tile" downloads and caches whole tiles, "block" fetches and caches only
+                                        the blocks of the tiles intersecting the bounding box. Defaults to "tile".
+            target_resolution (int, optional): The resolution in meters of the output, it is rounded to a multiple
+                                               of the native 10 meters and read from the overviews of the tiles with
+                                               mode resampling. Defaults to None (native resolution).
+            max_pool_connections (int, optional): The connection pool size of the shared S3 client. Defaults to 32.
+            output_profile (str | dict, optional): The profile of the GeoTIFF output, see geotiff_lib.OUTPUT_PROFILES.
+                                                   Defaults to None (plain GeoTIFF).
+        """
+        super().__init__(point1, point2, output_file, output_profile)
         self.cache_folder = cache_folder
         self.use_cache = not disable_cache
-        # Default resolution for the ESA World Cover
-        self.resolution = 20
+        # Number of native pixels per output pixel along each axis
+        self.decimation = 1
+        if target_resolution is not None:
+            self.decimation = max(
+                1, round(target_resolution / S3_EsaWorldCover.native_resolution)
+            )
+        # The resolution of the matrix read, the kernels of GProx are sized from it
+        self.resolution = S3_EsaWorldCover.native_resolution * self.decimation
         # Check if the cache folder exists otherwise create it
         self.cache_folder = f"{self.cache_folder}/{self.__class__.__name__}"
         if not os.path.exists(self.cache_folder) and self.use_cache:
             os.makedirs(self.cache_folder)
 
-        self.s3_client = boto3.client(
-            "s3",
-            region_name="eu-central-1",
-            config=botocore.client.Config(signature_version=botocore.UNSIGNED),
+        # The client is shared by all the instances and their caches
+        self.s3_client = awsclient.get_s3_client(
+            "eu-central-1", max_pool_connections=max_pool_connections
         )
 
         self.version = version
@@ -109,40 +141,47 @@ class S3_EsaWorldCover(BaseSat_GeoTiff, IsMappable):
             self.cache_folder,
             S3_EsaWorldCover.bucket_name,
             "eu-central-1",
+            s3_client=self.s3_client,
+            max_bytes=cache_max_bytes,
         )
+        if cache_mode not in ("tile", "block"):
+            raise ValueError(f"Unsupported cache mode {cache_mode}")
+        self.cache_mode = cache_mode
+        self.s3blockcache = None
+        if cache_mode == "block":
+            self.s3blockcache = simplecache.S3BlockCache(
+                self.cache_folder,
+                S3_EsaWorldCover.bucket_name,
+                "eu-central-1",
+                s3_client=self.s3_client,
+                max_bytes=cache_max_bytes,
+            )
 
     def get_default_value_map(self):
         return {ESAWC_MAPCODE.TREE_COVER.code: 1, ESAWC_MAPCODE.GRASSLAND.code: 0.2}
 
+    def _get_colormap(self):
+        return ESAWC_MAPCODE.get_color_map()
+
     def write_geotiff(self, output_file=None):
         if output_file is None:
             output_file = self.get_output_file_path()
         self.log.info("Processing ESA World Cover")
         # Get the tiles that intersect with the bounding box
-        tile_names = self._get_tile_names()
-        prefix = self._get_versionprefix()
-        geotiffs = []
-        for tile in tile_names:
-            key = f"{prefix}{tile}_Map.tif"
-
-            self.log.info(f"Getting {key}")
-            if not self.use_cache:
-                geotiffs.append(f"s3://{S3_EsaWorldCover.bucket_name}/{key}")
-            else:
-                self.log.info(f"Using cache")
-                local_filename = f"{self.cache_folder}/{key[14:]}"
-                # If the file does not exist in the cache download it
-
-                self.s3cache.get(key, local_filename)
-                geotiffs.append(local_filename)
-
-        self.log.info("Extracting bounding box")
-        self.geotiff_trasform, self.geotiff_meta = (
-            geotiff_lib.extract_boundingbox_into_tiff(
-                geotiffs, output_file, self.bounding_box
+        with self._get_geotiffs() as geotiffs:
+            self.log.info("Extracting bounding box")
+            # All the tiles are mosaicked into the output file in a single pass
+            self.geotiff_trasform, self.geotiff_meta = (
+                geotiff_lib.extract_boundingbox_into_tiff(
+                    geotiffs,
+                    output_file,
+                    self.bounding_box,
+                    opener=self._get_opener(),
+                    decimation=self.decimation,
+                    profile=self.output_profile,
+                    colormap=self._get_colormap(),
+                )
             )
-        )
-        geotiff_lib.apply_colormap(output_file, ESAWC_MAPCODE.get_color_map())
         self.log.info("Bounding box extracted to " + output_file)
 
     def extract_bandmatrix(self):
@@ -157,28 +196,51 @@ class S3_EsaWorldCover(BaseSat_GeoTiff, IsMappable):
             Exception: If there is an error during the extraction process.
         """
         self.log.info("Extracting band matrix")
+        with self._get_geotiffs() as geotiffs:
+            # Trasform the geotiffs into a matrix
+            matrix, self.geotiff_trasform, self.geotiff_meta = (
+                geotiff_lib.extract_boundingbox_into_matrix(
+                    geotiffs,
+                    self.bounding_box,
+                    opener=self._get_opener(),
+                    decimation=self.decimation,
+                )
+            )
+        self.log.info("Band matrix extracted")
+        return matrix
+
+    @contextmanager
+    def _get_geotiffs(self):
+        """
+        Yields the uris of the tiles that intersect with the bounding box.
+        When the cache is enabled the tiles are downloaded in the cache folder and the local paths are yielded,
+        pinned in the cache until the block ends, otherwise the s3 urls are yielded.
+        """
         tile_names = self._get_tile_names()
         prefix = self._get_versionprefix()
+        keys = [f"{prefix}{tile}_Map.tif" for tile in tile_names]
 
-        geotiffs = []
-        for tile in tile_names:
-            key = f"{prefix}{tile}_Map.tif"
-
-            if not self.use_cache:
-                self.log.info(f"Getting {key}")
-                geotiffs.append(f"s3://{S3_EsaWorldCover.bucket_name}/{key}")
-            else:
-                local_filename = f"{self.cache_folder}/{key[14:]}"
-                # If the file does not exist in the cache download it
-                self.s3cache.get(key, local_filename)
-                geotiffs.append(local_filename)
-
-        # Trasform the geotiffs into a matrix
-        matrix, self.geotiff_trasform, self.geotiff_meta = (
-            geotiff_lib.extract_boundingbox_into_matrix(geotiffs, self.bounding_box)
-        )
-        self.log.info("Band matrix extracted")
-        return matrix
+        if not self.use_cache:
+            yield [f"s3://{S3_EsaWorldCover.bucket_name}/{key}" for key in keys]
+            return
+        if self.cache_mode == "block":
+            # The keys are read through the opener of the block cache
+            yield keys
+            return
+
+        # If the files do not exist in the cache download them concurrently
+        local_filenames = [f"{self.cache_folder}/{key[14:]}" for key in keys]
+        with self.s3cache.pinned(local_filenames):
+            results = self.s3cache.get_many(keys, local_filenames)
+            for key in keys:
+                if not results[key].ok:
+                    raise results[key].error
+            yield local_filenames
+
+    def _get_opener(self):
+        if self.use_cache and self.cache_mode == "block":
+            return self.s3blockcache.opener
+        return None
 
     def _get_gridgeojson(self):
         if not self.use_cache:
@@ -197,16 +259,35 @@ class S3_EsaWorldCover(BaseSat_GeoTiff, IsMappable):
             return geo_data
 
     def _get_tile_names(self):
-        geojson = self._get_gridgeojson()
-        tiles = []
-        for feature in geojson["features"]:
-            polygon = Polygon(feature["geometry"]["coordinates"][0])
-            cord_bounding_box = box(
-                self.NW_Long, self.SE_Lat, self.SE_Long, self.NW_Lat
-            )
-            if polygon.intersects(cord_bounding_box):
-                tiles.append(feature["properties"]["ll_tile"])
-        return tiles
+        return self._get_tile_index().query(
+            self.NW_Long, self.SE_Lat, self.SE_Long, self.NW_Lat
+        )
+
+    def _get_tile_index(self):
+        """
+        Returns the spatial index of the tile grid.
+        The index is built once from the grid geojson, persisted next to the cached geojson
+        and shared by all the instances of the process.
+        """
+        if not self.use_cache:
+            index_key = f"s3://{S3_EsaWorldCover.bucket_name}/esa_worldcover_grid.geojson"
+        else:
+            index_key = f"{self.cache_folder}/esa_worldcover_grid.npz"
+
+        with _tile_indexes_lock:
+            tile_index = _tile_indexes.get(index_key)
+            if tile_index is None:
+                if self.use_cache and os.path.exists(index_key):
+                    tile_index = TileIndex.load(index_key)
+                else:
+                    self.log.info("Building the tile grid index")
+                    tile_index = TileIndex.from_geojson(
+                        self._get_gridgeojson(), "ll_tile"
+                    )
+                    if self.use_cache:
+                        tile_index.save(index_key)
+                _tile_indexes[index_key] = tile_index
+        return tile_index
 
     def _get_versionprefix(self):
         match self.version:
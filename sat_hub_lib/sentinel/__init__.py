@@ -1,12 +1,20 @@
 from .basetype_sent import SentinelBaseType, SentinelBaseSettings
+from .bands import S2Bands
+from .batch import BatchResult, fetch_all, iter_fetch
+from .composite import Composite
 from .landcover import Landcover, SAT_LANDCOVER_MAPCODE
 from .rgb import RGB
 from .sentinel_lib import (
+    RequestPlan,
     calculate_dimensions,
+    get_dimensions,
+    get_minimum_resolution,
     get_resolution_degree_from_meters,
     get_valid_resolution,
+    plan_request,
 )
 from .stemp import STemp
+from .timeseries import TimeSeries, TimeSeriesStore
 
 # from .vis import Vis
 from .ndvi import NDVI
@@ -15,13 +23,24 @@ from .ndvi import NDVI
 __all__ = [
     "SentinelBaseType",
     "SentinelBaseSettings",
+    "Composite",
+    "S2Bands",
+    "BatchResult",
+    "fetch_all",
+    "iter_fetch",
     "SAT_LANDCOVER_MAPCODE",
     "Landcover",
     "RGB",
+    "RequestPlan",
     "calculate_dimensions",
+    "get_dimensions",
+    "get_minimum_resolution",
     "get_resolution_degree_from_meters",
     "get_valid_resolution",
+    "plan_request",
     "STemp",
+    "TimeSeries",
+    "TimeSeriesStore",
     #    "Vis",
     "NDVI",
 ]
@@ -0,0 +1,83 @@
+import json
+import numpy as np
+from sentinelhub import SentinelHubRequest, DataCollection
+from .basetype_sent import SentinelBaseType, SentinelBaseSettings
+import sat_hub_lib.sentinel.indices as indices
+
+
+class S2Bands(SentinelBaseType):
+    """
+    The raw Sentinel-2 L2A bands, fetched once and used to compute the indices locally.
+    The bands are fetched as digital numbers in UINT16, which is lossless, and converted to reflectances locally.
+    """
+
+    def __init__(
+        self, conf: SentinelBaseSettings, bands: tuple = ("B03", "B04", "B08", "B11")
+    ):
+        self.bands = tuple(bands)
+        super().__init__(conf)
+
+    @property
+    def n_input_bands(self):
+        return len(self.bands)
+
+    def get_band(self, band: str) -> np.ndarray:
+        """
+        Returns the [rows, cols] reflectances of a band, in float64.
+        """
+        data, meta = self._read_raster()
+        return indices.to_reflectance(data[self.bands.index(band)])
+
+    def derive(self, product: SentinelBaseType, matrix: np.ndarray):
+        """
+        Returns the raster of a product computed from the bands, on the grid of the bands.
+        Args:
+            product (SentinelBaseType): The derived product, its geotiff metadata and transform are set.
+            matrix (np.ndarray): The [rows, cols] matrix computed from the bands.
+        Returns:
+            tuple: The [1, rows, cols] matrix and the metadata of the output GeoTIFF.
+        """
+        data, meta = self._read_raster()
+        product.geotiff_meta = self.geotiff_meta
+        product.geotiff_trasform = self.geotiff_trasform
+        meta.update(count=1, dtype=matrix.dtype)
+        return matrix[np.newaxis], meta
+
+    def _decode_response(self, content: bytes):
+        data, meta = super()._decode_response(content)
+        meta.update(dtype=data.dtype)
+        return data, meta
+
+    def _mosaic_tiles(self, plan, contents: list):
+        data, meta = super()._mosaic_tiles(plan, contents)
+        meta.update(dtype=data.dtype)
+        return data, meta
+
+    def _get_input_options(self) -> dict:
+        return {"units": "DN"}
+
+    def _get_input_type(self):
+        return [
+            SentinelHubRequest.input_data(
+                data_collection=DataCollection.SENTINEL2_L2A,
+                time_interval=(self.timeIntervalStart, self.timeIntervalEnd),
+                other_args={"dataFilter": {"maxCloudCoverage": self.cloud_coverage}},
+            ),
+        ]
+
+    def _get_evalscript(self) -> str:
+        input_data = json.dumps({"bands": list(self.bands), **self._get_input_options()})
+        samples = ", ".join(f"sample.{band}" for band in self.bands)
+        return f"""
+//VERSION=3
+function setup() {{
+    return {{
+        input: [{input_data}],
+        output: {{ bands: {len(self.bands)}, sampleType: "UINT16" }}
+    }};
+}}
+
+function evaluatePixel(sample) {{
+    return [{samples}];
+}}
+"""
@@ -1,10 +1,35 @@
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 from io import BytesIO
+import json
+import threading
+import numpy as np
 import rasterio
 from sat_hub_lib.baseproducts import BaseSatType
-from sentinelhub import SentinelHubRequest, MimeType, CRS, SHConfig
+from sentinelhub import (
+    SentinelHubRequest,
+    MimeType,
+    CRS,
+)
 import sentinelhub
 import sat_hub_lib.sentinel.sentinel_lib as sentinel_lib
+import sat_hub_lib.sentinel.shsession as shsession
+from sat_hub_lib.utils import simplecache
+
+
+def _get_cache_key(download_request) -> str:
+    """
+    Returns the content address of a Sentinel Hub request.
+    The payload holds the evalscript, the input data collections with their time interval and filters,
+    the bounding box, the resolution or size and the response types.
+    """
+    payload = json.dumps(
+        {"url": download_request.url, "payload": download_request.post_values},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
 
 class SentinelBaseSettings:
@@ -19,7 +44,37 @@ class SentinelBaseSettings:
         cloud_coverage: float = 20,
         resolution: int = None,
         output_file: str = None,
+        output_profile=None,
+        tiled: bool = False,
+        max_threads: int = 4,
+        cache_folder: str = None,
+        cache_ttl: float = None,
+        cache_max_bytes: int = None,
+        sh_base_url: str = None,
+        sh_token_url: str = None,
     ):
+        """
+        Args:
+            point1 (tuple): The (lat, lon) of a corner of the bounding box.
+            point2 (tuple): The (lat, lon) of the opposite corner of the bounding box.
+            client_id (str): The Sentinel Hub OAuth client id.
+            client_secret (str): The Sentinel Hub OAuth client secret.
+            start_date (str): The start of the time interval.
+            end_date (str): The end of the time interval.
+            cloud_coverage (float, optional): The maximum cloud coverage in percent. Defaults to 20.
+            resolution (int, optional): The resolution in meters, the finest valid one is used if None.
+            output_file (str, optional): The path of the output file. Defaults to None.
+            output_profile (str | dict, optional): The profile of the GeoTIFF output, see geotiff_lib.OUTPUT_PROFILES.
+            tiled (bool, optional): Split bounding boxes larger than the Sentinel Hub size limit at the requested
+                                    resolution into several requests, fetched concurrently and mosaicked.
+                                    Defaults to False.
+            max_threads (int, optional): The maximum number of requests fetched concurrently. Defaults to 4.
+            cache_folder (str, optional): The folder of the persistent response cache, None disables the cache.
+            cache_ttl (float, optional): The time to live of the cached responses in seconds. Defaults to None (forever).
+            cache_max_bytes (int, optional): The size budget of the response cache in bytes. Defaults to None (unbounded).
+            sh_base_url (str, optional): The base url of the Sentinel Hub services. Defaults to the sentinelhub one.
+            sh_token_url (str, optional): The url of the OAuth token endpoint. Defaults to the sentinelhub one.
+        """
         self.point1 = point1
         self.point2 = point2
         self.client_id = client_id
@@ -29,11 +84,22 @@ class SentinelBaseSettings:
         self.cloud_coverage = cloud_coverage
         self.resolution = resolution
         self.output_file = output_file
+        self.output_profile = output_profile
+        self.tiled = tiled
+        self.max_threads = max_threads
+        self.cache_folder = cache_folder
+        self.cache_ttl = cache_ttl
+        self.cache_max_bytes = cache_max_bytes
+        self.sh_base_url = sh_base_url
+        self.sh_token_url = sh_token_url
 
 
 class SentinelBaseType(BaseSatType):
 
     max_resolution_allowed = 2500  # Sentinel Hub allows a maximum resolution of 2500 pixel for the width and height
+    n_input_bands = 3  # Number of input bands of the evalscript, used to estimate the processing units
+    float32_output = False  # True if the evalscript outputs FLOAT32 samples, which cost twice as much
+    n_samples = 1  # Number of data samples per pixel of the evalscript, more than one with ORBIT or TILE mosaicking
 
     # def __init__(self, config: dict):
     #     # Initialize the base class with the configuration parameters
@@ -66,12 +132,19 @@ class SentinelBaseType(BaseSatType):
 
     def __init__(self, conf: SentinelBaseSettings):
 
-        super().__init__(conf.point1, conf.point2, conf.output_file)
+        super().__init__(
+            conf.point1, conf.point2, conf.output_file, conf.output_profile
+        )
+
+        # Auth configuration for Sentinel Hub, shared by the products with the same credentials
+        self.config = shsession.get_config(
+            conf.client_id, conf.client_secret, conf.sh_base_url, conf.sh_token_url
+        )
+        self.sh_base_url = conf.sh_base_url
 
-        # Auth configuration for Sentinel Hub
-        self.config = SHConfig()
-        self.config.sh_client_id = conf.client_id
-        self.config.sh_client_secret = conf.client_secret
+        # The client used to download the requests, the shared client of the credentials if None
+        self.download_client = None
+        self.show_progress = True
 
         # Time interval
         self.timeIntervalStart = conf.start_date
@@ -80,6 +153,23 @@ class SentinelBaseType(BaseSatType):
         # Geographical parameters
         self.cloud_coverage = conf.cloud_coverage
 
+        # Tiled fetch of the bounding boxes larger than max_resolution_allowed
+        self.tiled = conf.tiled
+        self.max_threads = conf.max_threads
+
+        # Responses are cached by the content of their request
+        self.response_cache = None
+        if conf.cache_folder is not None:
+            self.response_cache = simplecache.ResponseCache(
+                f"{conf.cache_folder}/SentinelHub",
+                ttl=conf.cache_ttl,
+                max_bytes=conf.cache_max_bytes,
+            )
+
+        # The decoded product, fetched once and shared by every reader of the instance
+        self._raster = None
+        self._raster_lock = threading.Lock()
+
         self.resolution = conf.resolution
         self.sat_hub_bounding_box = sentinelhub.BBox(
             bbox=self.bounding_box.bounds, crs=CRS.WGS84
@@ -93,59 +183,210 @@ class SentinelBaseType(BaseSatType):
             )
         self.log.info(f"Resolution: {self.resolution}")
 
-    def _get_response(self):
-        self.log.info("Getting data from Sentinel Hub")
-        request = self.get_request()
-        response = request.get_data(
-            save_data=False, show_progress=True, decode_data=False
-        )
-        return response
+    def _download(self, requests: list) -> list:
+        """
+        Downloads the responses of the requests concurrently, through the response cache if enabled.
+        Returns:
+            list: The content of each response.
+        """
+        client = self.download_client
+        if client is None:
+            client = shsession.get_download_client(self.config)
+        download_requests = [request.download_list[0] for request in requests]
+        for download_request in download_requests:
+            # The requests carry the output path as data folder, the responses are decoded in memory and must not
+            # be written there, nor be read back from there by a later download
+            download_request.save_response = False
+        if self.response_cache is None:
+            responses = client.download(
+                download_requests,
+                max_threads=self.max_threads,
+                decode_data=False,
+                show_progress=self.show_progress,
+            )
+            return [response.content for response in responses]
+
+        def fetch(download_request):
+            return self.response_cache.get(
+                _get_cache_key(download_request),
+                lambda: client.download([download_request], decode_data=False)[0].content,
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+            return list(executor.map(fetch, download_requests))
 
     def write_geotiff(self, output_file: str = None):
         if output_file is None:
             output_file = self.get_output_file_path()
 
-        response = self._get_response()
+        data, meta = self._read_raster()
+        self._write_bands(output_file, data, meta)
 
-        # self.output_file = output_file
+    def extract_bandmatrix(self):
+        data, meta = self._read_raster()
+        # The memoized raster is read only and shared, the callers get their own writable matrix
+        return data.copy()
 
-        data_in_memory = BytesIO(response[0].content)
-        with rasterio.open(data_in_memory) as src:
-            data, meta = self._default_rasterio_preprocess(src)
-            _range = data.shape[0]
+    def _read_raster(self):
+        """
+        Returns the decoded product, fetching it from Sentinel Hub on the first call only.
+        The matrix is shared by every caller and is read only, copy it before modifying it.
+        Returns:
+            tuple: The [bands, rows, cols] matrix and the metadata of the output GeoTIFF.
+        """
+        with self._raster_lock:
+            if self._raster is None:
+                data, meta = self._fetch_raster()
+                data.flags.writeable = False
+                self._raster = (data, meta)
+            data, meta = self._raster
+        return data, meta.copy()
 
-            with rasterio.open(output_file, "w", **meta) as dst:
-                for i in range(1, _range + 1):
-                    dst.write(data[i - 1], i)
+    def _set_raster(self, data, meta: dict):
+        """
+        Memoizes a raster decoded elsewhere, e.g. by a composite request, as the product of the instance.
+        """
+        data.flags.writeable = False
+        with self._raster_lock:
+            self._raster = (data, meta)
 
-    def extract_bandmatrix(self):
-        response = self._get_response()
+    def invalidate(self):
+        """
+        Drops the decoded product, the next read fetches it again from Sentinel Hub.
+        """
+        with self._raster_lock:
+            self._raster = None
+
+    def _fetch_raster(self):
+        """
+        Fetches the product from Sentinel Hub and decodes it.
+        Returns:
+            tuple: The [bands, rows, cols] matrix and the metadata of the output GeoTIFF.
+        """
+        if self.tiled:
+            return self._read_tiled_raster()
+        self.log.info("Getting data from Sentinel Hub")
+        content = self._download([self.get_request()])[0]
+        return self._decode_response(content)
 
-        data_in_memory = BytesIO(response[0].content)
+    def _decode_response(self, content: bytes):
+        data_in_memory = BytesIO(content)
         with rasterio.open(data_in_memory) as src:
-            data, meta = self._default_rasterio_preprocess(src)
-            return data
+            return self._default_rasterio_preprocess(src)
 
-    def get_request(self) -> SentinelHubRequest:
-        converted_resolution = sentinel_lib.get_resolution_degree_from_meters(
-            self.sat_hub_bounding_box, self.resolution
+    def _read_tiled_raster(self):
+        """
+        Fetches the product with one request per tile of the bounding box and mosaics the tiles.
+        The tiles are cut on the pixel grid of the whole bounding box so the mosaic has no seams.
+        """
+        plan = self.get_request_plan()
+        self.log.info(f"Getting data from Sentinel Hub with {plan}")
+        contents = self._download(self._get_tile_requests(plan))
+        return self._mosaic_tiles(plan, contents)
+
+    def _get_tile_requests(self, plan: sentinel_lib.RequestPlan) -> list:
+        return [self.get_request(tile_bbox, size[2:]) for tile_bbox, size in plan.tiles]
+
+    def _mosaic_tiles(self, plan: sentinel_lib.RequestPlan, contents: list):
+        """
+        Mosaics the TIFF responses of the tiles of the plan into a single raster.
+        Returns:
+            tuple: The [bands, rows, cols] matrix and the metadata of the output GeoTIFF.
+        """
+        transform, width, height, tiles = (
+            plan.transform,
+            plan.width,
+            plan.height,
+            plan.tiles,
         )
+        data = None
+        for (_, (col_off, row_off, tile_width, tile_height)), content in zip(
+            tiles, contents
+        ):
+            with rasterio.open(BytesIO(content)) as src:
+                if data is None:
+                    data = np.zeros((src.count, height, width), dtype=src.dtypes[0])
+                    meta = src.meta.copy()
+                src.read(
+                    out=data[
+                        :,
+                        row_off : row_off + tile_height,
+                        col_off : col_off + tile_width,
+                    ]
+                )
+
+        meta.update(height=height, width=width, transform=transform)
+        self.geotiff_meta = meta
+        self.geotiff_trasform = transform
+
+        out_meta = meta.copy()
+        out_meta.update(driver="GTiff", dtype=rasterio.uint8)
+        return data, out_meta
+
+    def get_request(self, bbox=None, size=None) -> SentinelHubRequest:
+        """
+        Builds the Sentinel Hub request of the product.
+        Args:
+            bbox (BBox, optional): The bounding box of the request. Defaults to the bounding box of the product.
+            size (tuple, optional): The (width, height) in pixels of the output, used instead of the resolution.
+        """
+        if bbox is None:
+            bbox = self.sat_hub_bounding_box
+        converted_resolution = None
+        if size is None:
+            res_lat, res_lon = sentinel_lib.get_resolution_degree_from_meters(
+                self.sat_hub_bounding_box, self.resolution
+            )
+            # Sentinel Hub expects the (x, y) resolution
+            converted_resolution = (res_lon, res_lat)
+        input_data = self._get_input_type()
+        if self.sh_base_url is not None:
+            # The data collections bind their service url, an explicit base url takes precedence
+            for input_data_dict in input_data:
+                input_data_dict.service_url = None
         request = SentinelHubRequest(
             evalscript=self._get_evalscript(),
             data_folder=self.get_output_file_path(False),
-            input_data=self._get_input_type(),
+            input_data=input_data,
             responses=self._get_response_type(),
             resolution=converted_resolution,
-            bbox=self.sat_hub_bounding_box,
+            size=size,
+            bbox=bbox,
             config=self.config,
         )
         return request
 
+    def get_request_plan(self) -> sentinel_lib.RequestPlan:
+        """
+        Plans the requests needed to fetch the product, without sending any.
+        A single request is planned unless the product is tiled.
+        """
+        max_pixels = self.max_resolution_allowed
+        if not self.tiled:
+            max_pixels = max(
+                sentinel_lib.get_dimensions(self.sat_hub_bounding_box, self.resolution)
+            )
+        return sentinel_lib.plan_request(
+            self.sat_hub_bounding_box,
+            self.resolution,
+            max_pixels,
+            n_bands=self.n_input_bands,
+            float32=self.float32_output,
+            n_samples=self.n_samples,
+        )
+
     def _get_response_type(self) -> list:
         return [
             SentinelHubRequest.output_response("default", MimeType.TIFF),
         ]
 
+    def _get_input_options(self) -> dict:
+        """
+        Returns the options of the evalscript input besides its bands, e.g. {"units": "DN"}.
+        The products of a composite share a single input, so they must have the same options.
+        """
+        return {}
+
     @abstractmethod
     def _get_input_type(self) -> list:
         pass
@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import logging
+import threading
+import time
+import requests
+from sentinelhub.exceptions import DownloadFailedException, OutOfRequestsException
+from .basetype_sent import SentinelBaseType
+
+log = logging.getLogger(__name__)
+
+
+class BatchResult:
+    """
+    The result of the fetch of a product of a batch.
+    Attributes:
+        product (SentinelBaseType): The product, its raster is memoized if the fetch succeeded.
+        error (Exception): The error of the last attempt, None if the fetch succeeded.
+        attempts (int): The number of attempts.
+    """
+
+    def __init__(self, product: SentinelBaseType, error: Exception, attempts: int):
+        self.product = product
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        state = "ok" if self.ok else f"error={self.error!r}"
+        return f"BatchResult({type(self.product).__name__}, {state}, attempts={self.attempts})"
+
+
+class _AdaptiveBackoff:
+    """
+    A delay shared by the workers of a batch, doubled at every retryable failure and halved at every success.
+    """
+
+    def __init__(self, initial: float, maximum: float):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self.delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def failed(self):
+        with self._lock:
+            self.delay = min(max(self.delay * 2, self.initial), self.maximum)
+
+    def succeeded(self):
+        with self._lock:
+            self.delay = self.delay / 2 if self.delay > self.initial else 0
+
+
+def iter_fetch(
+    products: list,
+    max_threads: int = 8,
+    max_retries: int = 3,
+    backoff: float = 1,
+    max_backoff: float = 60,
+):
+    """
+    Fetches many Sentinel products concurrently, yielding them as they complete.
+    The products sharing the same credentials and services share one download client, see
+    shsession.get_download_client, so they share the rate limit of Sentinel Hub. The failures caused by rate limits
+    or server errors are retried with a backoff shared by the whole batch, the other failures are not retried.
+    Args:
+        products (list): The SentinelBaseType products to fetch, e.g. [NDVI(conf) for conf in confs].
+        max_threads (int, optional): The maximum number of products fetched concurrently. Defaults to 8.
+        max_retries (int, optional): The maximum number of retries of a product. Defaults to 3.
+        backoff (float, optional): The first delay in seconds after a retryable failure. Defaults to 1.
+        max_backoff (float, optional): The maximum delay in seconds. Defaults to 60.
+    Yields:
+        BatchResult: The result of each product, in completion order.
+    """
+    products = list(products)
+    for product in products:
+        product.show_progress = False
+
+    shared_backoff = _AdaptiveBackoff(backoff, max_backoff)
+
+    def fetch(product):
+        shared_backoff.wait()
+        product._read_raster()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_threads) as executor:
+            pending = {
+                executor.submit(fetch, product): (product, 1) for product in products
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    product, attempts = pending.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        shared_backoff.succeeded()
+                    elif _is_retryable(error) and attempts <= max_retries:
+                        shared_backoff.failed()
+                        log.warning(
+                            f"Fetch of {type(product).__name__} failed, retry {attempts}/{max_retries}: {error}"
+                        )
+                        pending[executor.submit(fetch, product)] = (product, attempts + 1)
+                        continue
+                    yield BatchResult(product, error, attempts)
+    finally:
+        for product in products:
+            product.show_progress = True
+
+
+def fetch_all(products: list, **kwargs) -> list:
+    """
+    Fetches many Sentinel products concurrently, see iter_fetch for the arguments.
+    Returns:
+        list: The BatchResult of each product, in the order of the products.
+    """
+    products = list(products)
+    results = {id(result.product): result for result in iter_fetch(products, **kwargs)}
+    return [results[id(product)] for product in products]
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, OutOfRequestsException):
+        return True
+    if isinstance(error, DownloadFailedException):
+        # Raised by the client after its own retries of the server and connection errors
+        error = error.request_exception
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == requests.codes.too_many_requests or status >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
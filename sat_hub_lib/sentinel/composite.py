@@ -0,0 +1,247 @@
+import json
+import os
+import tarfile
+from io import BytesIO
+import numpy as np
+from sentinelhub import SentinelHubRequest, MimeType
+from .basetype_sent import SentinelBaseType, SentinelBaseSettings
+
+
+class Composite(SentinelBaseType):
+    """
+    Fetches several Sentinel products of the same area and time range with a single Sentinel Hub request.
+    The evalscripts of the products are merged into one multi-output evalscript, every product gets its own
+    response in the returned tar and is memoized on its instance, so reading a product afterwards costs no request.
+    The band matrix of the composite is the stack of the bands of its products.
+
+    Example:
+        rgb, ndvi, landcover = RGB(conf), NDVI(conf), Landcover(conf)
+        Composite(conf, [rgb, ndvi, landcover]).fetch()
+        ndvi.write_geotiff()
+    """
+
+    def __init__(self, conf: SentinelBaseSettings, products: list):
+        """
+        Args:
+            conf (SentinelBaseSettings): The settings of the request, the bounding box, time range and resolution
+                                         must match the ones of the products.
+            products (list): The SentinelBaseType products to fetch.
+        Raises:
+            ValueError: If the products do not share the same input data, bounding box and resolution, or if they
+                        fuse several data collections.
+        """
+        if not products:
+            raise ValueError("A composite needs at least one product.")
+        self.products = list(products)
+        super().__init__(conf)
+        self._check_products()
+
+    @property
+    def n_input_bands(self):
+        # Upper bound, the bands shared by several products are requested only once
+        return sum(product.n_input_bands for product in self.products)
+
+    @property
+    def float32_output(self):
+        return any(product.float32_output for product in self.products)
+
+    @property
+    def n_samples(self):
+        return max(product.n_samples for product in self.products)
+
+    def fetch(self) -> list:
+        """
+        Fetches all the products with one request, or one request per tile if tiled.
+        Returns:
+            list: The products, with their raster memoized.
+        """
+        self._read_raster()
+        return self.products
+
+    def invalidate(self):
+        super().invalidate()
+        for product in self.products:
+            product.invalidate()
+
+    def _check_products(self):
+        """
+        Checks that every product would send the same request as the composite except for the evalscript and the
+        responses, the data collections, time range, filters, bounding box and resolution must match.
+        """
+        if len(self._get_input_type()) > 1:
+            raise ValueError(
+                "Products fusing several data collections cannot be part of a composite."
+            )
+        expected = _get_shared_payload(self.get_request())
+        expected_options = self._get_input_options()
+        for product in self.products:
+            if not isinstance(product, SentinelBaseType):
+                raise ValueError(
+                    f"{type(product).__name__} is not a Sentinel product and cannot be part of a composite."
+                )
+            if _get_shared_payload(product.get_request()) != expected:
+                raise ValueError(
+                    f"{type(product).__name__} does not request the same data, bounding box and resolution "
+                    "as the composite."
+                )
+            # The products share one evalscript input, e.g. bands in DN and in reflectance cannot be mixed
+            if product._get_input_options() != expected_options:
+                raise ValueError(
+                    f"{type(product).__name__} requests its input with the options {product._get_input_options()}, "
+                    f"the other products of the composite with {expected_options}."
+                )
+
+    def _fetch_raster(self):
+        if self.tiled:
+            plan = self.get_request_plan()
+            self.log.info(f"Getting composite data from Sentinel Hub with {plan}")
+            tiles = [
+                _split_response(content)
+                for content in self._download(self._get_tile_requests(plan))
+            ]
+            for i, product in enumerate(self.products):
+                contents = [tile[_get_response_id(i)] for tile in tiles]
+                product._set_raster(*product._mosaic_tiles(plan, contents))
+        else:
+            self.log.info("Getting composite data from Sentinel Hub")
+            responses = _split_response(self._download([self.get_request()])[0])
+            for i, product in enumerate(self.products):
+                product._set_raster(
+                    *product._decode_response(responses[_get_response_id(i)])
+                )
+
+        rasters = [product._read_raster() for product in self.products]
+        data = np.concatenate([data for data, meta in rasters])
+        meta = rasters[0][1].copy()
+        meta.update(count=data.shape[0], dtype=data.dtype)
+        self.geotiff_meta = self.products[0].geotiff_meta
+        self.geotiff_trasform = self.products[0].geotiff_trasform
+        return data, meta
+
+    def _get_input_type(self) -> list:
+        return self.products[0]._get_input_type()
+
+    def _get_input_options(self) -> dict:
+        return self.products[0]._get_input_options()
+
+    def _get_response_type(self) -> list:
+        return [
+            SentinelHubRequest.output_response(_get_response_id(i), MimeType.TIFF)
+            for i in range(len(self.products))
+        ]
+
+    def _get_evalscript(self) -> str:
+        """
+        Merges the evalscripts of the products.
+        Every evalscript is wrapped in its own function scope so their globals do not clash, the merged setup
+        requests the union of the input bands and one output per product. The setup fails if the products request
+        their input with different options, such as units, instead of silently applying the options of one product
+        to all of them.
+        """
+        scripts = ",\n".join(
+            _SCRIPT_TEMPLATE.replace("SCRIPT_PLACEHOLDER", product._get_evalscript())
+            for product in self.products
+        )
+        ids = json.dumps([_get_response_id(i) for i in range(len(self.products))])
+        return _EVALSCRIPT_TEMPLATE.replace("SCRIPTS_PLACEHOLDER", scripts).replace(
+            "IDS_PLACEHOLDER", ids
+        )
+
+
+def _get_response_id(index: int) -> str:
+    return f"product{index}"
+
+
+def _get_shared_payload(request: SentinelHubRequest) -> str:
+    payload = dict(request.download_list[0].post_values)
+    payload.pop("evalscript", None)
+    output = dict(payload.get("output", {}))
+    output.pop("responses", None)
+    payload["output"] = output
+    return json.dumps(payload, sort_keys=True, default=str)
+
+
+def _split_response(content: bytes) -> dict:
+    """
+    Splits the tar returned by a multi-output request into the TIFF of each response id.
+    """
+    responses = {}
+    with tarfile.open(fileobj=BytesIO(content)) as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                name = os.path.splitext(os.path.basename(member.name))[0]
+                responses[name] = tar.extractfile(member).read()
+    return responses
+
+
+_SCRIPT_TEMPLATE = """(function () {
+SCRIPT_PLACEHOLDER
+return { setup: setup, evaluatePixel: evaluatePixel };
+})()"""
+
+_EVALSCRIPT_TEMPLATE = """//VERSION=3
+var products = [
+SCRIPTS_PLACEHOLDER
+];
+var ids = IDS_PLACEHOLDER;
+
+function setup() {
+    var bands = [];
+    var input;
+    var outputs = [];
+    var mosaicking;
+    for (var i = 0; i < products.length; i++) {
+        var product_setup = products[i].setup();
+        var product_inputs = product_setup.input;
+        for (var j = 0; j < product_inputs.length; j++) {
+            var product_input = product_inputs[j];
+            // The inputs are either band names or objects listing their bands and options, e.g. the units
+            var product_bands = typeof product_input === "string" ? [product_input] : product_input.bands;
+            var options = {};
+            if (typeof product_input !== "string") {
+                for (var key in product_input) {
+                    if (key !== "bands") {
+                        options[key] = product_input[key];
+                    }
+                }
+            }
+            // The products share one input, their options cannot be merged
+            if (input === undefined) {
+                input = options;
+            } else if (getOptionsKey(input) !== getOptionsKey(options)) {
+                throw new Error("The products of the composite request their input with different options: "
+                    + getOptionsKey(input) + " and " + getOptionsKey(options));
+            }
+            for (var k = 0; k < product_bands.length; k++) {
+                if (bands.indexOf(product_bands[k]) < 0) {
+                    bands.push(product_bands[k]);
+                }
+            }
+        }
+        var output = Object.assign({}, product_setup.output);
+        output.id = ids[i];
+        outputs.push(output);
+        if (mosaicking === undefined) {
+            mosaicking = product_setup.mosaicking;
+        }
+    }
+    input.bands = bands;
+    var merged = { input: [input], output: outputs };
+    if (mosaicking !== undefined) {
+        merged.mosaicking = mosaicking;
+    }
+    return merged;
+}
+
+function getOptionsKey(options) {
+    return JSON.stringify(options, Object.keys(options).sort());
+}
+
+function evaluatePixel(samples, scenes, inputMetadata, customData, outputMetadata) {
+    var result = {};
+    for (var i = 0; i < products.length; i++) {
+        result[ids[i]] = products[i].evaluatePixel(samples, scenes, inputMetadata, customData, outputMetadata);
+    }
+    return result;
+}
+"""
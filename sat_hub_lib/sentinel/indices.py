@@ -0,0 +1,119 @@
+"""
+Vectorized versions of the computations of the Sentinel evalscripts.
+The functions follow the evalscripts operation by operation in float64, as JavaScript does, so the results match
+the ones computed by Sentinel Hub.
+"""
+
+import warnings
+import numpy as np
+
+# Sentinel-2 L2A reflectances are delivered as DN = reflectance * 10000
+S2_QUANTIFICATION_VALUE = 10000
+
+
+def to_reflectance(dn) -> np.ndarray:
+    """
+    Converts the Sentinel-2 digital numbers to the reflectances seen by the evalscripts.
+    """
+    return np.asarray(dn, dtype=np.float64) / S2_QUANTIFICATION_VALUE
+
+
+def normalized_difference(a, b, epsilon: float = 0) -> np.ndarray:
+    """
+    Returns (a - b) / (a + b + epsilon), NaN where the denominator is 0.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (a - b) / (a + b + epsilon)
+
+
+def js_round(x) -> np.ndarray:
+    """
+    Rounds like JavaScript Math.round, halves are rounded towards +infinity (numpy rounds them to even).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    floor = np.floor(x)
+    # x - floor is exact, so unlike floor(x + 0.5) no value is rounded up by the addition
+    return floor + (x - floor >= 0.5)
+
+
+def to_uint8(x) -> np.ndarray:
+    """
+    Casts like a UINT8 evalscript output, the values are rounded and clamped to [0, 255] and NaN becomes 0.
+    """
+    x = js_round(x)
+    return np.clip(np.nan_to_num(x, nan=0), 0, 255).astype(np.uint8)
+
+
+def scale_ndvi(b04, b08) -> np.ndarray:
+    """
+    Computes the NDVI product, the NDVI normalized from [-0.5, 1] to [0, 150].
+    """
+    ndvi = normalized_difference(b08, b04)
+    return to_uint8(js_round(((ndvi + 0.5) / 1.5) * 150))
+
+
+def classify_landcover(
+    b03,
+    b04,
+    b08,
+    b11,
+    ndwi_threshold: float = 0.2,
+    ndvi_grass_min: float = 0.3,
+    ndvi_trees_min: float = 0.6,
+    ndbi_building_min: float = 0.16,
+) -> np.ndarray:
+    """
+    Computes the Landcover product, see SAT_LANDCOVER_MAPCODE for the codes.
+    """
+    ndvi = normalized_difference(b08, b04, 0.00001)
+    ndwi = normalized_difference(b03, b08, 0.00001)
+    ndbi = normalized_difference(b11, b08, 0.00001)
+
+    # The first matching rule wins, as the early returns of the evalscript
+    return np.select(
+        [
+            ndwi > ndwi_threshold,
+            (ndvi > ndvi_grass_min) & (ndvi > ndvi_trees_min),
+            ndvi > ndvi_grass_min,
+            (ndvi < ndvi_grass_min) & (ndbi > ndbi_building_min),
+        ],
+        [1, 2, 3, 0],
+        default=6,
+    ).astype(np.uint8)
+
+
+def reduce_scenes(stack, statistics) -> np.ndarray:
+    """
+    Reduces a [scenes, rows, cols] stack per pixel, ignoring the NaN of the invalid scenes.
+    Args:
+        stack (np.ndarray): The values of every scene.
+        statistics (list): The names of the statistics: "avg", "min", "max", "std" (sample standard deviation)
+                           or "p<q>" for the q-th percentile, e.g. "p90".
+    Returns:
+        np.ndarray: The [statistics, rows, cols] float32 matrix, NaN where no scene is valid.
+    """
+    stack = np.asarray(stack, dtype=np.float64)
+    percentiles = [
+        float(statistic[1:]) for statistic in statistics if statistic.startswith("p")
+    ]
+    with warnings.catch_warnings():
+        # Pixels without any valid scene reduce to NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if percentiles:
+            # One pass of the sort for all the percentiles
+            percentile_values = iter(np.nanpercentile(stack, percentiles, axis=0))
+        reduced = []
+        for statistic in statistics:
+            if statistic == "avg":
+                reduced.append(np.nanmean(stack, axis=0))
+            elif statistic == "min":
+                reduced.append(np.nanmin(stack, axis=0))
+            elif statistic == "max":
+                reduced.append(np.nanmax(stack, axis=0))
+            elif statistic == "std":
+                reduced.append(np.nanstd(stack, axis=0, ddof=1))
+            elif statistic.startswith("p"):
+                reduced.append(next(percentile_values))
+            else:
+                raise ValueError(f"Unknown statistic {statistic}")
+    return np.stack(reduced).astype(np.float32)
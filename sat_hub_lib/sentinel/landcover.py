@@ -1,7 +1,8 @@
 from enum import Enum
 from .basetype_sent import SentinelBaseType, SentinelBaseSettings
+from .bands import S2Bands
+from . import indices
 from sentinelhub import SentinelHubRequest, DataCollection
-import sat_hub_lib.utils.geotiff_lib as geotiff_lib
 from sat_hub_lib.extension import IsMappable
 
 
@@ -34,13 +35,25 @@ class SAT_LANDCOVER_MAPCODE(Enum):
 
 
 class Landcover(SentinelBaseType, IsMappable):
-  
-    def __init__(self, conf: SentinelBaseSettings,ndwi_threshold=0.2,ndvi_grass_min=0.3,ndvi_trees_min=0.6,ndbi_building_min=0.16):
+
+    n_input_bands = 4
+
+    def __init__(self, conf: SentinelBaseSettings,ndwi_threshold=0.2,ndvi_grass_min=0.3,ndvi_trees_min=0.6,ndbi_building_min=0.16,local_compute=False,bands: S2Bands = None):
+      """
+      Args:
+          conf (SentinelBaseSettings): The settings of the request.
+          local_compute (bool, optional): Fetch the raw bands once and classify them locally, changing a threshold
+                                          and calling invalidate() then costs no request. Defaults to False.
+          bands (S2Bands, optional): The raw bands to classify, shared with other products. Implies local_compute.
+      """
       super().__init__(conf)
       self.ndwi_threshold = ndwi_threshold
       self.ndvi_grass_min = ndvi_grass_min
       self.ndvi_trees_min = ndvi_trees_min
       self.ndbi_building_min = ndbi_building_min
+      if bands is None and local_compute:
+          bands = S2Bands(conf)
+      self.bands = bands
       
 
     def get_default_value_map(self):
@@ -50,16 +63,28 @@ class Landcover(SentinelBaseType, IsMappable):
             SAT_LANDCOVER_MAPCODE.GRASS.code: 0.8,
         }
 
-    def write_geotiff(self, output_file: str = None):
-        if output_file is None:
-            output_file = self.get_output_file_path()
-        super().write_geotiff(output_file)
-        # Apply the color map
-        geotiff_lib.apply_colormap(output_file, SAT_LANDCOVER_MAPCODE.get_color_map())
+    def _get_colormap(self):
+        return SAT_LANDCOVER_MAPCODE.get_color_map()
 
     def extract_bandmatrix(self):
         return super().extract_bandmatrix()
 
+    def _fetch_raster(self):
+        if self.bands is None:
+            return super()._fetch_raster()
+        self.log.info("Computing Landcover from the raw bands")
+        matrix = indices.classify_landcover(
+            self.bands.get_band("B03"),
+            self.bands.get_band("B04"),
+            self.bands.get_band("B08"),
+            self.bands.get_band("B11"),
+            self.ndwi_threshold,
+            self.ndvi_grass_min,
+            self.ndvi_trees_min,
+            self.ndbi_building_min,
+        )
+        return self.bands.derive(self, matrix)
+
     def _get_input_type(self):
         return [
             SentinelHubRequest.input_data(
@@ -1,20 +1,47 @@
-from sat_hub_lib.sentinel import SentinelBaseType
+from sat_hub_lib.sentinel import SentinelBaseType, SentinelBaseSettings
+from sat_hub_lib.sentinel.bands import S2Bands
+import sat_hub_lib.sentinel.indices as indices
 import sat_hub_lib.utils.geotiff_lib as geotiff_lib
 from sentinelhub import SentinelHubRequest, DataCollection
 
 
 class NDVI(SentinelBaseType):
 
-    def write_geotiff(self, output_file: str = None):
-        if output_file is None:
-            output_file = self.get_output_file_path()
-        super().write_geotiff(output_file)
-        # Apply the color map
-        geotiff_lib.apply_colormap(output_file, self.get_color_map())
+    n_input_bands = 2
+
+    def __init__(
+        self,
+        conf: SentinelBaseSettings,
+        local_compute: bool = False,
+        bands: S2Bands = None,
+    ):
+        """
+        Args:
+            conf (SentinelBaseSettings): The settings of the request.
+            local_compute (bool, optional): Fetch the raw bands and compute the NDVI locally. Defaults to False.
+            bands (S2Bands, optional): The raw bands to compute the NDVI from, shared with other products.
+                                       Implies local_compute.
+        """
+        super().__init__(conf)
+        if bands is None and local_compute:
+            bands = S2Bands(conf)
+        self.bands = bands
+
+    def _get_colormap(self):
+        return self.get_color_map()
 
     def extract_bandmatrix(self):
         return super().extract_bandmatrix()
 
+    def _fetch_raster(self):
+        if self.bands is None:
+            return super()._fetch_raster()
+        self.log.info("Computing NDVI from the raw bands")
+        matrix = indices.scale_ndvi(
+            self.bands.get_band("B04"), self.bands.get_band("B08")
+        )
+        return self.bands.derive(self, matrix)
+
     def _get_input_type(self):
         return [
             SentinelHubRequest.input_data(
@@ -1,6 +1,4 @@
-from io import BytesIO
 import numpy as np
-import rasterio
 from .basetype_sent import SentinelBaseType, SentinelBaseSettings
 from sentinelhub import SentinelHubRequest, DataCollection, MosaickingOrder
 
@@ -14,30 +12,18 @@ class RGB(SentinelBaseType):
     def write_geotiff(self, output_file: str = None):
         if output_file is None:
             output_file = self.get_output_file_path()
-        response = self._get_response()
-
-        data_in_memory = BytesIO(response[0].content)
-        with rasterio.open(data_in_memory) as src:
-            full_data, meta = self._default_rasterio_preprocess(src)
-            _range = full_data.shape[0]
-
-            with rasterio.open(output_file, "w", **meta) as dst:
-                for i in range(1, _range + 1):
-                    band_matrix = full_data[i - 1]
-
-                    band_matrix = self.__brighten_band(band_matrix)
-
-                    dst.write(band_matrix, i)
+        full_data, meta = self._read_raster()
+        self._write_bands(output_file, self.__brighten(full_data), meta)
 
     def extract_bandmatrix(self):
-        response = self._get_response()
-        data_in_memory = BytesIO(response[0].content)
-        with rasterio.open(data_in_memory) as src:
-            band_matrix, meta = self._default_rasterio_preprocess(src)
-            # Apply factor factor=3.5 / 255 to band_matrix to brighten the image
-            for i in range(0, band_matrix.shape[0]):
-                band_matrix[i] = self.__brighten_band(band_matrix[i])
-            return band_matrix
+        band_matrix, meta = self._read_raster()
+        return self.__brighten(band_matrix)
+
+    def __brighten(self, data):
+        """
+        Returns a brightened copy of the [bands, rows, cols] matrix, the shared raster is left untouched.
+        """
+        return np.stack([self.__brighten_band(band) for band in data])
 
     def __brighten_band(self, band):
         """
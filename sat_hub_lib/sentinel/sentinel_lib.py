@@ -1,4 +1,5 @@
 import math
+from rasterio.transform import from_origin
 from sentinelhub import BBox
 
 
@@ -8,20 +9,24 @@ def calculate_dimensions(bbox, resolution):
 
     Parameters:
         bbox (tuple): A tuple representing the bounding box in the format (min_lon, min_lat, max_lon, max_lat).
-        resolution (float): The desired resolution in decimal degrees.
+        resolution (float | tuple): The desired resolution in decimal degrees, or a (lon, lat) tuple of resolutions.
 
     Returns:
         tuple: A tuple containing the width and height in pixels.
     """
     min_lon, min_lat, max_lon, max_lat = bbox
+    if isinstance(resolution, tuple):
+        res_lon, res_lat = resolution
+    else:
+        res_lon = res_lat = resolution
 
     # Calculate the width and height in degrees
     width_deg = max_lon - min_lon
     height_deg = max_lat - min_lat
 
     # Calculate the width and height in pixels
-    width_px = int(width_deg / resolution)
-    height_px = int(height_deg / resolution)
+    width_px = int(width_deg / res_lon)
+    height_px = int(height_deg / res_lat)
 
     return width_px, height_px
 
@@ -78,15 +83,196 @@ def get_resolution_degree_from_meters(bounding_box: BBox, resolution: float):
             - float: Latitudinal resolution in degrees.
             - float: Longitudinal resolution in degrees.
     """
-    lat = _meters_to_decimal_degrees(resolution, "lat")
-    lon = _meters_to_decimal_degrees(resolution, bounding_box.middle[0], "lon")
+    # The middle of a WGS84 BBox is (lon, lat)
+    lat = _meters_to_decimal_degrees(resolution, direction="lat")
+    lon = _meters_to_decimal_degrees(resolution, bounding_box.middle[1], "lon")
     return (lat, lon)
 
 
-def get_valid_resolution(bounding_box: BBox, resolution, max_pixels=2500):
-    lon, lat = get_resolution_degree_from_meters(bounding_box, resolution)
-    calculated_dim = calculate_dimensions(bounding_box, lon)
-    # TODO : Fix the resolution with a function and not with a recursive call
-    if calculated_dim[0] > max_pixels or calculated_dim[1] > max_pixels:
-        return get_valid_resolution(bounding_box, resolution + 1, max_pixels)
+def get_dimensions(bounding_box: BBox, resolution: float):
+    """
+    Calculate the width and height in pixels of a bounding box at a resolution in meters.
+
+    Args:
+        bounding_box (BBox): The bounding box, in WGS84.
+        resolution (float): The ground resolution in meters.
+
+    Returns:
+        tuple: The width and height in pixels, at least 1.
+    """
+    min_lon, min_lat, max_lon, max_lat = bounding_box
+    res_lat, res_lon = get_resolution_degree_from_meters(bounding_box, resolution)
+    width = max(1, round((max_lon - min_lon) / res_lon))
+    height = max(1, round((max_lat - min_lat) / res_lat))
+    return width, height
+
+
+def get_minimum_resolution(bounding_box: BBox, max_pixels=2500, resolution=1):
+    """
+    Calculate in closed form the finest integer resolution in meters at which the bounding box fits max_pixels.
+
+    Args:
+        bounding_box (BBox): The bounding box, in WGS84.
+        max_pixels (int): The maximum width and height in pixels.
+        resolution (int): The finest resolution to consider.
+
+    Returns:
+        int: The resolution in meters.
+    """
+    # Size of the bounding box in meters, the pixel count is inversely proportional to the resolution
+    width_m, height_m = get_dimensions(bounding_box, 1)
+    # round(size / r) <= max_pixels  <=>  r > size / (max_pixels + 0.5)
+    minimum = max(width_m, height_m) / (max_pixels + 0.5)
+    resolution = max(resolution, math.floor(minimum) + 1)
+    # Guard against the rounding of the pixel counts
+    while max(get_dimensions(bounding_box, resolution)) > max_pixels:
+        resolution += 1
     return resolution
+
+
+def get_valid_resolution(bounding_box: BBox, resolution, max_pixels=2500):
+    """
+    Returns the resolution if the bounding box fits max_pixels at it, otherwise the finest resolution that fits.
+    """
+    return get_minimum_resolution(bounding_box, max_pixels, resolution)
+
+
+class RequestPlan:
+    """
+    The plan of the Sentinel Hub requests needed to fetch a bounding box at a resolution.
+    Attributes:
+        resolution (float): The resolution in meters.
+        width (int): The width in pixels of the full grid.
+        height (int): The height in pixels of the full grid.
+        minimum_resolution (int): The finest resolution at which a single request is enough.
+        transform (Affine): The transform of the full grid.
+        tiles (list): A (BBox, (col_off, row_off, width, height)) pair for each request.
+        n_requests (int): The number of requests.
+        processing_units (float): The estimated Sentinel Hub processing units of all the requests.
+    """
+
+    def __init__(
+        self,
+        resolution,
+        width,
+        height,
+        minimum_resolution,
+        transform,
+        tiles,
+        processing_units,
+    ):
+        self.resolution = resolution
+        self.width = width
+        self.height = height
+        self.minimum_resolution = minimum_resolution
+        self.transform = transform
+        self.tiles = tiles
+        self.n_requests = len(tiles)
+        self.processing_units = processing_units
+
+    def __repr__(self):
+        return (
+            f"RequestPlan(resolution={self.resolution}, size={self.width}x{self.height}, "
+            f"minimum_resolution={self.minimum_resolution}, n_requests={self.n_requests}, "
+            f"processing_units={self.processing_units:.3f})"
+        )
+
+
+def plan_request(
+    bounding_box: BBox,
+    resolution: float,
+    max_pixels=2500,
+    n_bands=3,
+    float32=False,
+    n_samples=1,
+):
+    """
+    Plans the requests needed to fetch a bounding box at a resolution, without sending any.
+
+    Args:
+        bounding_box (BBox): The bounding box, in WGS84.
+        resolution (float): The ground resolution in meters.
+        max_pixels (int): The maximum width and height in pixels of a single request.
+        n_bands (int): The number of input bands of the evalscript.
+        float32 (bool): True if the output sample type is FLOAT32.
+        n_samples (int): The number of data samples per pixel (ORBIT or TILE mosaicking).
+
+    Returns:
+        RequestPlan: The plan of the requests.
+    """
+    transform, (width, height), tiles = split_bounding_box(
+        bounding_box, resolution, max_pixels
+    )
+    processing_units = sum(
+        estimate_processing_units(size[2], size[3], n_bands, float32, n_samples)
+        for _, size in tiles
+    )
+    return RequestPlan(
+        resolution,
+        width,
+        height,
+        get_minimum_resolution(bounding_box, max_pixels),
+        transform,
+        tiles,
+        processing_units,
+    )
+
+
+def estimate_processing_units(width, height, n_bands=3, float32=False, n_samples=1):
+    """
+    Estimate the Sentinel Hub processing units of a single request.
+    A request of 512x512 pixels with 3 input bands costs 1 PU, the area factor is at least 0.01,
+    FLOAT32 outputs cost twice as much and every additional data sample adds the same cost again.
+    """
+    area_factor = max(width * height / (512 * 512), 0.01)
+    return area_factor * (n_bands / 3) * (2 if float32 else 1) * n_samples
+
+
+def split_bounding_box(bounding_box: BBox, resolution: float, max_pixels=2500):
+    """
+    Splits a bounding box into a grid of sub bounding boxes that fit the Sentinel Hub size limit at the given resolution.
+    The sub bounding boxes are cut on pixel boundaries of the full grid, so the mosaic of their rasters is seamless.
+
+    Args:
+        bounding_box (BBox): The bounding box to split, in WGS84.
+        resolution (float): The ground resolution in meters.
+        max_pixels (int): The maximum width and height in pixels of a single request.
+
+    Returns:
+        tuple:
+            - Affine: The transform of the full grid.
+            - tuple: The (width, height) in pixels of the full grid.
+            - list: A (BBox, (col_off, row_off, width, height)) pair for each sub bounding box.
+    """
+    min_lon, min_lat, max_lon, max_lat = bounding_box
+    res_lat, res_lon = get_resolution_degree_from_meters(bounding_box, resolution)
+
+    width, height = get_dimensions(bounding_box, resolution)
+    cols = _split_range(width, max_pixels)
+    rows = _split_range(height, max_pixels)
+
+    tiles = []
+    for row_off, tile_height in rows:
+        for col_off, tile_width in cols:
+            tile_bbox = BBox(
+                (
+                    min_lon + col_off * res_lon,
+                    max_lat - (row_off + tile_height) * res_lat,
+                    min_lon + (col_off + tile_width) * res_lon,
+                    max_lat - row_off * res_lat,
+                ),
+                crs=bounding_box.crs,
+            )
+            tiles.append((tile_bbox, (col_off, row_off, tile_width, tile_height)))
+
+    transform = from_origin(min_lon, max_lat, res_lon, res_lat)
+    return transform, (width, height), tiles
+
+
+def _split_range(length: int, max_length: int):
+    """
+    Splits [0, length) into the minimum number of (offset, length) chunks not longer than max_length, of nearly equal size.
+    """
+    count = math.ceil(length / max_length)
+    edges = [round(i * length / count) for i in range(count + 1)]
+    return [(start, stop - start) for start, stop in zip(edges[:-1], edges[1:])]
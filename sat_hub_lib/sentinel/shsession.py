@@ -0,0 +1,219 @@
+import logging
+import os
+import threading
+import time
+import requests
+from sentinelhub import SHConfig, SentinelHubDownloadClient, SentinelHubSession
+from sentinelhub.download.client import DownloadClient
+
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+
+log = logging.getLogger(__name__)
+
+# Configs, sessions and clients shared by the whole process, keyed by their credentials
+_configs = {}
+_sessions = {}
+_clients = {}
+_session_locks = {}
+_lock = threading.Lock()
+
+
+class SharedSession(SentinelHubSession):
+    """
+    A Sentinel Hub OAuth session shared by several threads.
+    The token is refreshed in the background before it expires, so requests never wait for a token.
+    A failed background refresh is retried with a backoff, meanwhile an expiring token is refreshed on the next
+    request, as SentinelHubSession does. Tokens too short lived to be refreshed ahead are only refreshed by the
+    requests.
+    """
+
+    # The minimum delay between two background refreshes, in seconds
+    MIN_REFRESH_DELAY = 10
+    # The delays between the retries of a failed background refresh, in seconds
+    RETRY_DELAY = 5
+    MAX_RETRY_DELAY = 300
+
+    def __init__(
+        self,
+        config: SHConfig,
+        refresh_before_expiry: float = SentinelHubSession.DEFAULT_SECONDS_BEFORE_EXPIRY,
+    ):
+        self._token_lock = threading.Lock()
+        self._timer = None
+        self._failures = 0
+        super().__init__(config, refresh_before_expiry)
+        self._schedule_refresh()
+
+    @property
+    def token(self) -> dict:
+        with self._token_lock:
+            return SentinelHubSession.token.fget(self)
+
+    def _get_refresh_delay(self):
+        """
+        Returns the delay of the next background refresh, None if the token is too short lived to be refreshed ahead.
+        """
+        # The requests refresh the token themselves once it enters their refresh window
+        window = self._token["expires_at"] - time.time() - self.refresh_before_expiry
+        if window < 2 * self.MIN_REFRESH_DELAY:
+            return None
+        # Refresh well before the window, or half way to it for the tokens shorter lived than two windows
+        return max(window - self.refresh_before_expiry, window / 2)
+
+    def _schedule_refresh(self, delay: float = None):
+        if delay is None:
+            delay = self._get_refresh_delay()
+            if delay is None:
+                log.debug(
+                    "The Sentinel Hub token is too short lived for a background refresh"
+                )
+                return
+        self._timer = threading.Timer(delay, self._refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh(self):
+        try:
+            token = self._collect_new_token()
+        except Exception as e:
+            self._failures += 1
+            delay = min(
+                self.RETRY_DELAY * 2 ** (self._failures - 1), self.MAX_RETRY_DELAY
+            )
+            log.warning(
+                f"Background refresh of the Sentinel Hub token failed, retry in {delay} s: {e}"
+            )
+            self._schedule_refresh(delay)
+            return
+        with self._token_lock:
+            self._token = token
+        self._failures = 0
+        log.debug("Sentinel Hub token refreshed")
+        self._schedule_refresh()
+
+    def close(self):
+        """
+        Stops the background refresh.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class SharedDownloadClient(SentinelHubDownloadClient):
+    """
+    A Sentinel Hub download client shared by several threads.
+    The rate limit of Sentinel Hub is tracked by one object per client, sharing the client makes every thread wait
+    when any of them is rate limited instead of each one hitting the limit on its own.
+    The requests go through a pool of keep-alive connections instead of a new connection per request.
+    """
+
+    def __init__(
+        self, max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS, **kwargs
+    ):
+        super().__init__(**kwargs)
+        # The base client creates and drops its lock at every download, which breaks with concurrent downloads
+        self.lock = threading.Lock()
+        self.http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_pool_connections, pool_maxsize=max_pool_connections
+        )
+        self.http_session.mount("https://", adapter)
+        self.http_session.mount("http://", adapter)
+
+    def download(self, *args, **kwargs):
+        return DownloadClient.download(self, *args, **kwargs)
+
+    def _do_download(self, request):
+        if request.url is None:
+            raise ValueError(f"Faulty request {request}, no URL specified.")
+
+        return self.http_session.request(
+            request.request_type.value,
+            url=request.url,
+            json=request.post_values,
+            headers=self._prepare_headers(request),
+            timeout=self.config.download_timeout_seconds,
+        )
+
+
+def _get_key(config: SHConfig) -> tuple:
+    return (
+        os.getpid(),
+        config.sh_client_id,
+        config.sh_client_secret,
+        config.sh_base_url,
+        config.sh_token_url,
+    )
+
+
+def get_config(
+    client_id: str,
+    client_secret: str,
+    sh_base_url: str = None,
+    sh_token_url: str = None,
+) -> SHConfig:
+    """
+    Returns the Sentinel Hub config of the credentials, shared by the whole process.
+    The config is shared, it must not be modified.
+    Args:
+        client_id (str): The Sentinel Hub OAuth client id.
+        client_secret (str): The Sentinel Hub OAuth client secret.
+        sh_base_url (str, optional): The base url of the Sentinel Hub services. Defaults to the sentinelhub one.
+        sh_token_url (str, optional): The url of the OAuth token endpoint. Defaults to the sentinelhub one.
+    Returns:
+        SHConfig: The config.
+    """
+    key = (os.getpid(), client_id, client_secret, sh_base_url, sh_token_url)
+    with _lock:
+        config = _configs.get(key)
+        if config is None:
+            config = SHConfig()
+            config.sh_client_id = client_id
+            config.sh_client_secret = client_secret
+            if sh_base_url is not None:
+                config.sh_base_url = sh_base_url
+            if sh_token_url is not None:
+                config.sh_token_url = sh_token_url
+            _configs[key] = config
+        return config
+
+
+def get_session(config: SHConfig) -> SharedSession:
+    """
+    Returns the OAuth session of the credentials of the config, shared by the whole process.
+    The token is fetched once and refreshed in the background.
+    """
+    key = _get_key(config)
+    with _lock:
+        session = _sessions.get(key)
+        if session is not None:
+            return session
+        key_lock = _session_locks.setdefault(key, threading.Lock())
+
+    # The token is fetched under the lock of the credentials only, the other credentials are not blocked
+    with key_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = SharedSession(config)
+            with _lock:
+                _sessions[key] = session
+        return session
+
+
+def get_download_client(config: SHConfig) -> SharedDownloadClient:
+    """
+    Returns the download client of the credentials of the config, shared by the whole process.
+    The client uses the shared OAuth session and a pool of keep-alive connections.
+    """
+    key = _get_key(config)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    session = get_session(config)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = SharedDownloadClient(config=config, session=session)
+            _clients[key] = client
+        return client
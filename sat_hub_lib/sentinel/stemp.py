@@ -1,9 +1,110 @@
-from .basetype_sent import SentinelBaseType
+import datetime
+from io import BytesIO
+import numpy as np
+import rasterio
+from .basetype_sent import SentinelBaseType, SentinelBaseSettings
+from . import indices
 from sentinelhub import SentinelHubRequest, DataCollection
 
 
 class STemp(SentinelBaseType):
 
+    n_input_bands = 4
+
+    def __init__(self, conf: SentinelBaseSettings, statistics: tuple = None):
+        """
+        Args:
+            conf (SentinelBaseSettings): The settings of the request.
+            statistics (tuple, optional): The statistics of the land surface temperature in °C computed locally
+                                          from the temperature of every orbit, e.g. ("avg", "max", "std", "p90"),
+                                          see indices.reduce_scenes. Defaults to None, the red temperature
+                                          visualisation of the average computed by Sentinel Hub.
+        """
+        super().__init__(conf)
+        self.statistics = tuple(statistics) if statistics is not None else None
+
+    @property
+    def float32_output(self):
+        return self.statistics is not None
+
+    @property
+    def n_samples(self):
+        # ORBIT mosaicking, Sentinel-3 sees every point about once a day
+        start = datetime.date.fromisoformat(str(self.timeIntervalStart)[:10])
+        end = datetime.date.fromisoformat(str(self.timeIntervalEnd)[:10])
+        return max((end - start).days + 1, 1)
+
+    def get_lst(self) -> np.ndarray:
+        """
+        Returns the [orbits, rows, cols] land surface temperature in °C of every orbit, NaN where the orbit is not
+        valid. Only available with statistics and a single request, the tiles of a tiled request see their own
+        orbits, so band k is not the same acquisition in every tile, only the statistics are supported then.
+        Raises:
+            ValueError: If no statistics are requested, or the request is split into several tiles.
+        """
+        if self.statistics is None:
+            raise ValueError("The temperatures are only fetched when statistics are requested.")
+        if self.tiled and self.get_request_plan().n_requests > 1:
+            raise ValueError(
+                "The orbits of a tiled request are not aligned across the tiles, "
+                "only the statistics of extract_bandmatrix are supported."
+            )
+        return self._get_orbits_lst().copy()
+
+    def extract_bandmatrix(self):
+        if self.statistics is None:
+            return super().extract_bandmatrix()
+        # The reductions are per pixel, so the orbits of every tile are reduced on their own
+        return indices.reduce_scenes(self._get_orbits_lst(), self.statistics)
+
+    def _get_orbits_lst(self) -> np.ndarray:
+        data, meta = self._read_raster()
+        return data
+
+    def write_geotiff(self, output_file: str = None):
+        if self.statistics is None:
+            return super().write_geotiff(output_file)
+        if output_file is None:
+            output_file = self.get_output_file_path()
+
+        data = self.extract_bandmatrix()
+        _, meta = self._read_raster()
+        meta.update(count=data.shape[0], dtype=rasterio.float32, nodata=np.nan)
+        self._write_bands(output_file, data, meta)
+
+    def _decode_response(self, content: bytes):
+        if self.statistics is None:
+            return super()._decode_response(content)
+        with rasterio.open(BytesIO(content)) as src:
+            self.geotiff_meta = src.meta
+            self.geotiff_trasform = src.transform
+            meta = src.meta.copy()
+            meta.update(driver="GTiff")
+            return src.read(), meta
+
+    def _mosaic_tiles(self, plan, contents: list):
+        if self.statistics is None:
+            return super()._mosaic_tiles(plan, contents)
+        # The tiles may see a different number of orbits, the missing ones are NaN, the bands of the
+        # tiles are stacked by position and not by date so only the per pixel reductions are meaningful
+        tiles = [self._decode_response(content) for content in contents]
+        count = max(data.shape[0] for data, meta in tiles)
+        data = np.full((count, plan.height, plan.width), np.nan, dtype=np.float32)
+        for (_, (col_off, row_off, tile_width, tile_height)), (tile, meta) in zip(
+            plan.tiles, tiles
+        ):
+            data[
+                : tile.shape[0],
+                row_off : row_off + tile_height,
+                col_off : col_off + tile_width,
+            ] = tile
+        meta.update(
+            height=plan.height, width=plan.width, count=count, transform=plan.transform
+        )
+        self.geotiff_meta = meta
+        self.geotiff_trasform = plan.transform
+        return data, meta.copy()
+
     def _get_input_type(self):
         return [
             SentinelHubRequest.input_data(
@@ -21,6 +122,8 @@ class STemp(SentinelBaseType):
         ]
 
     def _get_evalscript(self):
+        if self.statistics is not None:
+            return _LST_EVALSCRIPT
         return """
             // VERSION 3
             /**
@@ -189,3 +292,81 @@ class STemp(SentinelBaseType):
             return viz.process(outLST);
             }
     """
+
+
+# Outputs the land surface temperature in °C of every orbit in FLOAT32, NaN for the orbits with errors.
+# The computation is the one of the visualisation script of STemp, the reductions over time are done locally.
+_LST_EVALSCRIPT = """
+//VERSION=3
+var NDVIs = 0.2;
+var NDVIv = 0.8;
+
+// emissivity
+var waterE = 0.991;
+var soilE = 0.966;
+var vegetationE = 0.973;
+var C = 0.009;
+
+//central/mean wavelength in meters, Sentinel-3 SLSTR B08
+var bCent = 0.000010854;
+
+// rho =h*c/sigma=PlanckC*velocityLight/BoltzmannC
+var rho = 0.01438; // m K
+
+function setup() {
+    return {
+        input: [
+            { datasource: "S3SLSTR", bands: ["S8"] },
+            { datasource: "S3OLCI", bands: ["B06", "B08", "B17"] }],
+        output: [
+            { id: "default", bands: 1, sampleType: SampleType.FLOAT32 }
+        ],
+        mosaicking: "ORBIT"
+    };
+}
+
+// One band per orbit
+function updateOutput(outputs, collection) {
+    outputs.default.bands = Math.max(collection.S3SLSTR.scenes.length, 1);
+}
+
+function LSEcalc(NDVI, Pv) {
+    if (NDVI < 0) {
+        return waterE;
+    } else if (NDVI < NDVIs) {
+        return soilE;
+    } else if (NDVI > NDVIv) {
+        return vegetationE;
+    }
+    return vegetationE * Pv + soilE * (1 - Pv) + C;
+}
+
+function evaluatePixel(samples) {
+    var N = Math.max(samples.S3SLSTR.length, 1);
+    var LSTarray = [];
+    for (let i = 0; i < N; i++) {
+        var slstr = samples.S3SLSTR[i];
+        var olci = samples.S3OLCI[i];
+        if (!slstr || !olci) {
+            LSTarray.push(NaN);
+            continue;
+        }
+        var Bi = slstr.S8;
+        var B06i = olci.B06;
+        var B08i = olci.B08;
+        var B17i = olci.B17;
+
+        // some images have errors, whole area is either B10<173K or B10>65000K, or B06 and B17 = 0
+        if ((Bi > 173 && Bi < 65000) && (B06i > 0 && B08i > 0 && B17i > 0)) {
+            var S8BTi = Bi - 273.15;
+            var NDVIi = (B17i - B08i) / (B17i + B08i);
+            var PVi = Math.pow(((NDVIi - NDVIs) / (NDVIv - NDVIs)), 2);
+            var LSEi = LSEcalc(NDVIi, PVi);
+            LSTarray.push(S8BTi / (1 + (((bCent * S8BTi) / rho) * Math.log(LSEi))));
+        } else {
+            LSTarray.push(NaN);
+        }
+    }
+    return LSTarray;
+}
+"""
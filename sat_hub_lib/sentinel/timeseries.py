@@ -0,0 +1,243 @@
+import copy
+import datetime
+import json
+import os
+import threading
+import numpy as np
+from sentinelhub import SentinelHubCatalog
+from .basetype_sent import SentinelBaseType, SentinelBaseSettings
+from . import batch
+from sat_hub_lib.utils.simplecache import atomic_filename
+
+
+class TimeSeriesStore:
+    """
+    An on-disk store of the slices of a time series, one .npy file per slice.
+    The index records the product and the grid of the slices, and when each slice was fetched, a slice fetched
+    before its end date may miss acquisitions and is fetched again.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self._index_filename = os.path.join(folder, "index.json")
+        self._lock = threading.Lock()
+        self._index = {"grid": None, "slices": {}}
+        if os.path.exists(self._index_filename):
+            with open(self._index_filename) as f:
+                self._index = json.load(f)
+
+    def check_product(self, product: dict):
+        """
+        Checks that the slices fetched now are of the product of the stored ones.
+        Raises:
+            ValueError: If the stored slices are of another product type or product parameters,
+                        e.g. other Landcover thresholds.
+        """
+        self._check("product", product)
+
+    def check_grid(self, grid: dict):
+        """
+        Checks that the slices fetched now are on the grid of the stored ones.
+        Raises:
+            ValueError: If the stored slices are on another grid, e.g. another bounding box or resolution.
+        """
+        self._check("grid", grid)
+
+    def _check(self, name: str, value: dict):
+        with self._lock:
+            if self._index.get(name) is None:
+                self._index[name] = value
+            elif self._index[name] != value:
+                raise ValueError(
+                    f"The store {self.folder} holds slices of another {name}: {self._index[name]}"
+                )
+
+    def is_complete(self, time_slice: tuple) -> bool:
+        entry = self._index["slices"].get(_get_slice_key(time_slice))
+        if entry is None:
+            return False
+        fetched_at = datetime.date.fromisoformat(entry["fetched_at"])
+        return fetched_at > datetime.date.fromisoformat(time_slice[1])
+
+    def get(self, time_slice: tuple) -> np.ndarray:
+        """
+        Returns the [bands, rows, cols] matrix of a slice, memory mapped.
+        """
+        entry = self._index["slices"][_get_slice_key(time_slice)]
+        return np.load(os.path.join(self.folder, entry["file"]), mmap_mode="r")
+
+    def put(self, time_slice: tuple, data: np.ndarray):
+        key = _get_slice_key(time_slice)
+        filename = f"{time_slice[0]}_{time_slice[1]}.npy"
+        with atomic_filename(os.path.join(self.folder, filename)) as temp_filename:
+            with open(temp_filename, "wb") as f:
+                np.save(f, data)
+        with self._lock:
+            self._index["slices"][key] = {
+                "file": filename,
+                "fetched_at": datetime.date.today().isoformat(),
+            }
+            with atomic_filename(self._index_filename) as temp_filename:
+                with open(temp_filename, "w") as f:
+                    json.dump(self._index, f, indent=1)
+
+
+class TimeSeries:
+    """
+    Fetches a Sentinel product over consecutive slices of a time interval as a (time, band, rows, cols) cube.
+    The interval is split every N days or per acquisition date, the slices are fetched concurrently.
+    With a store only the slices missing from it are fetched, so a monitoring job extending the end date
+    downloads only the new slices.
+
+    Example:
+        series = TimeSeries(NDVI, conf, days=7, store_folder="cache/ndvi_weekly")
+        slices, cube = series.fetch()
+    """
+
+    def __init__(
+        self,
+        product_type: type,
+        conf: SentinelBaseSettings,
+        days: int = None,
+        store_folder: str = None,
+        max_threads: int = 4,
+        **product_kwargs,
+    ):
+        """
+        Args:
+            product_type (type): The SentinelBaseType subclass to fetch, e.g. NDVI.
+            conf (SentinelBaseSettings): The settings of the product, start_date and end_date bound the series.
+            days (int, optional): The length in days of the slices, None for one slice per acquisition date.
+            store_folder (str, optional): The folder of the on-disk store of the slices. Defaults to None (no store).
+            max_threads (int, optional): The maximum number of slices fetched concurrently. Defaults to 4.
+            product_kwargs: The other arguments of the product, e.g. the thresholds of Landcover.
+        """
+        if days is not None and days < 1:
+            raise ValueError("The slices must be at least one day long.")
+        self.product_type = product_type
+        self.conf = conf
+        self.days = days
+        self.max_threads = max_threads
+        self.product_kwargs = product_kwargs
+        self.store = None
+        if store_folder:
+            self.store = TimeSeriesStore(store_folder)
+            self.store.check_product(self._get_product())
+
+    def get_slices(self) -> list:
+        """
+        Returns the (start, end) dates of the slices, both included, as ISO strings.
+        """
+        start = datetime.date.fromisoformat(str(self.conf.start_date)[:10])
+        end = datetime.date.fromisoformat(str(self.conf.end_date)[:10])
+        if self.days is None:
+            dates = self._search_acquisitions(start, end)
+            return [(date, date) for date in dates]
+
+        slices = []
+        step = datetime.timedelta(days=self.days)
+        while start <= end:
+            slice_end = min(start + step - datetime.timedelta(days=1), end)
+            slices.append((start.isoformat(), slice_end.isoformat()))
+            start += step
+        return slices
+
+    def fetch(self):
+        """
+        Fetches the slices missing from the store and returns the whole series.
+        Returns:
+            tuple: The list of (start, end) slices and the (time, band, rows, cols) cube.
+        """
+        slices = self.get_slices()
+        missing = [
+            time_slice
+            for time_slice in slices
+            if self.store is None or not self.store.is_complete(time_slice)
+        ]
+        products = {}
+        for time_slice in missing:
+            product = self._make_product(time_slice)
+            products[id(product)] = (time_slice, product)
+
+        fetched = {}
+        for result in batch.iter_fetch(
+            [product for _, product in products.values()], max_threads=self.max_threads
+        ):
+            if not result.ok:
+                raise result.error
+            time_slice, product = products[id(result.product)]
+            data, meta = product._read_raster()
+            if self.store is not None:
+                self.store.check_grid(_get_grid(meta))
+                self.store.put(time_slice, data)
+            else:
+                fetched[time_slice] = data
+
+        if not slices:
+            return slices, None
+        cube = np.stack(
+            [
+                fetched[time_slice] if time_slice in fetched else self.store.get(time_slice)
+                for time_slice in slices
+            ]
+        )
+        return slices, cube
+
+    def _get_product(self) -> dict:
+        """
+        Returns the product type and parameters recorded in the store, as they are read back from json.
+        """
+        product = {
+            "type": f"{self.product_type.__module__}.{self.product_type.__qualname__}",
+            "cloud_coverage": self.conf.cloud_coverage,
+            "kwargs": self.product_kwargs,
+        }
+        # Products passed as arguments, e.g. the shared bands of Landcover, are recorded by their type
+        return json.loads(
+            json.dumps(
+                product,
+                sort_keys=True,
+                default=lambda value: f"{type(value).__module__}.{type(value).__qualname__}",
+            )
+        )
+
+    def _make_product(self, time_slice: tuple) -> SentinelBaseType:
+        conf = copy.copy(self.conf)
+        conf.start_date, conf.end_date = time_slice
+        return self.product_type(conf, **self.product_kwargs)
+
+    def _search_acquisitions(self, start: datetime.date, end: datetime.date) -> list:
+        """
+        Returns the dates with at least one acquisition of the first input of the product, from the catalog.
+        """
+        product = self._make_product((start.isoformat(), end.isoformat()))
+        input_data = product._get_input_type()[0]
+        search_filter = None
+        max_cloud_coverage = input_data.get("dataFilter", {}).get("maxCloudCoverage")
+        if max_cloud_coverage is not None:
+            search_filter = f"eo:cloud_cover <= {max_cloud_coverage}"
+
+        catalog = SentinelHubCatalog(config=product.config)
+        dates = catalog.search(
+            input_data["type"],
+            bbox=product.sat_hub_bounding_box,
+            time=(start.isoformat(), end.isoformat()),
+            filter=search_filter,
+            distinct="date",
+        )
+        return sorted(set(dates))
+
+
+def _get_slice_key(time_slice: tuple) -> str:
+    return f"{time_slice[0]}/{time_slice[1]}"
+
+
+def _get_grid(meta: dict) -> dict:
+    return {
+        "width": meta["width"],
+        "height": meta["height"],
+        "count": meta["count"],
+        "crs": str(meta["crs"]),
+        "transform": list(meta["transform"])[:6],
+    }
@@ -0,0 +1,62 @@
+import os
+import threading
+import boto3
+import botocore
+import botocore.client
+
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+
+# Sessions and clients shared by the whole process, keyed by their settings
+_sessions = {}
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_session() -> boto3.session.Session:
+    """
+    Returns the boto3 session of the current process.
+    The session is created once per process, a forked child gets its own.
+    """
+    pid = os.getpid()
+    with _lock:
+        session = _sessions.get(pid)
+        if session is None:
+            session = boto3.session.Session()
+            _sessions[pid] = session
+        return session
+
+
+def get_s3_client(
+    region_name: str,
+    unsigned: bool = True,
+    max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+):
+    """
+    Returns an S3 client shared by the whole process.
+    Clients are thread safe, so every caller asking for the same region, signing mode and pool size
+    reuses the same client and its pool of keep-alive connections.
+    Args:
+        region_name (str): The AWS region of the client.
+        unsigned (bool, optional): Send unsigned requests, for public buckets. Defaults to True.
+        max_pool_connections (int, optional): The size of the connection pool. Defaults to 32.
+    Returns:
+        botocore.client.S3: The S3 client.
+    """
+    key = (os.getpid(), region_name, unsigned, max_pool_connections)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    session = get_session()
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            config = botocore.client.Config(max_pool_connections=max_pool_connections)
+            if unsigned:
+                config = config.merge(
+                    botocore.client.Config(signature_version=botocore.UNSIGNED)
+                )
+            # Creating clients from the same session is not thread safe, it is done under the lock
+            client = session.client("s3", region_name=region_name, config=config)
+            _clients[key] = client
+        return client
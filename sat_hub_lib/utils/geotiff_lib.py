@@ -1,5 +1,11 @@
+from contextlib import ExitStack, contextmanager
+import math
+import tempfile
 import rasterio
-from rasterio.windows import from_bounds
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.windows import Window, from_bounds
 from shapely import Polygon
 from rasterio.io import MemoryFile
 import os
@@ -10,60 +16,310 @@ from scipy.interpolate import interp1d
 # Set the environment variable to disable signing requests for public S3 buckets
 os.environ["AWS_NO_SIGN_REQUEST"] = "YES"
 
+# Creation options of the GeoTIFF outputs, the predictor is chosen from the data type when not set
+OUTPUT_PROFILES = {
+    # Plain striped and uncompressed GeoTIFF
+    "gtiff": {},
+    # Internally tiled and compressed GeoTIFF
+    "tiled": {
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+        "compress": "deflate",
+        "num_threads": "ALL_CPUS",
+    },
+    # Cloud-Optimized GeoTIFF with internal overviews
+    "cog": {
+        "driver": "COG",
+        "blocksize": 512,
+        "compress": "deflate",
+        "num_threads": "ALL_CPUS",
+        "overviews": "auto",
+    },
+}
 
-def extract_boundingbox_into_tiff(geotiff_uri, output_file: str, bbox: Polygon):
+
+def get_output_profile(profile, dtype) -> dict:
+    """
+    Resolves an output profile into the creation options of the output GeoTIFF.
+    Args:
+        profile (str | dict): The name of a profile in OUTPUT_PROFILES or a dict of creation options,
+                              "driver" can be "GTiff" (default) or "COG". None is the plain "gtiff" profile.
+        dtype (str): The data type of the output, used to choose the predictor.
+    Returns:
+        dict: The creation options, including the driver.
+    Raises:
+        ValueError: If the profile name is unknown.
+    """
+    if profile is None:
+        profile = "gtiff"
+    if isinstance(profile, str):
+        if profile not in OUTPUT_PROFILES:
+            raise ValueError(
+                f"Unknown output profile {profile}, use one of {list(OUTPUT_PROFILES)}"
+            )
+        profile = OUTPUT_PROFILES[profile]
+
+    options = {"driver": "GTiff", **profile}
+    compress = str(options.get("compress", "")).lower()
+    if compress in ("deflate", "zstd", "lzw") and "predictor" not in options:
+        if options["driver"] == "COG":
+            # The COG driver picks the floating point predictor by itself
+            options["predictor"] = "yes"
+        else:
+            options["predictor"] = 3 if np.issubdtype(dtype, np.floating) else 2
+    return options
+
+
+@contextmanager
+def open_output_geotiff(output_file: str, meta: dict, profile=None, colormap=None):
     """
-    Extracts a bounding box from a list of TIFF files or rasterio DatasetReader objects and saves the result to a new GeoTIFF file.
-        tiff_files (list): List of (paths to the input TIFF files | list of s3 urls)
+    Opens the output GeoTIFF for writing with the creation options of an output profile.
+    The colormap, if any, is written to the first band before the file is closed, so no second open is needed.
+    The COG driver cannot write blocks directly, in that case the data is written to a temporary tiled GeoTIFF
+    that is converted to a COG when the block exits.
+    Args:
+        output_file (str): Path to the output GeoTIFF file.
+        meta (dict): The metadata of the output (width, height, count, dtype, crs, transform...).
+        profile (str | dict, optional): The output profile, see get_output_profile. Defaults to plain GeoTIFF.
+        colormap (dict, optional): A dictionary mapping pixel values to RGB(A) colors.
+    Yields:
+        rasterio.io.DatasetWriter: The dataset to write to.
+    """
+    options = get_output_profile(profile, meta["dtype"])
+    driver = options.pop("driver")
+    meta = {**meta, "driver": "GTiff"}
+
+    if driver == "COG":
+        with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(output_file) or "."
+        ) as temp_dir:
+            temp_file = os.path.join(temp_dir, "temp.tif")
+            with rasterio.open(
+                temp_file, "w", **meta, tiled=True, blockxsize=512, blockysize=512
+            ) as dst:
+                yield dst
+                if colormap is not None:
+                    dst.write_colormap(1, colormap)
+            rasterio.shutil.copy(temp_file, output_file, driver="COG", **options)
+    else:
+        with rasterio.open(output_file, "w", **{**meta, **options}) as dst:
+            yield dst
+            if colormap is not None:
+                dst.write_colormap(1, colormap)
+
+
+def extract_boundingbox_into_tiff(
+    geotiff_uri,
+    output_file: str,
+    bbox: Polygon,
+    block_size: int = 1024,
+    opener=None,
+    decimation: int = 1,
+    resampling: Resampling = Resampling.mode,
+    profile=None,
+    colormap: dict = None,
+):
+    """
+    Extracts a bounding box from a list of TIFF files and mosaics the result into a single GeoTIFF file.
+    The output grid is computed once from the bounding box, then the intersecting window of every source
+    is copied block by block into the output dataset, so peak memory depends on block_size and not on the
+    size of the bounding box.
+        geotiff_uri (list): List of (paths to the input TIFF files | list of s3 urls)
         output_file (str): Path to the output file where the extracted bounding box will be saved.
         bbox (Polygon): A shapely Polygon object representing the bounding box to extract.
+        block_size (int, optional): Size in output pixels of the square blocks copied at once. Defaults to 1024.
+        opener (callable, optional): A custom opener passed to rasterio.open to read the sources.
+        decimation (int, optional): The number of source pixels per output pixel along each axis. Defaults to 1.
+        resampling (Resampling, optional): The resampling used when decimation > 1, the overviews of the sources
+                                           are used when available. Defaults to Resampling.mode (categorical data).
+        profile (str | dict, optional): The output profile, see get_output_profile. Defaults to plain GeoTIFF.
+        colormap (dict, optional): A colormap written to the first band of the output.
     Returns:
         Affine: The transform of the output GeoTIFF file
+        dict: The metadata of the output GeoTIFF file
     """
-    for geotiff_str in geotiff_uri:
-        # Check if the input is a path to a file or a rasterio DatasetReader object
-        with rasterio.open(geotiff_str, "r") as geotiff:
-            # Calculate the window to read the subset
-            window = from_bounds(*bbox.bounds, transform=geotiff.transform)
-            # Read the subset
-            subset = geotiff.read(window=window)
-            transform = geotiff.window_transform(window)
-
-            # Define metadata for the new file
-            out_meta = geotiff.meta.copy()
-            out_meta.update(
-                {
-                    "driver": "GTiff",
-                    "height": subset.shape[1],
-                    "width": subset.shape[2],
-                    "transform": transform,
-                }
+    with ExitStack() as stack:
+        geotiffs = [
+            stack.enter_context(rasterio.open(uri, "r", opener=opener))
+            for uri in geotiff_uri
+        ]
+        transform, width, height = _get_mosaic_grid(geotiffs, bbox, decimation)
+
+        # Define metadata for the new file
+        out_meta = geotiffs[0].meta.copy()
+        out_meta.update(
+            {
+                "driver": "GTiff",
+                "height": height,
+                "width": width,
+                "transform": transform,
+            }
+        )
+
+        with open_output_geotiff(output_file, out_meta, profile, colormap) as dest:
+            for geotiff in geotiffs:
+                for src_window, dst_window in _iter_mosaic_blocks(
+                    geotiff, transform, width, height, block_size, decimation
+                ):
+                    subset = geotiff.read(
+                        window=src_window,
+                        out_shape=(geotiff.count, dst_window.height, dst_window.width),
+                        resampling=resampling,
+                    )
+                    dest.write(subset, window=dst_window)
+            out_meta = dest.meta
+        return out_meta["transform"], out_meta
+
+
+def _get_mosaic_grid(geotiffs, bbox: Polygon, decimation: int = 1):
+    """
+    Computes the output grid of a mosaic covering the bounding box.
+    The grid is snapped to the pixel grid of the first dataset, all the datasets must share its CRS and resolution.
+    With a decimation the grid is also snapped to multiples of decimation pixels from the origin of the first dataset,
+    so the output pixels line up with the tile seams when the decimation divides the tile size.
+    Args:
+        geotiffs (list): List of opened rasterio DatasetReader objects.
+        bbox (Polygon): A shapely Polygon object representing the bounding box to extract.
+        decimation (int, optional): The number of source pixels per output pixel along each axis. Defaults to 1.
+    Returns:
+        tuple: The transform, the width and the height of the output grid.
+    Raises:
+        ValueError: If the datasets do not share the same CRS and resolution.
+    """
+    reference = geotiffs[0]
+    for geotiff in geotiffs[1:]:
+        if geotiff.crs != reference.crs or not np.allclose(geotiff.res, reference.res):
+            raise ValueError(
+                f"Cannot mosaic {geotiff.name} with {reference.name}: CRS and resolution must match"
             )
 
-            # Save the subset to a new GeoTIFF
-            with rasterio.open(output_file, "w", **out_meta) as dest:
-                dest.write(subset)
-    # Return the transform of the output GeoTIFF
-    with rasterio.open(output_file, "r+") as src:
-        return src.transform, src.meta
+    window = from_bounds(*bbox.bounds, transform=reference.transform)
+    # Round before snapping so floating point noise does not add a pixel row/column
+    col_start = math.floor(round(window.col_off, 6) / decimation) * decimation
+    row_start = math.floor(round(window.row_off, 6) / decimation) * decimation
+    col_stop = math.ceil(round(window.col_off + window.width, 6) / decimation) * decimation
+    row_stop = math.ceil(round(window.row_off + window.height, 6) / decimation) * decimation
+    window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+    transform = reference.window_transform(window) * Affine.scale(decimation)
+    return (
+        transform,
+        int(window.width) // decimation,
+        int(window.height) // decimation,
+    )
+
+
+def _iter_mosaic_blocks(
+    geotiff,
+    transform,
+    width: int,
+    height: int,
+    block_size: int,
+    decimation: int = 1,
+):
+    """
+    Yields the blocks of a dataset that intersect the output grid of a mosaic.
+    An output pixel is taken from the dataset holding its first source pixel.
+    Args:
+        geotiff (rasterio.io.DatasetReader): The source dataset, aligned with the output grid.
+        transform (Affine): The transform of the output grid.
+        width (int): The width of the output grid.
+        height (int): The height of the output grid.
+        block_size (int): Size in output pixels of the square blocks.
+        decimation (int, optional): The number of source pixels per output pixel along each axis. Defaults to 1.
+    Yields:
+        tuple: The (source window, destination window) pair of each block.
+    """
+    # Position of the dataset origin in the output grid, in source pixels
+    col_off = round((geotiff.transform.c - transform.c) / geotiff.transform.a)
+    row_off = round((geotiff.transform.f - transform.f) / geotiff.transform.e)
 
+    # Output pixels whose first source pixel is inside the dataset
+    col_start = max(-(-col_off // decimation), 0)
+    col_stop = min(-(-(col_off + geotiff.width) // decimation), width)
+    row_start = max(-(-row_off // decimation), 0)
+    row_stop = min(-(-(row_off + geotiff.height) // decimation), height)
+
+    for row in range(row_start, row_stop, block_size):
+        block_height = min(block_size, row_stop - row)
+        src_row = row * decimation - row_off
+        src_height = min(block_height * decimation, geotiff.height - src_row)
+        for col in range(col_start, col_stop, block_size):
+            block_width = min(block_size, col_stop - col)
+            src_col = col * decimation - col_off
+            src_width = min(block_width * decimation, geotiff.width - src_col)
+            yield (
+                Window(src_col, src_row, src_width, src_height),
+                Window(col, row, block_width, block_height),
+            )
 
-def extract_boundingbox_into_matrix(geotiffs, bbox: Polygon):
+
+def extract_boundingbox_into_matrix(
+    geotiffs,
+    bbox: Polygon,
+    out: np.ndarray = None,
+    block_size: int = 1024,
+    opener=None,
+    decimation: int = 1,
+    resampling: Resampling = Resampling.mode,
+):
     """
-    Extracts a bounding box from a list of TIFF files or rasterio DatasetReader objects and returns the result as a matrix.
-        geotiffs (list): List of (paths to the input TIFF files | rasterio DatasetReader objects)
+    Extracts a bounding box from a list of TIFF files and returns the mosaicked result as a matrix.
+    The intersecting window of every source is read straight into one preallocated array, no file is written.
+        geotiffs (list): List of (paths to the input TIFF files | list of s3 urls)
         bbox (Polygon): A shapely Polygon object representing the bounding box to extract.
+        out (np.ndarray, optional): A [bands, rows, cols] array to read into, it must match the shape of the output grid
+                                    and the data type of the sources, it is filled with nodata first.
+                                    If not provided, a new array is allocated.
+        block_size (int, optional): Size in output pixels of the square blocks read at once. Defaults to 1024.
+        opener (callable, optional): A custom opener passed to rasterio.open to read the sources.
+        decimation (int, optional): The number of source pixels per output pixel along each axis. Defaults to 1.
+        resampling (Resampling, optional): The resampling used when decimation > 1, the overviews of the sources
+                                           are used when available. Defaults to Resampling.mode (categorical data).
     Returns:
         np.array: The matrix containing the extracted bounding box.
-        Affine: The transform of the output GeoTIFF file
+        Affine: The transform of the output matrix
+        dict: The metadata of the output matrix
+    Raises:
+        ValueError: If the out array does not match the shape or the data type of the output grid.
     """
-    import tempfile
+    with ExitStack() as stack:
+        geotiffs = [
+            stack.enter_context(rasterio.open(uri, "r", opener=opener))
+            for uri in geotiffs
+        ]
+        transform, width, height = _get_mosaic_grid(geotiffs, bbox, decimation)
+
+        out_meta = geotiffs[0].meta.copy()
+        out_meta.update(
+            {
+                "driver": "GTiff",
+                "height": height,
+                "width": width,
+                "transform": transform,
+            }
+        )
+
+        shape = (out_meta["count"], height, width)
+        if out is None:
+            out = np.empty(shape, dtype=out_meta["dtype"])
+        elif out.shape != shape:
+            raise ValueError(f"out has shape {out.shape}, expected {shape}")
+        elif out.dtype != np.dtype(out_meta["dtype"]):
+            raise ValueError(f"out has dtype {out.dtype}, expected {out_meta['dtype']}")
+        # Areas not covered by any source keep the nodata value like in a GeoTIFF
+        out.fill(out_meta["nodata"] or 0)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        memory_file = os.path.join(temp_dir, "temp.tif")
-        extract_boundingbox_into_tiff(geotiffs, memory_file, bbox)
-        with rasterio.open(memory_file, "r") as src:
-            return src.read(), src.transform, src.meta
+        for geotiff in geotiffs:
+            for src_window, dst_window in _iter_mosaic_blocks(
+                geotiff, transform, width, height, block_size, decimation
+            ):
+                rows, cols = dst_window.toslices()
+                geotiff.read(
+                    window=src_window, out=out[:, rows, cols], resampling=resampling
+                )
+        return out, transform, out_meta
 
 
 def tiff_to_png(input_file, output_file):
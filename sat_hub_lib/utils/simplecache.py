@@ -1,22 +1,289 @@
 from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import io
 import os
-import boto3
-import botocore
+import sqlite3
+import tempfile
+import threading
+import time
+from boto3.s3.transfer import TransferConfig
 import logging
+from sat_hub_lib.utils import awsclient
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(lock_filename):
+    """
+    Holds an exclusive lock on a file, blocking until it is available.
+    The lock is shared between threads and processes so it can guard the fill of a cache entry.
+    """
+    with open(lock_filename, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def atomic_filename(filename):
+    """
+    Yields a temporary path next to filename, it is renamed to filename only if the block succeeds.
+    Readers therefore never see a partially written file.
+    """
+    fd, temp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or ".",
+        prefix=f".{os.path.basename(filename)}.",
+        suffix=".part",
+    )
+    os.close(fd)
+    try:
+        yield temp_filename
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+class CacheStats:
+    """
+    Thread safe counters of the activity of a cache in the current process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_downloaded": self.bytes_downloaded,
+                "evictions": self.evictions,
+                "bytes_evicted": self.bytes_evicted,
+            }
 
 
 class SimpleCache(ABC):
+    """
+    Base class of the file caches.
+    The accesses to the cached files are recorded in a small sqlite index inside the cache folder,
+    shared by all the processes using the folder. When max_bytes is set, the least recently used
+    (or least frequently used) files are evicted after each fill until the cache fits the budget.
+    The files in use can be pinned, the pinned files are never evicted by the current process.
+    Attributes:
+        cache_folder (str): The folder of the cached files.
+        max_bytes (int): The size budget of the cache in bytes, None for an unbounded cache.
+        eviction_policy (str): "lru" or "lfu".
+        stats (CacheStats): The hit/miss/byte counters of the current process.
+    """
 
-    def __init__(self, cache_folder):
+    index_filename = ".cache_index.sqlite3"
+    lock_folder = ".locks"
+
+    def __init__(self, cache_folder, max_bytes: int = None, eviction_policy="lru"):
         self.log = logging.getLogger(type(self).__name__)
         self.cache_folder = cache_folder
         if not os.path.exists(self.cache_folder):
             os.makedirs(self.cache_folder)
+        os.makedirs(os.path.join(self.cache_folder, self.lock_folder), exist_ok=True)
+        if eviction_policy not in ("lru", "lfu"):
+            raise ValueError(f"Unsupported eviction policy {eviction_policy}")
+        self.max_bytes = max_bytes
+        self.eviction_policy = eviction_policy
+        self.stats = CacheStats()
+        # The number of pins of each pinned file of the current process
+        self._pinned = Counter()
+        self._pinned_lock = threading.Lock()
+        with self._index() as index:
+            index.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "filename TEXT PRIMARY KEY, size INTEGER, last_access REAL, accesses INTEGER)"
+            )
 
     @abstractmethod
     def get(self, key):
         pass
 
+    def get_size(self) -> int:
+        """
+        Returns the size in bytes of the files recorded in the index.
+        """
+        with self._index() as index:
+            return index.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters of the current process and the size of the cache.
+        """
+        return {**self.stats.as_dict(), "size": self.get_size(), "max_bytes": self.max_bytes}
+
+    @contextmanager
+    def pinned(self, local_filenames):
+        """
+        Protects the files from the eviction while the block runs, the pins can be nested.
+        """
+        filenames = [os.path.abspath(filename) for filename in local_filenames]
+        with self._pinned_lock:
+            self._pinned.update(filenames)
+        try:
+            yield
+        finally:
+            with self._pinned_lock:
+                self._pinned.subtract(filenames)
+                self._pinned += Counter()  # Drop the files without pins
+
+    @contextmanager
+    def _index(self):
+        index = sqlite3.connect(
+            os.path.join(self.cache_folder, self.index_filename), timeout=60
+        )
+        try:
+            with index:
+                yield index
+        finally:
+            index.close()
+
+    def _get_lock_filename(self, local_filename) -> str:
+        """
+        Returns the lock file guarding the fill of a cached file.
+        The locks are kept in one subfolder of the cache and deleted with the file they guard.
+        """
+        return os.path.join(
+            self.cache_folder, self.lock_folder, f"{os.path.basename(local_filename)}.lock"
+        )
+
+    def _remove_lock(self, local_filename):
+        # A fill racing with the deletion may download the file twice, the atomic writes keep it consistent
+        try:
+            os.remove(self._get_lock_filename(local_filename))
+        except OSError:  # Missing, or held by another process on Windows
+            pass
+
+    def _record_hit(self, local_filename):
+        self.stats.add(hits=1)
+        self._touch([local_filename])
+
+    def _record_fill(self, local_filename):
+        self._record_fills([local_filename])
+
+    def _record_fills(self, local_filenames):
+        """
+        Records the fill of many files in one transaction, then evicts once if the cache exceeds its budget.
+        """
+        size = self._touch(local_filenames)
+        self.stats.add(misses=len(local_filenames), bytes_downloaded=size)
+        if self.max_bytes is not None:
+            self._evict(keep=local_filenames)
+
+    def _touch(self, local_filenames) -> int:
+        """
+        Records an access to cached files in one transaction, files cached before the index existed are added on
+        their first access and files deleted meanwhile are skipped.
+        Returns:
+            int: The size in bytes of the files.
+        """
+        now = time.time()
+        entries = []
+        for local_filename in local_filenames:
+            filename = os.path.abspath(local_filename)
+            try:
+                entries.append((filename, os.path.getsize(filename), now))
+            except FileNotFoundError:
+                continue
+        if not entries:
+            return 0
+        with self._index() as index:
+            index.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, 1) ON CONFLICT(filename) "
+                "DO UPDATE SET size = excluded.size, last_access = excluded.last_access, "
+                "accesses = accesses + 1",
+                entries,
+            )
+        return sum(size for _, size, _ in entries)
+
+    def _evict(self, keep=()):
+        """
+        Deletes the least recently (or frequently) used files until the cache fits max_bytes.
+        The pinned files and the files in keep are not deleted, the cache stays above the budget if they do not
+        fit in it.
+        """
+        order = "last_access" if self.eviction_policy == "lru" else "accesses, last_access"
+        with self._pinned_lock:
+            protected = set(self._pinned)
+        protected.update(os.path.abspath(filename) for filename in keep)
+        with self._index() as index:
+            size = index.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if size <= self.max_bytes:
+                return
+            for filename, file_size in index.execute(
+                f"SELECT filename, size FROM entries ORDER BY {order}"
+            ).fetchall():
+                if size <= self.max_bytes:
+                    break
+                if filename in protected:
+                    continue
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+                self._remove_lock(filename)
+                index.execute("DELETE FROM entries WHERE filename = ?", (filename,))
+                size -= file_size
+                self.stats.add(evictions=1, bytes_evicted=file_size)
+                self.log.info(f"Evicted {filename} ({file_size} bytes)")
+            if size > self.max_bytes:
+                self.log.warning(
+                    f"The files in use ({size} bytes) do not fit the cache budget of {self.max_bytes} bytes"
+                )
+
+
+class CacheResult:
+    """
+    The result of retrieving a single key from a cache.
+    Attributes:
+        key (str): The requested key.
+        local_filename (str): The path of the cached file.
+        hit (bool): True if the file was already in the cache.
+        error (Exception): The error raised while retrieving the key, None on success.
+    """
+
+    def __init__(self, key, local_filename, hit=False, error=None):
+        self.key = key
+        self.local_filename = local_filename
+        self.hit = hit
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
 
 class S3Cache(SimpleCache):
     """
@@ -24,26 +291,394 @@ class S3Cache(SimpleCache):
     Attributes:
         s3_client (boto3.client): The S3 client used to interact with the S3 service.
         bucket_name (str): The name of the S3 bucket.
+        transfer_config (TransferConfig): The multipart transfer settings used for the downloads.
+        max_workers (int): The maximum number of keys downloaded concurrently by get_many.
     Methods:
         __init__(cache_folder, bucket_name, region_name):
             Initializes the S3Cache with the specified cache folder, bucket name, and region name.
         get(key, local_filename):
             Retrieves the file from the cache if it exists locally, otherwise downloads it from the S3 bucket.
+        get_many(keys, local_filenames):
+            Retrieves many files, the missing ones are downloaded concurrently.
     """
 
-    def __init__(self, cache_folder, bucket_name, region_name):
-        super().__init__(cache_folder)
-        self.s3_client = boto3.client(
-            "s3",
-            region_name=region_name,
-            config=botocore.client.Config(signature_version=botocore.UNSIGNED),
-        )
+    def __init__(
+        self,
+        cache_folder,
+        bucket_name,
+        region_name,
+        max_workers: int = 8,
+        multipart_chunksize: int = 16 * 1024 * 1024,
+        max_concurrency: int = 4,
+        s3_client=None,
+        max_bytes: int = None,
+        eviction_policy="lru",
+    ):
+        super().__init__(cache_folder, max_bytes, eviction_policy)
+        if s3_client is None:
+            s3_client = awsclient.get_s3_client(region_name)
+        self.s3_client = s3_client
         self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+        )
+
+    def get(self, key, local_filename=None):
+        if local_filename is None:
+            local_filename = self.get_local_filename(key)
+        self._fetch(key, local_filename)
+        return local_filename
+
+    def get_many(self, keys, local_filenames=None) -> dict:
+        """
+        Retrieves many files from the cache, the missing ones are downloaded concurrently.
+        The files are pinned until get_many returns, pin them with pinned() to keep them while reading them.
+        Args:
+            keys (list): The keys of the files in the S3 bucket.
+            local_filenames (list, optional): The local paths of the files, one for each key.
+                                              Defaults to the key file name inside the cache folder.
+        Returns:
+            dict: A CacheResult for each key, the errors are reported in the results and not raised.
+        """
+        if local_filenames is None:
+            local_filenames = [self.get_local_filename(key) for key in keys]
 
-    def get(self, key, local_filename):
-        if not os.path.exists(local_filename):
+        results = {}
+        # The files of the batch are pinned, so the fills of the batch do not evict each other
+        with self.pinned(local_filenames):
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    executor.submit(self._fetch, key, local_filename): (
+                        key,
+                        local_filename,
+                    )
+                    for key, local_filename in zip(keys, local_filenames)
+                }
+                for future in as_completed(futures):
+                    key, local_filename = futures[future]
+                    try:
+                        results[key] = CacheResult(
+                            key, local_filename, hit=future.result()
+                        )
+                    except Exception as e:
+                        self.log.error(f"Failed to get {key} : {e}")
+                        results[key] = CacheResult(key, local_filename, error=e)
+
+            # Another process sharing the cache folder may still have evicted a file of the batch
+            for result in results.values():
+                if result.ok and not os.path.exists(result.local_filename):
+                    result.error = FileNotFoundError(
+                        f"{result.local_filename} was evicted from the cache"
+                    )
+        return results
+
+    def get_local_filename(self, key):
+        return os.path.join(self.cache_folder, os.path.basename(key))
+
+    def _fetch(self, key, local_filename) -> bool:
+        """
+        Downloads the key if it is not in the cache.
+        Returns:
+            bool: True on a cache hit, False if the file was downloaded.
+        """
+        if os.path.exists(local_filename):
+            self.log.info(f"Cache hit : {key}")
+            self._record_hit(local_filename)
+            return True
+
+        # Only one process downloads the key, the others wait for it and then hit the cache
+        with file_lock(self._get_lock_filename(local_filename)):
+            if os.path.exists(local_filename):
+                self.log.info(f"Cache hit : {key} (filled by another process)")
+                self._record_hit(local_filename)
+                return True
             self.log.info(f"Cache miss : Downloading {key} to {local_filename}")
-            self.s3_client.download_file(self.bucket_name, key, local_filename)
-        else:
+            with atomic_filename(local_filename) as temp_filename:
+                self.s3_client.download_file(
+                    self.bucket_name, key, temp_filename, Config=self.transfer_config
+                )
+            self._record_fill(local_filename)
+        return False
+
+
+class ResponseCache(SimpleCache):
+    """
+    A content-addressed cache of responses, stored as files named after their key.
+    Attributes:
+        ttl (float): The time to live of the responses in seconds, None for responses that never expire.
+    Methods:
+        get(key, fetch):
+            Returns the cached response of the key, calling fetch to produce it on a miss.
+        purge_expired():
+            Deletes the expired responses.
+    """
+
+    def __init__(
+        self,
+        cache_folder,
+        ttl: float = None,
+        max_bytes: int = None,
+        eviction_policy="lru",
+    ):
+        super().__init__(cache_folder, max_bytes, eviction_policy)
+        self.ttl = ttl
+
+    def get(self, key, fetch) -> bytes:
+        """
+        Returns the cached response of the key.
+        On a miss fetch() is called to produce the response. Identical concurrent requests, from threads or processes,
+        wait for the one in-flight fetch instead of fetching again.
+        """
+        local_filename = os.path.join(self.cache_folder, key)
+        content = self._read_fresh(local_filename)
+        if content is not None:
             self.log.info(f"Cache hit : {key}")
-        return local_filename
+            self._record_hit(local_filename)
+            return content
+
+        with file_lock(self._get_lock_filename(local_filename)):
+            content = self._read_fresh(local_filename)
+            if content is not None:
+                self.log.info(f"Cache hit : {key} (filled by another request)")
+                self._record_hit(local_filename)
+                return content
+
+            self.log.info(f"Cache miss : {key}")
+            content = fetch()
+            with atomic_filename(local_filename) as temp_filename:
+                with open(temp_filename, "wb") as f:
+                    f.write(content)
+            self._record_fill(local_filename)
+        if self.ttl is not None:
+            self.purge_expired()
+        return content
+
+    def purge_expired(self):
+        """
+        Deletes the responses older than the time to live, and their locks.
+        """
+        if self.ttl is None:
+            return
+        with self._index() as index:
+            for (filename,) in index.execute("SELECT filename FROM entries").fetchall():
+                try:
+                    if not self._is_expired(filename):
+                        continue
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+                self._remove_lock(filename)
+                index.execute("DELETE FROM entries WHERE filename = ?", (filename,))
+
+    def _is_expired(self, filename) -> bool:
+        return self.ttl is not None and time.time() - os.path.getmtime(filename) > self.ttl
+
+    def _read_fresh(self, local_filename):
+        try:
+            if self._is_expired(local_filename):
+                return None
+            with open(local_filename, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class S3BlockCache(SimpleCache):
+    """
+    A cache of the byte blocks of files in an S3 bucket.
+    Instead of downloading whole files, only the blocks covering the requested byte ranges are fetched with ranged
+    GETs and stored in the cache folder, keyed by (key, block index). Cloud-Optimized GeoTIFFs keep each internal
+    tile (and overview) contiguous, so a windowed read through this cache moves only the tiles intersecting the window.
+    Attributes:
+        s3_client (boto3.client): The S3 client used to interact with the S3 service.
+        bucket_name (str): The name of the S3 bucket.
+        block_size (int): The size in bytes of the cached blocks.
+    Methods:
+        get(key):
+            Returns a file-like object reading the key through the cache.
+        opener(key, mode):
+            The same as get, with the signature expected by the opener argument of rasterio.open.
+    """
+
+    def __init__(
+        self,
+        cache_folder,
+        bucket_name,
+        region_name,
+        block_size: int = 256 * 1024,
+        s3_client=None,
+        max_bytes: int = None,
+        eviction_policy="lru",
+    ):
+        super().__init__(cache_folder, max_bytes, eviction_policy)
+        if s3_client is None:
+            s3_client = awsclient.get_s3_client(region_name)
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.block_size = block_size
+        with self._index() as index:
+            index.execute(
+                "CREATE TABLE IF NOT EXISTS file_sizes (key TEXT PRIMARY KEY, size INTEGER)"
+            )
+
+    def get(self, key):
+        return S3BlockFile(self, key)
+
+    def opener(self, key, mode="rb"):
+        if "r" not in mode or "+" in mode:
+            raise ValueError(f"{type(self).__name__} is read only, got mode {mode}")
+        return self.get(key)
+
+    def get_block_folder(self, key):
+        return os.path.join(self.cache_folder, "blocks", key.replace("/", "_"))
+
+    def get_file_size(self, key) -> int:
+        """
+        Returns the size of the key, it is requested once and then stored in the index of the cache.
+        """
+        with self._index() as index:
+            row = index.execute(
+                "SELECT size FROM file_sizes WHERE key = ?", (key,)
+            ).fetchone()
+        if row is not None:
+            return row[0]
+
+        size = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)[
+            "ContentLength"
+        ]
+        with self._index() as index:
+            index.execute("INSERT OR REPLACE INTO file_sizes VALUES (?, ?)", (key, size))
+        return size
+
+    def read_blocks(
+        self, key, first: int, last: int, file_size: int, accessed: set = None
+    ) -> list:
+        """
+        Returns the content of the blocks first..last (included) of the key.
+        The missing blocks are fetched with a single ranged GET per run of consecutive missing blocks, the index is
+        updated once per call.
+        Args:
+            accessed (set, optional): Collects the blocks hit instead of recording them in the index, so a reader
+                                      can record all its hits at once, see S3BlockFile.
+        """
+        block_folder = self.get_block_folder(key)
+        blocks = {}
+        hits = []
+        missing = []
+        for index in range(first, last + 1):
+            block_filename = os.path.join(block_folder, str(index))
+            try:
+                with open(block_filename, "rb") as f:
+                    blocks[index] = f.read()
+                hits.append(block_filename)
+            except FileNotFoundError:
+                missing.append(index)
+        self.stats.add(hits=len(hits))
+        if accessed is not None:
+            accessed.update(hits)
+        else:
+            self._touch(hits)
+
+        # Group the missing blocks into runs of consecutive blocks
+        runs = []
+        for index in missing:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+
+        filled = []
+        for run_first, run_last in runs:
+            start = run_first * self.block_size
+            end = min((run_last + 1) * self.block_size, file_size) - 1
+            self.log.info(f"Cache miss : Fetching bytes {start}-{end} of {key}")
+            content = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=key, Range=f"bytes={start}-{end}"
+            )["Body"].read()
+            os.makedirs(block_folder, exist_ok=True)
+            for index in range(run_first, run_last + 1):
+                offset = (index - run_first) * self.block_size
+                blocks[index] = content[offset : offset + self.block_size]
+                block_filename = os.path.join(block_folder, str(index))
+                with atomic_filename(block_filename) as temp_filename:
+                    with open(temp_filename, "wb") as f:
+                        f.write(blocks[index])
+                filled.append(block_filename)
+        if filled:
+            self._record_fills(filled)
+
+        return [blocks[index] for index in range(first, last + 1)]
+
+
+class S3BlockFile(io.RawIOBase):
+    """
+    A read-only file-like object over a key of an S3BlockCache.
+    The last block read is kept in memory, so the many small reads of a TIFF header hit the disk only once.
+    The blocks hit are recorded in the index of the cache once, when the file is closed.
+    """
+
+    def __init__(self, cache: S3BlockCache, key):
+        super().__init__()
+        self.cache = cache
+        self.key = key
+        self.size = cache.get_file_size(key)
+        self.position = 0
+        self._last_block = (None, b"")
+        self._accessed = set()
+
+    def close(self):
+        if not self.closed:
+            accessed, self._accessed = self._accessed, set()
+            self.cache._touch(accessed)
+        super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b""
+
+        block_size = self.cache.block_size
+        first = self.position // block_size
+        last = (self.position + size - 1) // block_size
+        if first == last and self._last_block[0] == first:
+            blocks = [self._last_block[1]]
+        else:
+            blocks = self.cache.read_blocks(
+                self.key, first, last, self.size, self._accessed
+            )
+            self._last_block = (last, blocks[-1])
+
+        start = self.position - first * block_size
+        data = b"".join(blocks)[start : start + size]
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import numpy as np
+
+
+class TileIndex:
+    """
+    A compact spatial index of the tiles of a grid.
+    The bounds of every tile are kept in a single [tiles, 4] array so an intersection query is a few vectorized
+    comparisons instead of building a shapely geometry for every tile.
+    Attributes:
+        names (np.ndarray): The names of the tiles.
+        bounds (np.ndarray): The (minx, miny, maxx, maxy) bounds of the tiles.
+    """
+
+    def __init__(self, names, bounds):
+        self.names = np.asarray(names, dtype=str)
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+
+    @classmethod
+    def from_geojson(cls, geojson: dict, name_property: str):
+        """
+        Builds the index from a geojson FeatureCollection of polygons.
+        Args:
+            geojson (dict): The parsed geojson.
+            name_property (str): The feature property holding the name of the tile.
+        Returns:
+            TileIndex: The index of the tiles.
+        """
+        names = []
+        bounds = []
+        for feature in geojson["features"]:
+            coordinates = np.asarray(feature["geometry"]["coordinates"][0])
+            names.append(feature["properties"][name_property])
+            bounds.append((*coordinates.min(axis=0)[:2], *coordinates.max(axis=0)[:2]))
+        return cls(names, bounds)
+
+    @classmethod
+    def load(cls, filename: str):
+        with np.load(filename) as index:
+            return cls(index["names"], index["bounds"])
+
+    def save(self, filename: str):
+        """
+        Saves the index to a .npz file, the file is replaced atomically.
+        """
+        fd, temp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(filename) or ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, names=self.names, bounds=self.bounds)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+    def query(self, minx: float, miny: float, maxx: float, maxy: float) -> list:
+        """
+        Returns the names of the tiles intersecting the bounding box, touching tiles included.
+        """
+        bounds = self.bounds
+        mask = (
+            (bounds[:, 0] <= maxx)
+            & (bounds[:, 2] >= minx)
+            & (bounds[:, 1] <= maxy)
+            & (bounds[:, 3] >= miny)
+        )
+        return self.names[mask].tolist()
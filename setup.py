@@ -18,4 +18,7 @@ setup(
         'sentinelhub==3.11.0',
         'sympy==1.13.3'
     ],
+    extras_require={
+        'test': ['pytest', 'moto[s3]'],
+    },
 )
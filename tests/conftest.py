@@ -0,0 +1,129 @@
+import io
+import re
+import tarfile
+import numpy as np
+import pytest
+import rasterio
+import requests
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds, from_origin
+from sat_hub_lib.sentinel import SentinelBaseSettings
+from sat_hub_lib.sentinel.shsession import SharedDownloadClient
+
+
+def make_tiff(width: int, height: int, count: int = 1, dtype: str = "uint8") -> bytes:
+    data = np.arange(count * width * height).reshape(count, height, width)
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=count,
+            dtype=dtype,
+            crs="EPSG:4326",
+            transform=from_bounds(10.0, 45.0, 10.01, 45.01, width, height),
+        ) as dst:
+            dst.write(data.astype(dtype))
+        return memfile.read()
+
+
+# Pixel size in degrees of the ESA World Cover tiles, about 10 meters
+TILE_RES = 1 / 12000
+
+
+def write_tile(path, west: float, north: float, data: np.ndarray, nodata=0) -> str:
+    """
+    Writes a [bands, rows, cols] or [rows, cols] matrix as an EPSG:4326 GeoTIFF on the ESA World Cover pixel grid.
+    """
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[2],
+        height=data.shape[1],
+        count=data.shape[0],
+        dtype=data.dtype,
+        crs="EPSG:4326",
+        transform=from_origin(west, north, TILE_RES, TILE_RES),
+        nodata=nodata,
+    ) as dst:
+        dst.write(data)
+    return str(path)
+
+
+class FakeSentinelHubClient(SharedDownloadClient):
+    """
+    Answers the process requests with TIFFs of the requested size, the number of bands and the sample type of the
+    outputs of the evalscript. The download logic of sentinelhub runs unchanged.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    def _get_session_headers(self):
+        return {}
+
+    def _do_download(self, request):
+        self.calls += 1
+        output = request.post_values["output"]
+        width, height = output.get("width", 8), output.get("height", 8)
+        evalscript = request.post_values["evalscript"]
+        # One (bands, sampleType) per evalscript, in the order of the responses, AUTO is UINT8
+        outputs = re.findall(
+            r'output:\s*\{\s*bands:\s*(\d+)(?:,\s*sampleType:\s*"(\w+)")?', evalscript
+        )
+        tiffs = [
+            make_tiff(width, height, int(bands), (sample_type or "uint8").lower())
+            for bands, sample_type in outputs
+        ]
+
+        response = requests.Response()
+        response.status_code = 200
+        if len(output["responses"]) == 1:
+            response.headers["Content-Type"] = "image/tiff"
+            response._content = tiffs[0]
+        else:
+            response.headers["Content-Type"] = "application/x-tar"
+            content = io.BytesIO()
+            with tarfile.open(fileobj=content, mode="w") as tar:
+                for response_output, tiff in zip(output["responses"], tiffs):
+                    info = tarfile.TarInfo(f"{response_output['identifier']}.tif")
+                    info.size = len(tiff)
+                    tar.addfile(info, io.BytesIO(tiff))
+            response._content = content.getvalue()
+        return response
+
+
+@pytest.fixture
+def sentinel_conf():
+    def make_conf(**kwargs) -> SentinelBaseSettings:
+        return SentinelBaseSettings(
+            point1=(45.0, 10.0),
+            point2=(45.01, 10.01),
+            client_id="id",
+            client_secret="secret",
+            start_date="2024-06-01",
+            end_date="2024-06-30",
+            resolution=100,
+            **kwargs,
+        )
+
+    return make_conf
+
+
+@pytest.fixture
+def fake_client(sentinel_conf):
+    """
+    Makes the products fetch their requests through a fake Sentinel Hub, see FakeSentinelHubClient.
+    """
+
+    def use_fake_client(*products):
+        client = FakeSentinelHubClient(config=products[0].config)
+        for product in products:
+            product.download_client = client
+        return client
+
+    return use_fake_client
@@ -0,0 +1,31 @@
+import threading
+import botocore
+from sat_hub_lib.utils import awsclient
+
+
+def test_clients_are_shared_per_settings():
+    client = awsclient.get_s3_client("eu-central-1")
+
+    assert awsclient.get_s3_client("eu-central-1") is client
+    assert awsclient.get_s3_client("eu-west-1") is not client
+    assert awsclient.get_s3_client("eu-central-1", max_pool_connections=8) is not client
+    assert client.meta.config.signature_version == botocore.UNSIGNED
+    assert client.meta.config.max_pool_connections == awsclient.DEFAULT_MAX_POOL_CONNECTIONS
+
+
+def test_concurrent_callers_get_one_client(monkeypatch):
+    monkeypatch.setattr(awsclient, "_clients", {})
+    barrier = threading.Barrier(8)
+    clients = []
+
+    def get_client():
+        barrier.wait()
+        clients.append(awsclient.get_s3_client("eu-central-1", max_pool_connections=16))
+
+    threads = [threading.Thread(target=get_client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in clients}) == 1
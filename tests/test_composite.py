@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from sat_hub_lib.sentinel import NDVI, Composite, Landcover, S2Bands
+
+
+def test_products_with_different_input_options_are_rejected(sentinel_conf):
+    conf = sentinel_conf()
+    with pytest.raises(ValueError, match="options"):
+        Composite(conf, [S2Bands(conf), NDVI(conf)])
+
+
+@pytest.mark.parametrize("tiled", [False, True])
+def test_products_are_decoded_with_their_own_dtype(sentinel_conf, fake_client, tiled):
+    conf = sentinel_conf(tiled=tiled)
+    bands, other_bands = S2Bands(conf), S2Bands(conf, bands=("B04", "B08"))
+    composite = Composite(conf, [bands, other_bands])
+    if tiled:
+        for product in (composite, bands, other_bands):
+            product.max_resolution_allowed = 4
+    client = fake_client(composite, bands, other_bands)
+
+    composite.fetch()
+
+    for product in (bands, other_bands):
+        data, meta = product._read_raster()
+        assert data.dtype == np.uint16
+        assert meta["dtype"] == np.uint16
+        assert meta["count"] == data.shape[0] == len(product.bands)
+    calls = client.calls
+    # The products are memoized by the composite request
+    bands.extract_bandmatrix()
+    assert client.calls == calls
+
+
+def test_composite_matches_the_standalone_products(sentinel_conf, fake_client):
+    conf = sentinel_conf()
+    ndvi, landcover = NDVI(conf), Landcover(conf)
+    composite = Composite(conf, [ndvi, landcover])
+    fake_client(composite, ndvi, landcover)
+    composite.fetch()
+
+    for product_type, product in ((NDVI, ndvi), (Landcover, landcover)):
+        standalone = product_type(conf)
+        fake_client(standalone)
+        expected, expected_meta = standalone._read_raster()
+        data, meta = product._read_raster()
+        np.testing.assert_array_equal(data, expected)
+        assert meta["dtype"] == expected_meta["dtype"]
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from scipy import signal
+from sat_hub_lib.extension import convolution, kernels
+
+FUNCTIONS = ["1-(x/r)**o", "1", "exp(-(x/r)**2)"]
+SHAPES = [(120, 97), (21, 40), (3, 60), (1, 1)]
+
+
+def _get_methods(kernel):
+    costs = convolution._estimate_costs((10, 10), kernel)
+    return [method for method in convolution.METHODS if method in costs]
+
+
+@pytest.mark.parametrize("function", FUNCTIONS)
+@pytest.mark.parametrize("meter_radius", [30, 25, 200])
+@pytest.mark.parametrize("shape", SHAPES)
+def test_methods_equal_fftconvolve(function, meter_radius, shape):
+    kernel = kernels.get_kernel(function, meter_radius, 1, 10)
+    image = np.random.default_rng(0).random(shape)
+    expected = signal.fftconvolve(image, kernel, mode="same")
+
+    for method in _get_methods(kernel):
+        result = convolution.convolve_same(image, kernel, method)
+        assert result.shape == image.shape
+        np.testing.assert_allclose(result, expected, atol=1e-9, err_msg=method)
+
+
+def test_applicable_methods():
+    assert _get_methods(kernels.get_kernel("1", 200, 1, 10)) == list(
+        convolution.METHODS
+    )
+    assert "separable" in _get_methods(kernels.get_kernel("exp(-(x/r)**2)", 200, 1, 10))
+    cone = kernels.get_kernel("1-(x/r)**o", 200, 1, 10)
+    assert _get_methods(cone) == ["direct", "fft"]
+    with pytest.raises(ValueError):
+        convolution.convolve_same(np.ones((20, 20)), cone, "separable")
+    with pytest.raises(ValueError):
+        convolution.convolve_same(np.ones((20, 20)), cone, "summed_area")
+
+
+def test_choose_method():
+    shape = (2000, 2000)
+
+    assert convolution.choose_method(shape, np.ones((1, 1))) == "direct"
+    assert (
+        convolution.choose_method(shape, kernels.get_kernel("1", 2000, 1, 10))
+        == "summed_area"
+    )
+    assert (
+        convolution.choose_method(
+            shape, kernels.get_kernel("exp(-(x/r)**2)", 30, 1, 10)
+        )
+        == "separable"
+    )
+    assert (
+        convolution.choose_method(shape, kernels.get_kernel("1-(x/r)**o", 2000, 1, 10))
+        == "fft"
+    )
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        convolution.convolve_same(np.ones((5, 5)), np.ones((3, 3)), "winograd")
@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+import numpy as np
+import pytest
+from conftest import TILE_RES, write_tile
+from sat_hub_lib.geotiff.s3 import S3_EsaWorldCover
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 111_320
+
+
+def _make_product(tmp_path, monkeypatch, **kwargs) -> S3_EsaWorldCover:
+    data = np.random.default_rng(0).choice([10, 30, 50], (240, 240)).astype(np.uint8)
+    tile = write_tile(tmp_path / "tile.tif", 0.0, 0.02, data)
+    product = S3_EsaWorldCover(
+        (0.015, 0.001),
+        (0.003, 0.012),
+        version=2,
+        cache_folder=str(tmp_path / "cache"),
+        **kwargs,
+    )
+
+    @contextmanager
+    def get_geotiffs():
+        yield [tile]
+
+    monkeypatch.setattr(product, "_get_geotiffs", get_geotiffs)
+    return product
+
+
+@pytest.mark.parametrize(
+    "target_resolution, decimation", [(None, 1), (10, 1), (20, 2), (60, 6)]
+)
+def test_resolution_matches_the_matrix(
+    tmp_path, monkeypatch, target_resolution, decimation
+):
+    product = _make_product(tmp_path, monkeypatch, target_resolution=target_resolution)
+
+    matrix = product.extract_bandmatrix()
+
+    assert product.decimation == decimation
+    assert product.resolution == S3_EsaWorldCover.native_resolution * decimation
+    assert product.geotiff_trasform.a == pytest.approx(TILE_RES * decimation)
+    pixel_meters = -product.geotiff_trasform.e * METERS_PER_DEGREE
+    assert pixel_meters == pytest.approx(product.resolution, rel=0.1)
+    assert matrix.shape[1:] == (
+        round(0.012 / TILE_RES / decimation),
+        round(0.011 / TILE_RES / decimation),
+    )
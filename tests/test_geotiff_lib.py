@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+import rasterio
+from shapely import box
+from conftest import TILE_RES, write_tile
+from sat_hub_lib.utils import geotiff_lib
+
+
+@pytest.fixture
+def two_tiles(tmp_path):
+    """
+    Two 60x60 tiles side by side and their mosaic.
+    """
+    rng = np.random.default_rng(0)
+    west = rng.integers(1, 100, (60, 60)).astype(np.uint8)
+    east = rng.integers(1, 100, (60, 60)).astype(np.uint8)
+    return [
+        write_tile(tmp_path / "west.tif", 0.0, 0.01, west),
+        write_tile(tmp_path / "east.tif", 60 * TILE_RES, 0.01, east),
+    ], np.hstack([west, east])
+
+
+def _get_bbox(col_start, row_start, col_stop, row_stop):
+    return box(
+        col_start * TILE_RES,
+        0.01 - row_stop * TILE_RES,
+        col_stop * TILE_RES,
+        0.01 - row_start * TILE_RES,
+    )
+
+
+def test_out_is_filled_with_nodata(two_tiles):
+    tiles, _ = two_tiles
+    # The bounding box spills 20 rows below the tiles
+    bbox = _get_bbox(10, 50, 110, 80)
+    out = np.full((1, 30, 100), 255, dtype=np.uint8)
+
+    matrix, _, _ = geotiff_lib.extract_boundingbox_into_matrix(tiles, bbox, out=out)
+
+    assert matrix is out
+    assert (out[:, 10:] == 0).all()
+    assert (out[:, :10] != 255).all()
+
+
+def test_out_must_match_the_grid(two_tiles):
+    tiles, _ = two_tiles
+    bbox = _get_bbox(10, 10, 110, 40)
+
+    with pytest.raises(ValueError, match="shape"):
+        geotiff_lib.extract_boundingbox_into_matrix(
+            tiles, bbox, out=np.zeros((1, 30, 99), dtype=np.uint8)
+        )
+    with pytest.raises(ValueError, match="dtype"):
+        geotiff_lib.extract_boundingbox_into_matrix(
+            tiles, bbox, out=np.zeros((1, 30, 100), dtype=np.float32)
+        )
+
+
+@pytest.mark.parametrize("block_size", [1024, 16])
+def test_mosaic_across_the_seam(tmp_path, two_tiles, block_size):
+    tiles, mosaic = two_tiles
+    output_file = str(tmp_path / "output.tif")
+
+    transform, meta = geotiff_lib.extract_boundingbox_into_tiff(
+        tiles, output_file, _get_bbox(10, 5, 110, 45), block_size=block_size
+    )
+    matrix, matrix_transform, _ = geotiff_lib.extract_boundingbox_into_matrix(
+        tiles, _get_bbox(10, 5, 110, 45), block_size=block_size
+    )
+
+    with rasterio.open(output_file) as src:
+        data = src.read()
+    np.testing.assert_array_equal(data[0], mosaic[5:45, 10:110])
+    np.testing.assert_array_equal(matrix, data)
+    assert transform == matrix_transform
+    assert transform.c == pytest.approx(10 * TILE_RES)
+    assert (meta["width"], meta["height"]) == (100, 40)
+
+
+@pytest.mark.parametrize("decimation", [2, 3, 4])
+def test_decimated_mosaic_is_snapped_to_the_tile_grid(tmp_path, two_tiles, decimation):
+    tiles, mosaic = two_tiles
+    # The bounding box is not aligned on the decimated grid
+    bbox = _get_bbox(11, 5, 107, 47)
+
+    matrix, transform, meta = geotiff_lib.extract_boundingbox_into_matrix(
+        tiles, bbox, decimation=decimation, block_size=7
+    )
+
+    col_start, row_start = 11 // decimation, 5 // decimation
+    col_stop, row_stop = -(-107 // decimation), -(-47 // decimation)
+    assert matrix.shape == (1, row_stop - row_start, col_stop - col_start)
+    assert transform.a == pytest.approx(TILE_RES * decimation)
+    assert transform.c == pytest.approx(col_start * decimation * TILE_RES)
+    # Every output pixel is the mode of its decimation x decimation source pixels, on both sides of the seam
+    for row in range(matrix.shape[1]):
+        for col in range(matrix.shape[2]):
+            source = mosaic[
+                (row_start + row) * decimation : (row_start + row + 1) * decimation,
+                (col_start + col) * decimation : (col_start + col + 1) * decimation,
+            ]
+            assert matrix[0, row, col] in source
+
+
+def test_decimated_tiff_equals_the_decimated_matrix(tmp_path, two_tiles):
+    tiles, _ = two_tiles
+    bbox = _get_bbox(11, 5, 107, 47)
+    output_file = str(tmp_path / "output.tif")
+
+    geotiff_lib.extract_boundingbox_into_tiff(tiles, output_file, bbox, decimation=4)
+    matrix, _, _ = geotiff_lib.extract_boundingbox_into_matrix(tiles, bbox, decimation=4)
+
+    with rasterio.open(output_file) as src:
+        np.testing.assert_array_equal(src.read(), matrix)
+
+
+@pytest.mark.parametrize("profile", ["gtiff", "tiled", "cog"])
+def test_output_profiles(tmp_path, profile):
+    output_file = str(tmp_path / "output.tif")
+    data = np.kron(np.arange(16).reshape(4, 4), np.ones((200, 200))).astype(np.uint8)
+    meta = {
+        "driver": "GTiff",
+        "width": 800,
+        "height": 800,
+        "count": 1,
+        "dtype": "uint8",
+        "crs": "EPSG:4326",
+        "transform": rasterio.transform.from_origin(0, 0.1, TILE_RES, TILE_RES),
+    }
+    colormap = {value: (value, 0, 0, 255) for value in range(16)}
+
+    with geotiff_lib.open_output_geotiff(output_file, meta, profile, colormap) as dst:
+        dst.write(data, 1)
+
+    with rasterio.open(output_file) as src:
+        np.testing.assert_array_equal(src.read(1), data)
+        assert src.colormap(1)[3] == (3, 0, 0, 255)
+        if profile == "gtiff":
+            assert src.compression is None
+        else:
+            assert src.compression.value == "DEFLATE"
+            assert src.block_shapes == [(512, 512)]
+        if profile == "cog":
+            assert src.overviews(1)
+    # The temporary file of the COG is removed
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["output.tif"]
+
+
+def test_output_profile_predictor():
+    assert geotiff_lib.get_output_profile("tiled", "uint8")["predictor"] == 2
+    assert geotiff_lib.get_output_profile("tiled", "float32")["predictor"] == 3
+    assert geotiff_lib.get_output_profile({"compress": "lzw", "predictor": 1}, "uint8") == {
+        "driver": "GTiff",
+        "compress": "lzw",
+        "predictor": 1,
+    }
+    with pytest.raises(ValueError, match="Unknown output profile"):
+        geotiff_lib.get_output_profile("jpeg", "uint8")
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from sat_hub_lib.extension import GProx
+
+
+class _Product:
+    resolution = 10
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.geotiff_meta = {"crs": "EPSG:3857", "nodata": None}
+        self.geotiff_trasform = from_origin(0, 0, 10, 10)
+
+    def extract_bandmatrix(self):
+        return self.matrix[np.newaxis]
+
+
+@pytest.fixture
+def product():
+    rng = np.random.default_rng(0)
+    # Smooth classes so the compressed output is much smaller than the raw one
+    matrix = np.kron(rng.integers(0, 3, (30, 25)), np.ones((20, 20))).astype(np.uint8)
+    return _Product(matrix)
+
+
+def test_blocks_are_yielded_in_raster_order(product):
+    gprox = GProx(product, 50, value_map={1: 1}, tile_size=64, max_workers=4)
+
+    windows = [window for window, _ in gprox.iter_blocks(product.matrix)]
+
+    assert windows == [
+        (row_off, col_off)
+        for row_off in range(0, 600, 64)
+        for col_off in range(0, 500, 64)
+    ]
+
+
+@pytest.mark.parametrize("profile", [None, "tiled", "cog"])
+def test_tiled_write_equals_the_whole_write(tmp_path, product, profile):
+    # The same convolution method for both, so the uint8 truncation of the percentages is identical
+    kwargs = {"value_map": {1: 1}, "output_profile": profile, "convolution_method": "direct"}
+    whole = GProx(product, 50, **kwargs)
+    tiled = GProx(product, 50, tile_size=100, max_workers=4, **kwargs)
+    whole_file, tiled_file = tmp_path / "whole.tif", tmp_path / "tiled.tif"
+
+    whole.write_geotiff(str(whole_file))
+    tiled.write_geotiff(str(tiled_file))
+
+    with rasterio.open(whole_file) as expected, rasterio.open(tiled_file) as src:
+        np.testing.assert_array_equal(src.read(), expected.read())
+    # No block of the compressed outputs is written twice
+    assert tiled_file.stat().st_size <= whole_file.stat().st_size * 1.05
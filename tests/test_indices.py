@@ -0,0 +1,91 @@
+import math
+import numpy as np
+import pytest
+from sat_hub_lib.sentinel import NDVI, Landcover, S2Bands, indices
+
+
+def _evaluate_landcover(b03, b04, b08, b11, water, grass, trees, building):
+    # The evalscript of Landcover, pixel by pixel
+    ndvi = (b08 - b04) / (b08 + b04 + 0.00001)
+    ndwi = (b03 - b08) / (b03 + b08 + 0.00001)
+    ndbi = (b11 - b08) / (b11 + b08 + 0.00001)
+    if ndwi > water:
+        return 1
+    if ndvi > grass:
+        return 2 if ndvi > trees else 3
+    if ndvi < grass and ndbi > building:
+        return 0
+    return 6
+
+
+def _evaluate_ndvi(b04, b08):
+    # The evalscript of NDVI, Math.round and the UINT8 output
+    if b08 + b04 == 0:
+        return 0
+    ndvi = (b08 - b04) / (b08 + b04)
+    return min(max(math.floor(((ndvi + 0.5) / 1.5) * 150 + 0.5), 0), 255)
+
+
+@pytest.fixture
+def reflectances():
+    rng = np.random.default_rng(0)
+    dn = rng.integers(0, 10000, (4, 30, 30)).astype(np.uint16)
+    dn[:, 0, 0] = 0
+    return [indices.to_reflectance(band) for band in dn]
+
+
+def test_js_round_rounds_halves_up():
+    np.testing.assert_array_equal(
+        indices.js_round([-1.5, -0.5, 0.5, 1.5, 2.4999]), [-1, 0, 1, 2, 2]
+    )
+    np.testing.assert_array_equal(
+        indices.to_uint8([np.nan, -3, 254.5, 300]), [0, 0, 255, 255]
+    )
+
+
+def test_ndvi_matches_the_evalscript(reflectances):
+    _, b04, b08, _ = reflectances
+
+    matrix = indices.scale_ndvi(b04, b08)
+
+    expected = np.vectorize(_evaluate_ndvi)(b04, b08)
+    np.testing.assert_array_equal(matrix, expected)
+    assert matrix.dtype == np.uint8
+
+
+@pytest.mark.parametrize("thresholds", [(0.2, 0.3, 0.6, 0.16), (-0.1, 0.1, 0.2, -0.2)])
+def test_landcover_matches_the_evalscript(reflectances, thresholds):
+    matrix = indices.classify_landcover(*reflectances, *thresholds)
+
+    expected = np.vectorize(_evaluate_landcover)(*reflectances, *thresholds)
+    np.testing.assert_array_equal(matrix, expected)
+
+
+def test_reduce_scenes_ignores_the_invalid_scenes():
+    stack = np.array([[[1.0, np.nan]], [[3.0, np.nan]], [[np.nan, np.nan]], [[8.0, np.nan]]])
+
+    reduced = indices.reduce_scenes(stack, ("avg", "min", "max", "std", "p50"))
+
+    np.testing.assert_allclose(reduced[:, 0, 0], [4, 1, 8, np.std([1, 3, 8], ddof=1), 3])
+    assert np.isnan(reduced[:, 0, 1]).all()
+    assert reduced.dtype == np.float32
+    with pytest.raises(ValueError, match="Unknown statistic"):
+        indices.reduce_scenes(stack, ("median",))
+
+
+def test_products_share_one_fetch_of_the_bands(sentinel_conf, fake_client):
+    conf = sentinel_conf()
+    bands = S2Bands(conf)
+    ndvi, landcover = NDVI(conf, bands=bands), Landcover(conf, bands=bands)
+    client = fake_client(bands, ndvi, landcover)
+
+    ndvi_matrix = ndvi.extract_bandmatrix()
+    landcover_matrix = landcover.extract_bandmatrix()
+    # Changing a threshold costs no request
+    landcover.ndwi_threshold = -1
+    landcover.invalidate()
+
+    assert client.calls == 1
+    assert (landcover.extract_bandmatrix() == 1).all()
+    assert ndvi_matrix.shape == landcover_matrix.shape == (1,) + bands.extract_bandmatrix().shape[1:]
+    assert ndvi_matrix.dtype == landcover_matrix.dtype == np.uint8
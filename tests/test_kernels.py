@@ -0,0 +1,123 @@
+import os
+import numpy as np
+import pytest
+from scipy import signal
+from sat_hub_lib.extension import GProx, GProxBatch, kernels
+
+FUNCTIONS = ["1-(x/r)**o", "1", "exp(-(x/r)**2)"]
+# Square and rectangular pixels, the radii give odd and even kernels
+KERNELS = [
+    (function, meter_radius, resolution)
+    for function in FUNCTIONS
+    for meter_radius, resolution in [(30, 10), (25, 10), (200, 10), (150, (10, 15))]
+]
+# AOIs larger than, comparable to and smaller than the kernels
+SHAPES = [(120, 97), (21, 40), (7, 5), (1, 1), (3, 60)]
+
+
+class _Product:
+    def __init__(self, matrix, resolution):
+        self.matrix = matrix
+        self.resolution = resolution
+
+    def extract_bandmatrix(self):
+        return self.matrix[np.newaxis]
+
+
+@pytest.mark.parametrize("function, meter_radius, resolution", KERNELS)
+@pytest.mark.parametrize("shape", SHAPES)
+def test_window_sums_equal_the_convolution_of_ones(
+    function, meter_radius, resolution, shape
+):
+    kernel = kernels.get_kernel(function, meter_radius, 1, resolution)
+    expected = signal.fftconvolve(np.ones(shape), kernel, mode="same")
+
+    sums = kernels.get_window_sums(shape, function, meter_radius, 1, resolution)
+
+    assert sums.shape == shape
+    np.testing.assert_allclose(sums, expected, rtol=1e-10, atol=1e-10)
+
+
+@pytest.mark.parametrize("shape", [(120, 97), (7, 5)])
+def test_window_sums_of_a_block_equal_the_whole_ones(shape):
+    kernel = kernels.get_kernel("1-(x/r)**o", 200, 1, 10)
+    whole = kernels.kernel_window_sums(kernel, shape)
+    window = ((shape[0] // 3, shape[0] - 1), (1, shape[1] // 2 + 1))
+
+    block = kernels.kernel_window_sums(kernel, shape, window)
+
+    (row_start, row_stop), (col_start, col_stop) = window
+    np.testing.assert_array_equal(block, whole[row_start:row_stop, col_start:col_stop])
+
+
+@pytest.mark.parametrize("function, meter_radius, resolution", KERNELS[::2])
+@pytest.mark.parametrize("shape", [(120, 97), (7, 5)])
+def test_gprox_equals_the_two_convolutions(function, meter_radius, resolution, shape):
+    matrix = np.random.default_rng(0).integers(0, 4, shape).astype(np.uint8)
+    value_map = {1: 1, 2: 0.5}
+    gprox = GProx(
+        _Product(matrix, resolution),
+        meter_radius,
+        value_map=value_map,
+        function=function,
+        convolution_method="fft",
+    )
+
+    # The previous implementation, the denominator is the convolution of a matrix of ones
+    kernel = kernels.get_kernel(function, meter_radius, 1, resolution)
+    target_matrix = np.zeros(shape)
+    for value, target in value_map.items():
+        target_matrix[matrix == value] = target
+    target_counts = signal.fftconvolve(target_matrix, kernel, mode="same")
+    total_cells = signal.fftconvolve(np.ones(shape), kernel, mode="same")
+    expected = (
+        np.divide(
+            target_counts,
+            total_cells,
+            out=np.zeros_like(target_counts),
+            where=total_cells != 0,
+        )
+        * 100
+    )
+
+    np.testing.assert_allclose(gprox.extract_bandmatrix(), expected, atol=1e-9)
+
+
+def test_gprox_batch_shares_the_gprox_output_path_and_colormap():
+    product = _Product(np.zeros((4, 4), dtype=np.uint8), 10)
+    gprox = GProx(product, 30, value_map={1: 1})
+    batch = GProxBatch(product, [({1: 1}, 30)])
+
+    assert batch._get_colormap() == gprox._get_colormap()
+    assert os.path.basename(gprox.get_output_file_path(False)).startswith(
+        "GProx__Product_"
+    )
+    assert os.path.basename(batch.get_output_file_path(False)).startswith(
+        "GProxBatch__Product_"
+    )
+    assert batch._gen_output_filepath("out/gprox.tif") == "out/gprox.tif"
+
+
+def test_kernels_are_cached_read_only():
+    kernels.clear_cache()
+
+    kernel = kernels.get_kernel("1-(x/r)**o", 100, 1, 10)
+
+    assert kernels.get_kernel("1-(x/r)**o", 100, 1, 10) is kernel
+    assert kernels.get_kernel("1-(x/r)**o", 100, 2, 10) is not kernel
+    assert not kernel.flags.writeable
+    assert not kernels.get_window_sums((50, 40), "1-(x/r)**o", 100, 1, 10).flags.writeable
+    # The expression is compiled once for both kernels
+    assert kernels.compile_expression.cache_info().misses == 1
+    with pytest.raises(ValueError):
+        kernel[0, 0] = 1
+
+    kernels.clear_cache()
+    assert kernels.get_kernel("1-(x/r)**o", 100, 1, 10) is not kernel
+    np.testing.assert_array_equal(kernels.get_kernel("1-(x/r)**o", 100, 1, 10), kernel)
+
+
+def test_constant_expression_kernel():
+    kernel = kernels.get_kernel("1", 30, 1, 10)
+
+    np.testing.assert_array_equal(kernel, np.ones((7, 7)))
@@ -0,0 +1,40 @@
+import pytest
+from sat_hub_lib.sentinel import NDVI, RGB, S2Bands, STemp
+
+
+def test_stemp_costs_more_than_rgb(sentinel_conf):
+    conf = sentinel_conf()
+    rgb = RGB(conf).get_request_plan()
+
+    visualised = STemp(conf).get_request_plan()
+    statistics = STemp(conf, statistics=("avg", "max")).get_request_plan()
+
+    assert (visualised.width, visualised.height) == (rgb.width, rgb.height)
+    # 4 input bands on the 30 orbits of June, FLOAT32 doubles the cost
+    assert visualised.processing_units == pytest.approx(rgb.processing_units * 4 / 3 * 30)
+    assert statistics.processing_units == pytest.approx(visualised.processing_units * 2)
+
+
+def test_cost_grows_with_the_input_bands(sentinel_conf):
+    conf = sentinel_conf()
+
+    ndvi = NDVI(conf).get_request_plan()
+    bands = S2Bands(conf).get_request_plan()
+    all_bands = S2Bands(conf, bands=("B02", "B03", "B04", "B08", "B11", "B12")).get_request_plan()
+
+    assert ndvi.processing_units < bands.processing_units < all_bands.processing_units
+    assert all_bands.processing_units == pytest.approx(ndvi.processing_units * 3)
+
+
+def test_tiled_cost_is_the_sum_of_the_tiles(sentinel_conf):
+    conf = sentinel_conf(tiled=True)
+    product = STemp(conf, statistics=("avg",))
+    whole = product.get_request_plan()
+    product.max_resolution_allowed = 4
+
+    plan = product.get_request_plan()
+
+    assert plan.n_requests > 1
+    # Every tile costs at least the minimum area factor
+    assert plan.processing_units >= whole.processing_units
+
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import pytest
+import rasterio
+from sat_hub_lib.sentinel import NDVI, RGB, S2Bands
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_write_geotiff_to_default_path(
+    tmp_path, monkeypatch, sentinel_conf, fake_client, cache
+):
+    monkeypatch.chdir(tmp_path)
+    kwargs = {"cache_folder": str(tmp_path / "cache")} if cache else {}
+    product = NDVI(sentinel_conf(**kwargs))
+    fake_client(product)
+
+    product.write_geotiff()
+
+    output_file = product.get_output_file_path()
+    assert os.path.isfile(output_file)
+    with rasterio.open(output_file) as src:
+        assert src.read().shape == product.extract_bandmatrix().shape
+    # Nothing but the GeoTIFF is written to the output folder
+    assert os.listdir(os.path.dirname(output_file)) == [os.path.basename(output_file)]
+
+
+def test_tiled_responses_are_not_saved(
+    tmp_path, monkeypatch, sentinel_conf, fake_client
+):
+    monkeypatch.chdir(tmp_path)
+    product = NDVI(sentinel_conf(tiled=True))
+    product.max_resolution_allowed = 4
+    client = fake_client(product)
+
+    product.write_geotiff()
+
+    assert client.calls == len(product.get_request_plan().tiles) > 1
+    assert os.path.isfile(product.get_output_file_path())
+    assert os.listdir(tmp_path / "output") == [
+        os.path.basename(product.get_output_file_path())
+    ]
+
+
+@pytest.mark.parametrize("product_type", [NDVI, RGB, S2Bands])
+def test_band_matrix_is_writable_and_memoized(sentinel_conf, fake_client, product_type):
+    product = product_type(sentinel_conf())
+    client = fake_client(product)
+
+    matrix = product.extract_bandmatrix()
+    expected = matrix.copy()
+    matrix[:] = 0
+
+    np.testing.assert_array_equal(product.extract_bandmatrix(), expected)
+    assert client.calls == 1
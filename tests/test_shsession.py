@@ -0,0 +1,226 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from unittest import mock
+import pytest
+from sentinelhub import DownloadRequest, SHConfig
+from sentinelhub.constants import RequestType
+from sat_hub_lib.sentinel import shsession
+from sat_hub_lib.sentinel.shsession import SharedDownloadClient, SharedSession
+
+
+class _Timers:
+    """
+    Records the delays of the refreshes instead of starting the timers.
+    """
+
+    def __init__(self):
+        self.delays = []
+
+    def __call__(self, delay, function):
+        self.delays.append(delay)
+        return mock.Mock()
+
+
+@pytest.fixture
+def timers(monkeypatch):
+    timers = _Timers()
+    monkeypatch.setattr(shsession.threading, "Timer", timers)
+    return timers
+
+
+def _make_session(lifetime: float) -> SharedSession:
+    def collect(self):
+        return {"access_token": "token", "expires_at": time.time() + lifetime}
+
+    with mock.patch.object(SharedSession, "_collect_new_token", collect):
+        config = SHConfig()
+        config.sh_client_id, config.sh_client_secret = "id", "secret"
+        return SharedSession(config, refresh_before_expiry=120)
+
+
+def test_long_lived_token_is_refreshed_before_the_refresh_window(timers):
+    _make_session(3600)
+    assert timers.delays == [pytest.approx(3600 - 2 * 120, abs=1)]
+
+
+def test_short_lived_token_is_refreshed_half_way_to_the_window(timers):
+    _make_session(200)
+    assert timers.delays == [pytest.approx((200 - 120) / 2, abs=1)]
+    assert timers.delays[0] >= SharedSession.MIN_REFRESH_DELAY
+
+
+def test_too_short_lived_token_has_no_background_refresh(timers):
+    _make_session(130)
+    assert timers.delays == []
+
+
+def test_failed_refresh_is_retried_with_backoff(timers):
+    session = _make_session(3600)
+    with mock.patch.object(
+        SharedSession, "_collect_new_token", side_effect=ConnectionError("down")
+    ):
+        for _ in range(8):
+            session._refresh()
+    retries = timers.delays[1:]
+    assert retries == [5, 10, 20, 40, 80, 160, 300, 300]
+
+    with mock.patch.object(
+        SharedSession,
+        "_collect_new_token",
+        return_value={"access_token": "new", "expires_at": time.time() + 3600},
+    ):
+        session._refresh()
+    assert session.token["access_token"] == "new"
+    assert timers.delays[-1] == pytest.approx(3600 - 2 * 120, abs=1)
+
+
+def test_get_session_fetches_one_token_without_blocking_other_credentials(
+    timers, monkeypatch
+):
+    monkeypatch.setattr(shsession, "_sessions", {})
+    monkeypatch.setattr(shsession, "_session_locks", {})
+    release = threading.Event()
+    calls = []
+
+    def collect(self):
+        calls.append(self.config.sh_client_id)
+        if self.config.sh_client_id == "slow":
+            release.wait(5)
+        return {"access_token": "token", "expires_at": time.time() + 3600}
+
+    slow = shsession.get_config("slow", "secret")
+    fast = shsession.get_config("fast", "secret")
+    with mock.patch.object(SharedSession, "_collect_new_token", collect):
+        threads = [
+            threading.Thread(target=shsession.get_session, args=(slow,))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        # The slow token fetch does not block the sessions of other credentials
+        assert shsession.get_session(fast) is not None
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert calls.count("slow") == 1
+    assert calls.count("fast") == 1
+
+
+class _SentinelHubHandler(BaseHTTPRequestHandler):
+    """
+    Answers the token and process requests of a fake Sentinel Hub, the first token requests fail if asked to.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/oauth/token":
+            with self.server.lock:
+                self.server.token_requests += 1
+                fail = self.server.token_failures > 0
+                self.server.token_failures -= fail
+                token = f"token{self.server.token_requests}"
+            if fail:
+                self._reply(500, b"{}")
+            else:
+                body = {
+                    "access_token": token,
+                    "token_type": "Bearer",
+                    "expires_in": self.server.token_lifetime,
+                }
+                self._reply(200, json.dumps(body).encode())
+        else:
+            with self.server.lock:
+                self.server.authorizations.append(self.headers["Authorization"])
+            self._reply(200, b"tiff", "image/tiff")
+
+    def _reply(self, status: int, body: bytes, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sentinel_hub(monkeypatch):
+    # The fake server speaks plain http
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SentinelHubHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.token_requests = 0
+    server.token_failures = 0
+    server.token_lifetime = 3600
+    server.authorizations = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    config = SHConfig()
+    config.sh_client_id, config.sh_client_secret = "id", "secret"
+    config.sh_base_url, config.sh_token_url = url, f"{url}/oauth/token"
+    config.max_download_attempts, config.download_sleep_time = 1, 0
+    server.config = config
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_client_pools_its_connections(sentinel_hub):
+    session = SharedSession(sentinel_hub.config)
+    client = SharedDownloadClient(
+        config=sentinel_hub.config, session=session, max_pool_connections=4
+    )
+    requests = [
+        DownloadRequest(
+            url=f"{sentinel_hub.config.sh_base_url}/api/v1/process",
+            request_type=RequestType.POST,
+            post_values={"index": index},
+            use_session=True,
+        )
+        for index in range(40)
+    ]
+
+    try:
+        responses = client.download(requests, max_threads=4, decode_data=False)
+    finally:
+        session.close()
+
+    assert [response.content for response in responses] == [b"tiff"] * 40
+    assert sentinel_hub.authorizations == ["Bearer token1"] * 40
+    # One connection for the token, at most one per thread for the 40 requests
+    assert sentinel_hub.token_requests == 1
+    assert sentinel_hub.connections <= 1 + 4
+
+
+def test_failed_background_refresh_keeps_retrying(sentinel_hub, monkeypatch):
+    monkeypatch.setattr(SharedSession, "MIN_REFRESH_DELAY", 0.1)
+    monkeypatch.setattr(SharedSession, "RETRY_DELAY", 0.05)
+    monkeypatch.setattr(SharedSession, "MAX_RETRY_DELAY", 0.2)
+    sentinel_hub.token_lifetime = 1
+    session = SharedSession(sentinel_hub.config, refresh_before_expiry=0.2)
+    # The background refreshes fail three times before the server recovers
+    sentinel_hub.token_failures = 3
+
+    try:
+        deadline = time.time() + 10
+        while session._token["access_token"] == "token1" and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        session.close()
+
+    assert session._token["access_token"] == "token5"
+    assert session._failures == 0
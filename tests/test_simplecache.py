@@ -0,0 +1,263 @@
+import os
+import sqlite3
+import threading
+import time
+import boto3
+import botocore.exceptions
+import pytest
+from moto import mock_aws
+from sat_hub_lib.utils.simplecache import ResponseCache, S3BlockCache, S3Cache
+
+BUCKET = "tiles"
+TILE_SIZE = 1000
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="eu-central-1")
+        client.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+        )
+        for index in range(8):
+            client.put_object(Bucket=BUCKET, Key=f"k{index}", Body=b"x" * TILE_SIZE)
+        yield client
+
+
+def _make_cache(tmp_path, s3_client, max_bytes) -> S3Cache:
+    return S3Cache(
+        str(tmp_path / "cache"),
+        BUCKET,
+        "eu-central-1",
+        s3_client=s3_client,
+        max_bytes=max_bytes,
+        max_workers=4,
+    )
+
+
+def test_get_many_does_not_evict_its_own_batch(tmp_path, s3_client):
+    # The budget holds two tiles, the batch has four
+    cache = _make_cache(tmp_path, s3_client, 2 * TILE_SIZE)
+    keys = ["k1", "k2", "k3", "k4"]
+
+    results = cache.get_many(keys)
+
+    for key in keys:
+        assert results[key].ok
+        assert os.path.exists(results[key].local_filename)
+
+
+def test_unpinned_files_are_evicted_by_the_next_fill(tmp_path, s3_client):
+    cache = _make_cache(tmp_path, s3_client, 2 * TILE_SIZE)
+    cache.get_many(["k1", "k2", "k3", "k4"])
+
+    cache.get("k5")
+
+    assert cache.get_size() <= 2 * TILE_SIZE
+    assert os.path.exists(cache.get_local_filename("k5"))
+
+
+def test_pinned_files_survive_concurrent_fills(tmp_path, s3_client):
+    cache = _make_cache(tmp_path, s3_client, 2 * TILE_SIZE)
+    pinned = [cache.get_local_filename(key) for key in ("k0", "k1")]
+
+    with cache.pinned(pinned):
+        cache.get_many(["k0", "k1"])
+        threads = [
+            threading.Thread(target=cache.get, args=(f"k{index}",))
+            for index in range(2, 8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for filename in pinned:
+            assert os.path.exists(filename)
+
+
+def test_get_many_reports_files_evicted_by_another_process(
+    tmp_path, s3_client, monkeypatch
+):
+    cache = _make_cache(tmp_path, s3_client, None)
+    fetch = cache._fetch
+
+    def fetch_then_evict(key, local_filename):
+        hit = fetch(key, local_filename)
+        if key == "k1":
+            os.remove(local_filename)
+        return hit
+
+    monkeypatch.setattr(cache, "_fetch", fetch_then_evict)
+    results = cache.get_many(["k1", "k2"])
+
+    assert not results["k1"].ok
+    assert isinstance(results["k1"].error, FileNotFoundError)
+    assert results["k2"].ok
+
+
+def test_lock_files_are_deleted_with_their_files(tmp_path, s3_client):
+    cache = _make_cache(tmp_path, s3_client, 2 * TILE_SIZE)
+
+    for index in range(8):
+        cache.get(f"k{index}")
+
+    lock_folder = os.path.join(cache.cache_folder, cache.lock_folder)
+    assert sorted(os.listdir(lock_folder)) == ["k6.lock", "k7.lock"]
+    assert not [name for name in os.listdir(cache.cache_folder) if name.endswith(".lock")]
+
+
+def test_response_locks_are_deleted_with_their_responses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses"), max_bytes=2 * TILE_SIZE)
+    lock_folder = os.path.join(cache.cache_folder, cache.lock_folder)
+
+    for index in range(4):
+        cache.get(f"key{index}", lambda: b"x" * TILE_SIZE)
+
+    assert sorted(os.listdir(lock_folder)) == ["key2.lock", "key3.lock"]
+
+
+def test_expired_responses_and_their_locks_are_purged(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses"), ttl=60)
+    cache.get("old", lambda: b"old")
+    old_filename = os.path.join(cache.cache_folder, "old")
+    os.utime(old_filename, (time.time() - 120, time.time() - 120))
+
+    assert cache.get("new", lambda: b"new") == b"new"
+
+    assert not os.path.exists(old_filename)
+    assert os.listdir(os.path.join(cache.cache_folder, cache.lock_folder)) == [
+        "new.lock"
+    ]
+    assert cache.get("old", lambda: b"refetched") == b"refetched"
+
+
+BLOCK_SIZE = 100
+
+
+@pytest.fixture
+def block_cache(tmp_path, s3_client):
+    s3_client.put_object(Bucket=BUCKET, Key="cog.tif", Body=bytes(range(250)) * 4)
+    return S3BlockCache(
+        str(tmp_path / "blocks"),
+        BUCKET,
+        "eu-central-1",
+        block_size=BLOCK_SIZE,
+        s3_client=s3_client,
+    )
+
+
+def _count_index_transactions(monkeypatch, cache) -> list:
+    transactions = []
+    index = cache._index
+
+    def counted_index():
+        transactions.append(1)
+        return index()
+
+    monkeypatch.setattr(cache, "_index", counted_index)
+    return transactions
+
+
+def test_block_hits_are_recorded_once_per_file(block_cache, monkeypatch):
+    with block_cache.get("cog.tif") as f:
+        expected = f.read()
+    transactions = _count_index_transactions(monkeypatch, block_cache)
+
+    with block_cache.get("cog.tif") as f:
+        for offset in range(0, 1000, 10):
+            f.seek(offset)
+            assert f.read(150) == expected[offset : offset + 150]
+        # The size of the file is read from the index, the hits are not recorded yet
+        assert len(transactions) == 1
+
+    assert len(transactions) == 2
+    assert block_cache.stats.hits > 0
+    with sqlite3.connect(
+        os.path.join(block_cache.cache_folder, block_cache.index_filename)
+    ) as index:
+        assert index.execute("SELECT MIN(accesses) FROM entries").fetchone() == (2,)
+
+
+def test_block_fills_are_recorded_once_per_read(block_cache, monkeypatch):
+    f = block_cache.get("cog.tif")
+    transactions = _count_index_transactions(monkeypatch, block_cache)
+
+    assert len(f.read()) == 1000
+
+    assert len(transactions) == 1
+    assert block_cache.get_size() == 1000
+
+
+def test_file_sizes_are_stored_in_the_index(block_cache, monkeypatch):
+    block_cache.get("cog.tif").close()
+    calls = []
+    head_object = block_cache.s3_client.head_object
+    monkeypatch.setattr(
+        block_cache.s3_client,
+        "head_object",
+        lambda **kwargs: calls.append(kwargs) or head_object(**kwargs),
+    )
+
+    assert block_cache.get("cog.tif").size == 1000
+    assert calls == []
+    # No size file is stored outside of the index
+    assert not os.path.exists(block_cache.get_block_folder("cog.tif"))
+
+
+def test_get_many_downloads_the_missing_keys_concurrently(tmp_path, s3_client):
+    cache = _make_cache(tmp_path, s3_client, None)
+    keys = [f"k{index}" for index in range(8)]
+
+    first = cache.get_many(keys)
+    second = cache.get_many(keys)
+
+    for key in keys:
+        assert first[key].ok and not first[key].hit
+        assert second[key].ok and second[key].hit
+        assert os.path.getsize(first[key].local_filename) == TILE_SIZE
+    assert cache.stats.as_dict()["misses"] == 8
+    assert cache.stats.as_dict()["hits"] == 8
+
+
+def test_get_many_reports_a_missing_key(tmp_path, s3_client):
+    cache = _make_cache(tmp_path, s3_client, None)
+
+    results = cache.get_many(["k1", "missing", "k2"])
+
+    assert results["k1"].ok and results["k2"].ok
+    assert not results["missing"].ok
+    assert isinstance(results["missing"].error, botocore.exceptions.ClientError)
+    # No partial file is left behind
+    assert not os.path.exists(results["missing"].local_filename)
+    assert not [name for name in os.listdir(cache.cache_folder) if name.endswith(".part")]
+
+
+def test_racing_callers_download_a_key_once(tmp_path, s3_client, monkeypatch):
+    # Two caches on the same folder, like two processes sharing it
+    caches = [_make_cache(tmp_path, s3_client, None) for _ in range(2)]
+    downloads = []
+    download_file = s3_client.download_file
+
+    def slow_download_file(*args, **kwargs):
+        downloads.append(args[1])
+        time.sleep(0.2)
+        return download_file(*args, **kwargs)
+
+    monkeypatch.setattr(s3_client, "download_file", slow_download_file)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def get(cache):
+        barrier.wait()
+        results.append(cache.get_many(["k1"])["k1"])
+
+    threads = [threading.Thread(target=get, args=(cache,)) for cache in caches * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert downloads == ["k1"]
+    assert all(result.ok for result in results)
+    assert sorted(result.hit for result in results) == [False, True, True, True]
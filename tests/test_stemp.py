@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from conftest import make_tiff
+from sat_hub_lib.sentinel import STemp
+
+
+def _make_tiled_stemp(sentinel_conf) -> STemp:
+    product = STemp(sentinel_conf(tiled=True), statistics=("avg", "max"))
+    product.max_resolution_allowed = 4
+    plan = product.get_request_plan()
+    # Every tile sees its own number of orbits
+    contents = [
+        make_tiff(width, height, 1 + index % 3, "float32")
+        for index, (_, (_, _, width, height)) in enumerate(plan.tiles)
+    ]
+    product._set_raster(*product._mosaic_tiles(plan, contents))
+    return product
+
+
+def test_tiled_orbits_are_rejected(sentinel_conf):
+    product = _make_tiled_stemp(sentinel_conf)
+
+    with pytest.raises(ValueError, match="tiled"):
+        product.get_lst()
+
+
+def test_tiled_statistics_reduce_the_orbits_of_each_tile(sentinel_conf):
+    product = _make_tiled_stemp(sentinel_conf)
+    plan = product.get_request_plan()
+
+    matrix = product.extract_bandmatrix()
+
+    assert plan.n_requests > 1
+    assert matrix.shape == (2, plan.height, plan.width)
+    assert not np.isnan(matrix).any()
+
+
+def test_single_request_orbits(sentinel_conf):
+    product = STemp(sentinel_conf(tiled=True), statistics=("avg",))
+    plan = product.get_request_plan()
+    (_, (_, _, width, height)), = plan.tiles
+    product._set_raster(*product._decode_response(make_tiff(width, height, 3, "float32")))
+
+    assert product.get_lst().shape == (3, height, width)
@@ -0,0 +1,73 @@
+import pytest
+from sat_hub_lib.geotiff.s3 import esaworldcover, S3_EsaWorldCover
+from sat_hub_lib.utils.tileindex import TileIndex
+
+
+def _make_grid() -> dict:
+    """
+    A 3x3 degrees tile grid from 0 to 9 degrees, named like the ESA World Cover tiles.
+    """
+    features = []
+    for lat in range(0, 9, 3):
+        for lon in range(0, 9, 3):
+            ring = [[lon, lat], [lon + 3, lat], [lon + 3, lat + 3], [lon, lat + 3], [lon, lat]]
+            features.append(
+                {
+                    "type": "Feature",
+                    "properties": {"ll_tile": f"N{lat:02d}E{lon:03d}"},
+                    "geometry": {"type": "Polygon", "coordinates": [ring]},
+                }
+            )
+    return {"type": "FeatureCollection", "features": features}
+
+
+@pytest.mark.parametrize(
+    "bounds, expected",
+    [
+        ((1, 1, 2, 2), ["N00E000"]),
+        ((2, 1, 4, 2), ["N00E000", "N00E003"]),
+        ((4, 4, 5, 5), ["N03E003"]),
+        # Touching tiles are included
+        ((3, 3, 3.5, 3.5), ["N00E000", "N00E003", "N03E000", "N03E003"]),
+        ((-5, -5, -1, -1), []),
+        ((8, 8, 20, 20), ["N06E006"]),
+    ],
+)
+def test_query(bounds, expected):
+    index = TileIndex.from_geojson(_make_grid(), "ll_tile")
+
+    assert sorted(index.query(*bounds)) == expected
+
+
+def test_saved_index_is_loaded_unchanged(tmp_path):
+    index = TileIndex.from_geojson(_make_grid(), "ll_tile")
+    filename = str(tmp_path / "index.npz")
+
+    index.save(filename)
+    loaded = TileIndex.load(filename)
+
+    assert loaded.names.tolist() == index.names.tolist()
+    assert loaded.query(2, 1, 4, 5) == index.query(2, 1, 4, 5)
+
+
+def test_grid_is_indexed_once_per_cache_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(esaworldcover, "_tile_indexes", {})
+    grids = []
+
+    def get_gridgeojson(self):
+        grids.append(1)
+        return _make_grid()
+
+    monkeypatch.setattr(S3_EsaWorldCover, "_get_gridgeojson", get_gridgeojson)
+
+    def make_product(point1, point2):
+        return S3_EsaWorldCover(point1, point2, 2, cache_folder=str(tmp_path))
+
+    assert sorted(make_product((1, 3.5), (4, 4.5))._get_tile_names()) == ["N00E003", "N03E003"]
+    assert make_product((7, 7), (8, 8))._get_tile_names() == ["N06E006"]
+    assert grids == [1]
+
+    # Another process loads the persisted index instead of the grid
+    monkeypatch.setattr(esaworldcover, "_tile_indexes", {})
+    assert make_product((1, 1), (2, 2))._get_tile_names() == ["N00E000"]
+    assert grids == [1]
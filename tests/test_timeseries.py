@@ -0,0 +1,56 @@
+import pytest
+from sat_hub_lib.sentinel import NDVI, Landcover, TimeSeries
+from sat_hub_lib.sentinel import shsession
+
+
+@pytest.fixture
+def store_series(tmp_path, monkeypatch, sentinel_conf, fake_client):
+    """
+    Makes time series of the products stored in the same folder, fetched through a fake Sentinel Hub.
+    """
+    conf = sentinel_conf()
+    client = fake_client(NDVI(conf))
+    monkeypatch.setattr(shsession, "get_download_client", lambda config: client)
+
+    def make_series(product_type, conf=conf, **product_kwargs):
+        return TimeSeries(
+            product_type,
+            conf,
+            days=15,
+            store_folder=str(tmp_path / "store"),
+            **product_kwargs,
+        )
+
+    make_series.client = client
+    return make_series
+
+
+def test_store_reuses_the_slices_of_the_same_product(store_series):
+    slices, cube = store_series(Landcover, ndwi_threshold=0.3).fetch()
+    calls = store_series.client.calls
+
+    stored_slices, stored_cube = store_series(Landcover, ndwi_threshold=0.3).fetch()
+
+    assert store_series.client.calls == calls == len(slices)
+    assert stored_slices == slices
+    assert (stored_cube == cube).all()
+
+
+@pytest.mark.parametrize(
+    "product_type, product_kwargs",
+    [(NDVI, {}), (Landcover, {}), (Landcover, {"ndwi_threshold": 0.4})],
+)
+def test_store_rejects_the_slices_of_another_product(
+    store_series, product_type, product_kwargs
+):
+    store_series(Landcover, ndwi_threshold=0.3).fetch()
+
+    with pytest.raises(ValueError, match="another product"):
+        store_series(product_type, **product_kwargs)
+
+
+def test_store_rejects_another_cloud_coverage(store_series, sentinel_conf):
+    store_series(NDVI).fetch()
+
+    with pytest.raises(ValueError, match="another product"):
+        store_series(NDVI, conf=sentinel_conf(cloud_coverage=50))